@@ -3,5 +3,13 @@ import utilities
 import database.link
 import image
 import table
+import jobs
+import scheduler
+import asynchronous
+import instrument
+import texture
+import zernike
+import objects
+import intensity
 
-__all__ = [ "features", "utilities", "database.link", "image", "table" ]
+__all__ = [ "features", "utilities", "database.link", "image", "table", "jobs", "scheduler", "asynchronous", "instrument", "texture", "zernike", "objects", "intensity" ]
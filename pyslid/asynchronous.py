@@ -0,0 +1,296 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import Queue
+import sys
+import threading
+import pyslid.features
+import pyslid.utilities
+import pyslid.database.direct
+
+
+class Future(object):
+    """
+    Result of a call that runs in the background, as returned by the
+    Executor methods.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def _set(self, result, exc_info):
+        '''
+        Set the result or the exception of the call (Internal function)
+        '''
+        with self._condition:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._condition.notify_all()
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        """
+        @return True if the call has finished
+        """
+        with self._condition:
+            return self._done
+
+    def wait(self, timeout=None):
+        """
+        Wait for the call to finish
+        @param timeout (seconds, by default wait forever)
+        @return True if the call has finished
+        """
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            return self._done
+
+    def result(self, timeout=None):
+        """
+        Wait for the call to finish and return its result, or raise its exception
+        @param timeout (seconds, by default wait forever)
+        @return result of the call
+        """
+        if not self.wait(timeout):
+            raise RuntimeError('Timed out waiting for the result')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Wait for the call to finish and return its exception
+        @param timeout (seconds, by default wait forever)
+        @return exception raised by the call, or None
+        """
+        if not self.wait(timeout):
+            raise RuntimeError('Timed out waiting for the result')
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def addCallback(self, callback):
+        """
+        Call callback(future) when the call finishes, or now if it has already finished
+        @param callback (function)
+        """
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+
+def gather(futures, timeout=None):
+    """
+    Wait for several calls
+    @param futures (list of Future)
+    @param timeout (seconds for each call, by default wait forever)
+    @return list of results, in the same order as futures
+    """
+    return [future.result(timeout) for future in futures]
+
+
+class Executor(object):
+    """
+    Runs the blocking pyslid calls on a pool of threads, so many OMERO
+    requests can be in flight from a single thread. Each method submits a
+    call and returns a Future at once.
+
+    Gateways are not safe to share between threads, so every call takes a
+    connection from a utilities.SessionPool. Updates of the same ContentDB
+    are run one at a time because every update replaces the DB file.
+    """
+
+    def __init__(self, conn, workers=8, pool=None):
+        """
+        Start the threads
+        @param conn (Blitzgateway)
+        @param workers (number of threads)
+        @param pool (utilities.SessionPool. By default a pool of workers clients joined to the session of conn is used)
+        """
+        self.conn = conn
+        self._own_pool = pool is None
+        if pool is None:
+            pool = pyslid.utilities.SessionPool(conn, workers)
+        self.pool = pool
+        self._queue = Queue.Queue()
+        self._db_locks = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        '''
+        Thread main loop (Internal function)
+        '''
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            future, function, args, kwargs = task
+            try:
+                with self.pool.connection() as conn:
+                    result = function(conn, *args, **kwargs)
+            except:
+                future._set(None, sys.exc_info())
+            else:
+                future._set(result, None)
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Run function(conn, *args, **kwargs) on one of the threads
+        @param function (function that takes a Blitzgateway as first argument)
+        @return Future
+        """
+        future = Future()
+        self._queue.put((future, function, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stop the threads once the submitted calls have finished, and close their sessions
+        @param wait (True to wait for the threads)
+        """
+        for thread in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+            if self._own_pool:
+                self.pool.close()
+
+    def _dbLock(self, featureset, did):
+        '''
+        Lock for the updates of a ContentDB (Internal function)
+        '''
+        with self._lock:
+            return self._db_locks.setdefault((featureset, did),
+                                             threading.Lock())
+
+    def _locked(self, function, featureset, did):
+        '''
+        Wrap function so it holds the lock of a ContentDB (Internal function)
+        '''
+        lock = self._dbLock(featureset, did)
+        def locked(conn, *args, **kwargs):
+            with lock:
+                return function(conn, *args, **kwargs)
+        return locked
+
+    def hasTable(self, iid, featureset="slf33", field=True, rid=None):
+        """
+        Background features.hasTable
+        @return Future
+        """
+        return self.submit(pyslid.features.hasTable, iid, featureset, field,
+                           rid)
+
+    def get(self, option, iid, scale=None, set="slf33", field=True, rid=None,
+            pixels=0, channel=0, zslice=0, timepoint=0):
+        """
+        Background features.get. The 'table' option is not supported, as the table would belong to the session of a thread.
+        @return Future
+        """
+        if option == 'table':
+            raise ValueError("The 'table' option is not supported")
+        return self.submit(pyslid.features.get, option, iid, scale, set,
+                           field, rid, pixels, channel, zslice, timepoint)
+
+    def link(self, iid, scale, fids, features, set, field=True, rid=None,
+             pixels=0, channel=0, zslice=0, timepoint=0):
+        """
+        Background features.link
+        @return Future
+        """
+        return self.submit(pyslid.features.link, iid, scale, fids, features,
+                           set, field, rid, pixels, channel, zslice,
+                           timepoint)
+
+    def linkBatch(self, iid, scale, fids, features, set, field=True,
+                  rid=None, pixels=[0], channels=[0], zslices=[0],
+                  timepoints=[0]):
+        """
+        Background features.linkBatch
+        @return Future
+        """
+        return self.submit(pyslid.features.linkBatch, iid, scale, fids,
+                           features, set, field, rid, pixels, channels,
+                           zslices, timepoints)
+
+    def getPlane(self, iid, pixels=0, channel=0, zslice=0, timepoint=0):
+        """
+        Background utilities.getPlane
+        @return Future
+        """
+        return self.submit(pyslid.utilities.getPlane, iid, pixels, channel,
+                           zslice, timepoint)
+
+    def retrieve(self, featureset, did=None, features=None):
+        """
+        Background database.direct.retrieve
+        @return Future
+        """
+        return self.submit(pyslid.database.direct.retrieve, featureset, did,
+                           features)
+
+    def update(self, server, username, scale, iid, pixels, channel, zslice,
+               timepoint, feature_ids, features, featureset, did=None):
+        """
+        Background database.direct.update
+        @return Future
+        """
+        return self.submit(
+            self._locked(pyslid.database.direct.update, featureset, did),
+            server, username, scale, iid, pixels, channel, zslice, timepoint,
+            feature_ids, features, featureset, did)
+
+    def updateDataset(self, server, username, scale, iid, pixels, channel,
+                      zslice, timepoint, feature_ids, features, featureset,
+                      did=None):
+        """
+        Background database.direct.updateDataset
+        @return Future
+        """
+        return self.submit(
+            self._locked(pyslid.database.direct.updateDataset, featureset,
+                         did),
+            server, username, scale, iid, pixels, channel, zslice, timepoint,
+            feature_ids, features, featureset, did)
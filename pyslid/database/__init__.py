@@ -1,4 +1,5 @@
 import link
 import direct
+import content
 
-__all__ = [ "link", "direct" ]
+__all__ = [ "link", "direct", "content" ]
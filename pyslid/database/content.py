@@ -0,0 +1,584 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import numpy
+
+# Number of leading (non-feature) values in a legacy ContentDB row
+# 0:IND 1:server 2:username 3:metadata 4:image 5:render,
+#   6:iid 7:pixels 8:channel 9:zslice 10:timepoint 11:features ....
+NUM_ROW_KEYS = 11
+
+def metadataURL(server, iid):
+    '''
+    URL of the metadata page of an image
+    '''
+    return str(server)+'/webclient/metadata_details/image/'+str(iid)
+
+def imageURL(server, iid):
+    '''
+    URL of the webclient page of an image
+    '''
+    return str(server)+'/webclient/?show=image-' + str(iid)
+
+def renderURL(server, iid):
+    '''
+    URL of the image viewer page of an image
+    '''
+    return str(server)+'/webclient/img_detail/' + str(iid)
+
+class ContentDB(object):
+    """
+    Array-backed image-content DB for a single scale.
+
+    Feature vectors are held in a 2D array (one row per image plane) and the
+    key columns (INDEX, iid, pixels, channel, zslice, timepoint) in integer
+    arrays. The server and username columns are stored as integer codes into
+    the servers and usernames lists, and the webclient URLs are derived from
+    the server and iid when needed.
+
+    The object can be used wherever the legacy list of rows is expected:
+    len(), iteration and indexing return rows in the legacy layout
+    [IND,server,username,metadata,image,render,iid,pixels,channel,zslice,timepoint,...]
+    built on demand.
+
+    Rows can be filtered on the key columns with select(), which uses sorted
+    indexes of the columns that are built on first use and kept until the
+    DB is modified.
+
+    The count, mean, variance, minimum and maximum of every feature are
+    updated as rows are appended (merging the statistics of each block of
+    rows with Welford/Chan's method), so getStats() and zscore() never need
+    a pass over the DB.
+
+    Appended rows are written into buffers whose capacity doubles when they
+    are full, and the columns are views of the filled part of the buffers,
+    so building a DB one row at a time takes linear time. Unlike
+    list.append, append() takes the key columns and the features as
+    separate arguments; rows() returns the legacy list of rows.
+    """
+
+    KEYS = ['iid', 'pixels', 'channel', 'zslice', 'timepoint']
+
+    def __init__(self, feature_ids=None, dtype=numpy.float64):
+        """
+        Create an empty ContentDB
+        @param feature_ids (id list for features)
+        @param dtype (numpy type used to store the features)
+        """
+        if feature_ids is None:
+            feature_ids = []
+        self.feature_ids = [str(fid) for fid in feature_ids]
+        self.servers = []
+        self.usernames = []
+
+        self.index = numpy.zeros(0, dtype=numpy.int64)
+        self.server = numpy.zeros(0, dtype=numpy.int32)
+        self.username = numpy.zeros(0, dtype=numpy.int32)
+        for key in self.KEYS:
+            setattr(self, key, numpy.zeros(0, dtype=numpy.int64))
+        self.features = numpy.zeros((0, len(self.feature_ids)), dtype=dtype)
+
+        # column name -> (argsort of the column, sorted column)
+        self._indexes = {}
+
+        # column name -> buffer the column is a view of (see _grow)
+        self._buffers = {}
+
+        # source DB -> (file id of its table, INDEX of the last row copied
+        # from it) (see direct.sync)
+        self.watermarks = {}
+
+        self._resetStats()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # indexes are rebuilt when needed, and only the filled part of the
+        # buffers is saved
+        state.pop('_indexes', None)
+        state.pop('_buffers', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._indexes = {}
+        self._buffers = {}
+        if 'watermarks' not in state:
+            self.watermarks = {}
+        if 'mean' not in state:
+            # saved before the statistics were kept with the DB
+            self._resetStats()
+            self._addStats(self.features)
+
+    def _resetStats(self):
+        '''
+        Reset the per-feature statistics (Internal function)
+        '''
+        num_feat = len(self.feature_ids)
+        self.count = numpy.zeros(num_feat, dtype=numpy.int64)
+        self.mean = numpy.zeros(num_feat)
+        self.m2 = numpy.zeros(num_feat)
+        self.minimum = numpy.empty(num_feat)
+        self.minimum.fill(numpy.inf)
+        self.maximum = numpy.empty(num_feat)
+        self.maximum.fill(-numpy.inf)
+
+    def _addStats(self, features):
+        '''
+        Merge the statistics of a block of feature vectors into the running
+        per-feature statistics. Non-finite values are ignored (Internal function)
+        '''
+        if features.shape[0] == 0:
+            return
+
+        finite = numpy.isfinite(features)
+        count = finite.sum(axis=0)
+        values = numpy.where(finite, features, 0.0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            mean = numpy.where(count > 0, values.sum(axis=0) / count, 0.0)
+            m2 = (numpy.where(finite, features - mean, 0.0) ** 2).sum(axis=0)
+
+            total = self.count + count
+            delta = mean - self.mean
+            self.mean = numpy.where(
+                total > 0, self.mean + delta * count / total, 0.0)
+            self.m2 = self.m2 + m2 + numpy.where(
+                total > 0, delta ** 2 * self.count * count / total, 0.0)
+        self.count = total
+
+        self.minimum = numpy.minimum(
+            self.minimum, numpy.where(finite, features, numpy.inf).min(axis=0))
+        self.maximum = numpy.maximum(
+            self.maximum, numpy.where(finite, features, -numpy.inf).max(axis=0))
+
+    def getStats(self):
+        """
+        Get the per-feature statistics of the DB
+        @return dictionary with the 'feature_ids' and the 'count', 'mean', 'var' (population variance),
+                'std', 'min' and 'max' arrays with one value per feature
+        """
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            var = numpy.where(self.count > 0, self.m2 / self.count, 0.0)
+        stats = {
+            'feature_ids': list(self.feature_ids),
+            'count': self.count.copy(),
+            'mean': self.mean.copy(),
+            'var': var,
+            'std': numpy.sqrt(var),
+            'min': self.minimum.copy(),
+            'max': self.maximum.copy(),
+            }
+        return stats
+
+    def zscore(self, features=None):
+        """
+        Normalize feature vectors to zero mean and unit variance using the DB statistics.
+        Features with no variance are only centered.
+        @param features (feature vector or feature vector array. By default the features of the DB)
+        @return normalized features
+        """
+        if features is None:
+            features = self.features
+        stats = self.getStats()
+        std = numpy.where(stats['std'] > 0, stats['std'], 1.0)
+        return (numpy.asarray(features, dtype=numpy.float64) - stats['mean']) / std
+
+    @classmethod
+    def fromRows(cls, rows, feature_ids=None, dtype=numpy.float64):
+        """
+        Create a ContentDB from a list of rows in the legacy layout
+        @param rows (list of data lists)
+        @param feature_ids (id list for features)
+        @param dtype (numpy type used to store the features)
+        @return ContentDB
+        """
+        rows = list(rows)
+        if feature_ids is None:
+            if rows:
+                num_feat = len(rows[0]) - NUM_ROW_KEYS
+            else:
+                num_feat = 0
+            feature_ids = ['feature' + str(i) for i in range(num_feat)]
+
+        db = cls(feature_ids, dtype)
+        if not rows:
+            return db
+
+        cols = zip(*rows)
+        db.append(cols[1], cols[2], cols[6], cols[7], cols[8], cols[9],
+                  cols[10], [row[NUM_ROW_KEYS:] for row in rows],
+                  index=cols[0])
+        return db
+
+    def _codes(self, table, values):
+        '''
+        Convert strings to codes into table, adding new strings (Internal function)
+        '''
+        if isinstance(values, basestring):
+            values = [values]
+        codes = numpy.empty(len(values), dtype=numpy.int32)
+        lookup = dict((v, i) for i, v in enumerate(table))
+        for i, value in enumerate(values):
+            value = str(value)
+            if value not in lookup:
+                lookup[value] = len(table)
+                table.append(value)
+            codes[i] = lookup[value]
+        return codes
+
+    def _newRows(self, server, username, iid, pixels, channel, zslice,
+                 timepoint, features, index, first):
+        '''
+        Convert the arguments of append and fill to a dictionary of key
+        columns and a feature array. Without an index, the rows are numbered
+        from first (Internal function)
+        '''
+        features = numpy.asarray(features, dtype=self.features.dtype)
+        if features.ndim == 1:
+            features = features.reshape(1, -1)
+        num_rows = features.shape[0]
+        if features.shape[1] != len(self.feature_ids):
+            raise ValueError('Expected %d features, got %d' % (
+                len(self.feature_ids), features.shape[1]))
+
+        def column(values, dtype):
+            values = numpy.asarray(values, dtype=dtype).ravel()
+            if values.size == 1:
+                values = numpy.repeat(values, num_rows)
+            if values.size != num_rows:
+                raise ValueError('Expected %d values, got %d' % (
+                    num_rows, values.size))
+            return values
+
+        if index is None:
+            index = numpy.arange(first, first + num_rows)
+
+        new = {
+            'index': column(index, numpy.int64),
+            'server': column(self._codes(self.servers, server), numpy.int32),
+            'username': column(self._codes(self.usernames, username),
+                               numpy.int32),
+            }
+        for key, values in zip(self.KEYS,
+                               [iid, pixels, channel, zslice, timepoint]):
+            new[key] = column(values, numpy.int64)
+
+        return new, features
+
+    def append(self, server, username, iid, pixels, channel, zslice,
+               timepoint, features, index=None):
+        """
+        Append one or more feature vectors.
+        All the key arguments can either be scalars or arrays with one value per row.
+        @param server (server name)
+        @param username (user name)
+        @param iid (image id)
+        @param pixels (pixels index)
+        @param channel (channel index)
+        @param zslice (zslice index)
+        @param timepoint (timpoint index)
+        @param features (feature vector, or feature vector array)
+        @param index (INDEX values. By default rows are numbered from the end of the DB)
+        @return number of rows added
+        """
+        new, features = self._newRows(server, username, iid, pixels, channel,
+                                      zslice, timepoint, features, index,
+                                      len(self) + 1)
+        new['features'] = features
+
+        start = len(self)
+        stop = start + features.shape[0]
+        for key, values in new.items():
+            buf = self._grow(key, stop)
+            buf[start:stop] = values
+            setattr(self, key, buf[:stop])
+        self._indexes = {}
+        self._addStats(features)
+
+        return features.shape[0]
+
+    def _grow(self, key, num_rows):
+        '''
+        Buffer of a column with room for num_rows rows. The buffer is
+        reallocated, with at least twice the rows of the DB, when it is full or
+        when the column is no longer a view of it (Internal function)
+        '''
+        column = getattr(self, key)
+        buf = self._buffers.get(key)
+        if (buf is not None and column.base is buf and len(buf) >= num_rows
+                and column.ctypes.data == buf.ctypes.data
+                and column.shape[1:] == buf.shape[1:]):
+            return buf
+
+        size = len(column)
+        buf = numpy.empty((max(num_rows, 2 * size),) + column.shape[1:],
+                          dtype=column.dtype)
+        buf[:size] = column
+        self._buffers[key] = buf
+        return buf
+
+    @classmethod
+    def allocate(cls, feature_ids, num_rows, dtype=numpy.float64):
+        """
+        Create a ContentDB with a fixed number of rows, to be filled in with fill().
+        This avoids growing the arrays when the size of the DB is known in advance.
+        @param feature_ids (id list for features)
+        @param num_rows (number of rows)
+        @param dtype (numpy type used to store the features)
+        @return ContentDB
+        """
+        db = cls(feature_ids, dtype)
+        for key in ['index', 'server', 'username'] + cls.KEYS:
+            setattr(db, key, numpy.zeros(num_rows, dtype=getattr(db, key).dtype))
+        db.features = numpy.zeros((num_rows, len(db.feature_ids)), dtype=dtype)
+        return db
+
+    def fill(self, start, server, username, iid, pixels, channel, zslice,
+             timepoint, features, index=None):
+        """
+        Set a block of rows of a DB created with allocate(). Every row should be set once.
+        @param start (position of the first row of the block)
+        @param server, username, iid, pixels, channel, zslice, timepoint, features (as in append)
+        @param index (INDEX values. By default rows are numbered by their position)
+        @return number of rows set
+        """
+        new, features = self._newRows(server, username, iid, pixels, channel,
+                                      zslice, timepoint, features, index,
+                                      start + 1)
+        stop = start + features.shape[0]
+        if start < 0 or stop > len(self):
+            raise ValueError('Rows %d:%d out of range' % (start, stop))
+
+        for key, values in new.items():
+            getattr(self, key)[start:stop] = values
+        self.features[start:stop] = features
+        self._indexes = {}
+        self._addStats(features)
+
+        return features.shape[0]
+
+    def take(self, positions):
+        """
+        Create a new ContentDB from a subset of rows
+        @param positions (row positions, or boolean mask)
+        @return ContentDB
+        """
+        db = ContentDB(self.feature_ids, self.features.dtype)
+        db.servers = list(self.servers)
+        db.usernames = list(self.usernames)
+        for key in ['index', 'server', 'username'] + self.KEYS:
+            setattr(db, key, getattr(self, key)[positions])
+        db.features = self.features[positions]
+        db.watermarks = dict(self.watermarks)
+        db._addStats(db.features)
+        return db
+
+    def project(self, feature_ids):
+        """
+        Create a new ContentDB with a subset of the features. If the features are
+        contiguous columns of the DB, in the same order, the feature array of the new
+        DB is a view of the feature array of the DB, otherwise it is a copy.
+        @param feature_ids (id list of the features to keep, in the order they should be returned)
+        @return ContentDB
+        """
+        lookup = dict((fid, i) for i, fid in enumerate(self.feature_ids))
+        cols = []
+        for fid in feature_ids:
+            if str(fid) not in lookup:
+                raise ValueError('Unknown feature id: %s' % fid)
+            cols.append(lookup[str(fid)])
+
+        db = ContentDB([self.feature_ids[c] for c in cols], self.features.dtype)
+        db.servers = list(self.servers)
+        db.usernames = list(self.usernames)
+        for key in ['index', 'server', 'username'] + self.KEYS:
+            setattr(db, key, getattr(self, key).copy())
+        if cols and cols == range(cols[0], cols[0] + len(cols)):
+            db.features = self.features[:, cols[0]:cols[0] + len(cols)]
+        else:
+            db.features = self.features[:, cols]
+        db.watermarks = dict(self.watermarks)
+        for key in ['count', 'mean', 'm2', 'minimum', 'maximum']:
+            setattr(db, key, getattr(self, key)[cols])
+        return db
+
+    def findLatest(self):
+        """
+        Find the most recent row for every image plane, that is for every
+        unique (server, iid, pixels, channel, zslice, timepoint).
+        @return row positions (in ascending order)
+        """
+        num_rows = len(self)
+        keys = numpy.column_stack(
+            [self.server] + [getattr(self, key) for key in self.KEYS])
+
+        # sort by plane, then by position, so the latest row of each plane
+        # is the last of its group
+        order = numpy.lexsort(
+            [numpy.arange(num_rows)] + [keys[:, i] for i in
+                                        reversed(range(keys.shape[1]))])
+        keys = keys[order]
+        last = numpy.ones(num_rows, dtype=bool)
+        last[:-1] = (keys[1:] != keys[:-1]).any(axis=1)
+        return numpy.sort(order[last])
+
+    def renumber(self):
+        """
+        Renumber the INDEX column from 1
+        """
+        self.index = numpy.arange(1, len(self) + 1, dtype=numpy.int64)
+        self._indexes.pop('index', None)
+
+    def _lookup(self, key, values):
+        '''
+        Row positions where a key column takes any of the values (Internal function)
+        '''
+        if key == 'server' or key == 'username':
+            # strings are matched through their codes
+            table = dict((v, i) for i, v in enumerate(getattr(self, key + 's')))
+            values = [table[str(v)] for v in values if str(v) in table]
+
+        if key not in self._indexes:
+            column = getattr(self, key)
+            order = numpy.argsort(column, kind='mergesort')
+            self._indexes[key] = (order, column[order])
+        order, sorted_column = self._indexes[key]
+
+        values = numpy.asarray(values, dtype=sorted_column.dtype)
+        lo = numpy.searchsorted(sorted_column, values, 'left')
+        hi = numpy.searchsorted(sorted_column, values, 'right')
+        positions = [order[l:h] for l, h in zip(lo, hi)]
+        if not positions:
+            return numpy.zeros(0, dtype=order.dtype)
+        return numpy.unique(numpy.concatenate(positions))
+
+    def select(self, **filters):
+        """
+        Find the rows that match all the given filters without scanning the DB.
+        Filters are given as column=value, or as column_in=list of values, for the
+        columns server, username, iid, pixels, channel, zslice and timepoint, e.g.
+            db.select(channel=0, username='user', iid_in=[1, 2, 3])
+        @return row positions (in ascending order, can be passed to take())
+        """
+        result = None
+        for name, value in filters.items():
+            if name.endswith('_in'):
+                key = name[:-3]
+                values = list(value)
+            else:
+                key = name
+                values = [value]
+            if key not in ['server', 'username'] + self.KEYS:
+                raise ValueError('Unknown filter: %s' % name)
+
+            positions = self._lookup(key, values)
+            if result is None:
+                result = positions
+            else:
+                result = numpy.intersect1d(result, positions, assume_unique=True)
+
+        if result is None:
+            return numpy.arange(len(self))
+        return result
+
+    def getServer(self, i):
+        '''
+        Server name of row i
+        '''
+        return self.servers[self.server[i]]
+
+    def getUsername(self, i):
+        '''
+        User name of row i
+        '''
+        return self.usernames[self.username[i]]
+
+    def getMetadataURL(self, i):
+        '''
+        URL of the metadata page of the image in row i
+        '''
+        return metadataURL(self.getServer(i), self.iid[i])
+
+    def getImageURL(self, i):
+        '''
+        URL of the webclient page of the image in row i
+        '''
+        return imageURL(self.getServer(i), self.iid[i])
+
+    def getRenderURL(self, i):
+        '''
+        URL of the image viewer page of the image in row i
+        '''
+        return renderURL(self.getServer(i), self.iid[i])
+
+    def row(self, i):
+        """
+        Get a row in the legacy layout
+        @param i (row position)
+        @return row [IND,server,username,metadata,image,render,iid,pixels,channel,zslice,timepoint,...]
+        """
+        server = self.getServer(i)
+        iid = long(self.iid[i])
+        tup = [long(self.index[i]), server, self.getUsername(i),
+               metadataURL(server, iid), imageURL(server, iid),
+               renderURL(server, iid), iid]
+        for key in self.KEYS[1:]:
+            tup.append(long(getattr(self, key)[i]))
+        tup.extend(self.features[i].tolist())
+        return tup
+
+    def rows(self):
+        """
+        Get all rows in the legacy layout
+        @return list of data lists
+        """
+        return [self.row(i) for i in xrange(len(self))]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.row(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(n) for n in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('ContentDB row out of range')
+        return self.row(i)
+
+    def nbytes(self):
+        """
+        Memory used by the arrays of the DB
+        @return number of bytes
+        """
+        total = self.features.nbytes
+        for key in ['index', 'server', 'username'] + self.KEYS:
+            total += getattr(self, key).nbytes
+        return total
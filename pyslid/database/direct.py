@@ -36,13 +36,33 @@ import omero
 from omero.gateway import BlitzGateway
 import pyslid.features
 import pyslid.utilities
+import pyslid.jobs
+from content import ContentDB, NUM_ROW_KEYS
+import link
 import copy
 import pickle
+import threading
+import itertools
+import time
+from multiprocessing.pool import ThreadPool
+import numpy
 from os.path import exists, join
 import os
 
 NUM_DIGIT_COUNT = 20
 
+# Chunk sizes used by retrieveRemote
+FIRST_CHUNK_ROWS = 1000
+MIN_CHUNK_ROWS = 100
+MAX_CHUNK_BYTES = 32 * 1024 * 1024
+READ_SECONDS = 1.0
+
+# Client-side cache of the ContentDB name tags, keyed by
+# (group id, dataset id, featureset). Each entry holds the current DB file
+# name, the tagAnnotation that points to it and the (inode, mtime) of the
+# DB file, which is used to check the entry is still valid.
+_NAME_CACHE = {}
+
 def set_contentdb_path(contentdb_path):
     """
     Set the OMERO_CONTENTDB_PATH, used to store the ContentDB files
@@ -74,6 +94,130 @@ def getCurrentGroupId(conn):
         gid = conn.getEventContext().groupId
     return gid
 
+def _nameKey(conn, featureset, did):
+    '''
+    Key used for the name tag cache (Internal function)
+    '''
+    if did is not None:
+        did = long(did)
+    return (getCurrentGroupId(conn), did, str(featureset))
+
+def _nextName(DBName):
+    '''
+    Get the DB file name for the next round (Internal function)
+    '''
+    COUNT_old = DBName.split('.')[0].split('_')[-1]
+    COUNT_num = long(COUNT_old)
+    COUNT_num += 1
+    num_digit = len(str(COUNT_num))
+    num_zeros = NUM_DIGIT_COUNT - num_digit
+
+    COUNT_new = ""
+    for i in range(num_zeros):
+        COUNT_new +="0"
+    COUNT_new += str(COUNT_num)
+    return DBName.replace(COUNT_old, COUNT_new)
+
+def _fileStamp(DBName):
+    '''
+    Identity of a DB file used to revalidate the name tag cache, or None if
+    the file does not exist (Internal function)
+    '''
+    try:
+        st = os.stat(join(OMERO_CONTENTDB_PATH, DBName))
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime)
+
+def clearNameCache():
+    """
+    Forget all the cached image-content DB names, so the next lookup for
+    every featureset queries OMERO again.
+    """
+    _NAME_CACHE.clear()
+
+def _legacyFeatureIds(conn, rows, featureset):
+    '''
+    Feature ids of a DB saved as a list of rows, which doesn't record them. They are read
+    from the feature table of the image of the first row, or are the ids of the featureset.
+    None if neither matches the number of features of the rows (Internal function)
+    '''
+    if len(rows) == 0:
+        return None
+    num_feat = len(rows[0]) - NUM_ROW_KEYS
+    try:
+        table = pyslid.features.get(conn, 'table', long(rows[0][6]), None, featureset)
+        try:
+            feature_ids = [col.name for col in table.getHeaders()][5:]
+        finally:
+            table.close()
+        if len(feature_ids) == num_feat:
+            return feature_ids
+    except Exception:
+        pass
+    try:
+        feature_ids = pyslid.features.getIds(featureset)
+        if len(feature_ids) == num_feat:
+            return feature_ids
+    except Exception:
+        pass
+    return None
+
+def _getContentDB(Data, scale, feature_ids=None, conn=None):
+    '''
+    Get the ContentDB of a scale, creating it if needed and converting DBs
+    saved as a list of rows. If feature_ids isn't given, the feature ids of
+    converted DBs are looked up with conn (Internal function)
+    '''
+    if scale not in Data:
+        Data[scale] = ContentDB(feature_ids)
+    elif not isinstance(Data[scale], ContentDB):
+        if feature_ids is None and conn is not None:
+            feature_ids = _legacyFeatureIds(conn, Data[scale], Data.get('info'))
+        Data[scale] = ContentDB.fromRows(Data[scale], feature_ids)
+    return Data[scale]
+
+def _checkFeatures(db, features):
+    '''
+    Error message if a feature vector array doesn't have the number of
+    features of the DB, None otherwise (Internal function)
+    '''
+    for f in features:
+        if len(f) != len(db.feature_ids):
+            return "Expected %d features, got %d" % (len(db.feature_ids), len(f))
+    return None
+
+def _statsPath(path):
+    '''
+    Path of the file that holds the per-feature statistics of a DB file (Internal function)
+    '''
+    return path[:-len('.pkl')] + '_stats.pkl'
+
+def _saveDB(Data, path):
+    '''
+    Save a DB file, and the statistics of its scales in a small file next to it, so
+    getStats doesn't need to load the feature arrays (Internal function)
+    '''
+    output = open(path, 'wb')
+    pickle.dump(Data, output, pickle.HIGHEST_PROTOCOL)
+    output.close()
+
+    stats = {}
+    for scale, db in Data.items():
+        if isinstance(db, ContentDB):
+            stats[scale] = db.getStats()
+    output = open(_statsPath(path), 'wb')
+    pickle.dump(stats, output, pickle.HIGHEST_PROTOCOL)
+    output.close()
+
+def _removeDB(path):
+    '''
+    Remove a DB file and its statistics file (Internal function)
+    '''
+    os.remove(path)
+    if exists(_statsPath(path)):
+        os.remove(_statsPath(path))
+
 def search_file(filename, search_path):
    """Given a search path, find file
    """
@@ -125,6 +269,9 @@ def initializeNameTag(conn, featureset, did=None):
     conn.getUpdateService().saveObject(
         flink, conn.SERVICE_OPTS)   # update the link
 
+    # the DB file is written after the tag, so its stamp is taken later
+    _NAME_CACHE[_nameKey(conn, featureset, did)] = (DBName, tag, None)
+
     return NameSpace, DBName
 
 def updateNameTag(conn, tag, DBName_new):
@@ -141,7 +288,14 @@ def updateNameTag(conn, tag, DBName_new):
     # change the DBName
     tag.setTextValue(omero.rtypes.RStringI(DBName_new))
     # update the tag
-    conn.getUpdateService().saveObject(tag, conn.SERVICE_OPTS)
+    tag_new = conn.getUpdateService().saveAndReturnObject(
+        tag, conn.SERVICE_OPTS)
+
+    # keep the cached entries pointing at this tag up to date
+    tid = tag.getId().getValue()
+    for key, (DBName, cached_tag, stamp) in _NAME_CACHE.items():
+        if cached_tag.getId().getValue() == tid:
+            _NAME_CACHE[key] = (DBName_new, tag_new, _fileStamp(DBName_new))
 
     return True
 
@@ -177,6 +331,8 @@ def deleteNameTag(conn, featureset, did=None):
     query_string = "select ann from ExperimenterGroupAnnotationLink as grl join grl.child as ann where grl.parent.id = :gid and ann.ns=:namesp"
     results_tag = query.findAllByQuery(query_string, params, conn.SERVICE_OPTS)
 
+    _NAME_CACHE.pop(_nameKey(conn, featureset, did), None)
+
     try:
         for result in results_link:
             conn.getUpdateService().deleteObject(result, conn.SERVICE_OPTS)
@@ -187,19 +343,33 @@ def deleteNameTag(conn, featureset, did=None):
     except:
         return False
     
-def getRecentName(conn, featureset, did=None):
+def getRecentName(conn, featureset, did=None, refresh=False):
     """
     Retreive the most recent public (entire) image-content DB file name for a specific featureset.
     This function retrieves the DB file name from a tagAnnotation in the ExperimenterGroup (Collaborative).
+    The name is cached on the client, and the cached name is used as long as the DB file it points
+    to is still the same file in OMERO_CONTENTDB_PATH (every update writes a new file and removes the old one).
     @param conn (Blitzgateway)
     @param featureset (featureset name)
     @param did (Dataset ID. If did is specified, this function will retrieve the partircular DB that is attached to the dataset. Otherwise it will retrieve the general DB that includes all datasets)
+    @param refresh (True to ignore the cached name and query OMERO)
     @return DBName (DB file name)
     @return DBName_next (DB file name for the next round)
     @return tag (tagAnnotation)
     
     """
-    groupid = getCurrentGroupId(conn)
+    key = _nameKey(conn, featureset, did)
+
+    if not refresh and key in _NAME_CACHE:
+        DBName, tag, stamp = _NAME_CACHE[key]
+        current = _fileStamp(DBName)
+        if current is not None and stamp in (None, current):
+            _NAME_CACHE[key] = (DBName, tag, current)
+            return DBName, _nextName(DBName), tag
+        # the DB was replaced by someone else, ask OMERO again
+        del _NAME_CACHE[key]
+
+    groupid = key[0]
     
     #create query service
     query = conn.getQueryService()
@@ -225,17 +395,8 @@ def getRecentName(conn, featureset, did=None):
         DBName = result.getTextValue().getValue()
 
         # get the next DBName
-        COUNT_old = DBName.split('.')[0].split('_')[-1]
-        COUNT_num = long(COUNT_old)
-        COUNT_num += 1
-        num_digit = len(str(COUNT_num))
-        num_zeros = NUM_DIGIT_COUNT - num_digit
-
-        COUNT_new = ""
-        for i in range(num_zeros):
-            COUNT_new +="0"
-        COUNT_new += str(COUNT_num)
-        DBName_next=DBName.replace(COUNT_old, COUNT_new)
+        DBName_next = _nextName(DBName)
+        _NAME_CACHE[key] = (DBName, result, _fileStamp(DBName))
     
     return DBName, DBName_next, result
 
@@ -292,7 +453,7 @@ def deleteTableLink(conn, featureset, did=None):
     else:
         import os
         try:
-            os.remove(result)
+            _removeDB(result)
             deleteNameTag(conn, featureset, did)
             return True
         except:
@@ -343,19 +504,32 @@ def initialize(conn, feature_ids, featureset, did=None):
         NS, DBfilename = initializeNameTag(conn, featureset, did)
 
         fullpath = OMERO_CONTENTDB_PATH + DBfilename
-        output = open(fullpath, 'wb')
-
         Data={'info': featureset}
-        pickle.dump(Data, output)
-        output.close()
+        _saveDB(Data, fullpath)
             
         return True
     except:
         return False
     
-def updatePerDataset(conn, server, username, dataset_id_list, featureset, field=True, did=None):
+def _readImageRows(conn, iid, featureset, field):
+    '''
+    Read all the feature vectors in the feature table of an image (Internal function)
+    @return feature ids (None if the image has no table)
+    @return rows ([pixels, channel, zslice, timepoint, scale, features...] lists)
+    '''
+    try:
+        ids, feats = pyslid.features.get(conn, 'vector', iid, None, featureset, field)
+    except pyslid.utilities.PyslidException:
+        # no image or no feature table
+        return None, []
+    return ids, feats
+
+def updatePerDataset(conn, server, username, dataset_id_list, featureset, field=True, did=None,
+                     sessions=4, perDataset=True, progress=None, ledger=None, pool=None):
     """
     Update the DB for given dataset list. Firstly retrieve OMERO.tables from each image in the dataset and add the data onto the DB.
+    The feature tables are read by a pool of threads, each with its own connection, and the rows are added
+    to the DB of their scale with one updateDataset call per scale.
     @param conn (Blitzgateway)
     @param server (server name)
     @param username (user name)
@@ -363,8 +537,13 @@ def updatePerDataset(conn, server, username, dataset_id_list, featureset, field=
     @param featureset (featureset name)
     @param field (True if the featureset is for field-level features)
     @param did (Dataset ID. If did is specified, this function will retrieve the partircular DB that is attached to the dataset. Otherwise it will retrieve the general DB that includes all datasets)
+    @param sessions (number of threads/sessions used to read the feature tables. If it is 1, conn is used)
+    @param pool (utilities.SessionPool used by the threads. By default a pool of clients joined to the session of conn is used)
+    @param perDataset (True to update the DB after each dataset, False to update it once after all datasets)
+    @param progress (function called as progress(done, total, did) after the tables of each image have been read)
+    @param ledger (pyslid.jobs.Ledger. If it is given, the images are marked as done once their rows are saved,
+                   and the images that are already done are skipped without querying the server)
     @return answer (True if it is successfuly saved)
-    @return Message (Error Message)
     """ 
     # check the existence of the DB with DBfilename
     answer, result = has(conn, featureset, did)
@@ -374,51 +553,184 @@ def updatePerDataset(conn, server, username, dataset_id_list, featureset, field=
         initialize(conn, feature_ids, featureset, did)
         answer, result = has(conn, featureset, did)
 
-    if answer is True:
-        # update image by image
-        for DID in dataset_id_list:
-            print 'starting dataset: '+str(DID)
-            ds = conn.getObject("Dataset", long(DID))
-            img_gen = ds.getChildLinks()
-
-
-            IID = []
-            PIXELS = []
-            CHANNEL = []
-            ZSLICE = []
-            TIMEPOINT = []
-            FEATURE_IDS =''
-            features_array = []
-            for im in img_gen:
-                iid = long(im.getId())
-                
-                print iid
-                answer2, result =pyslid.features.hasTable(conn, iid, featureset, field)
-                if answer2:
-                    scales=pyslid.features.getScales(conn, iid, featureset, field)
-                    scale=scales[0]
-#                    scale=0.645
-                    [ids, feats] = pyslid.features.get(conn, 'vector', iid, scale, featureset, field)
-                    if len(ids) == 0:
-                        print str(iid)+' has wrong table'
-                    else:
-                        IID.append(long(iid))
-                        for feat in feats:
-                            PIXELS.append(long(feat[0]))
-                            CHANNEL.append(long(feat[1]))
-                            ZSLICE.append(long(feat[2]))
-                            TIMEPOINT.append(long(feat[3]))
-                            FEATURE_IDS = list(ids[5:])
-                            features_array.append(list(feat[5:]))
-
-
-            updateDataset(conn, server, username, IID, PIXELS, CHANNEL, ZSLICE, TIMEPOINT, FEATURE_IDS, features_array, featureset, did)
+    if answer is False:
+        return False
 
-        return True
+    if ledger is not None:
+        job = 'updatePerDataset:%s:%s:%s' % (featureset, field, did)
+        done = set(ledger.getItems(job, pyslid.jobs.DONE))
+
+    # images of every dataset
+    images = []
+    for DID in dataset_id_list:
+        ds = conn.getObject("Dataset", long(DID))
+        if ds is None:
+            print 'Unable to retrieve dataset: '+str(DID)
+            continue
+        iids = [long(im.getId()) for im in ds.listChildren()]
+        if ledger is not None:
+            ledger.add(job, iids)
+            iids = [iid for iid in iids if str(iid) not in done]
+        images.append((DID, iids))
+    total = sum(len(iids) for DID, iids in images)
+
+    def read(iid):
+        try:
+            if sessions > 1:
+                with sessionPool.connection() as c:
+                    ids, feats = _readImageRows(c, iid, featureset, field)
+            else:
+                ids, feats = _readImageRows(conn, iid, featureset, field)
+            if ids is None:
+                return iid, ids, feats, 'No feature table'
+            return iid, ids, feats, None
+        except Exception as e:
+            print 'Unable to read the feature table of image %d: %s' % (iid, e)
+            return iid, None, [], str(e)
+
+    # rows for each scale, and the images they come from
+    ROWS = {}
+    READ = []
+    def write():
+        ok = True
+        failed = set()
+        for scale in sorted(ROWS.keys()):
+            R = ROWS[scale]
+            answer2, Message = updateDataset(
+                conn, server, username, scale, R['iid'], R['pixels'], R['channel'],
+                R['zslice'], R['timepoint'], R['feature_ids'], R['features'],
+                featureset, did)
+            if not answer2:
+                print 'Unable to update the DB: ' + Message
+                ok = False
+                failed.update(R['iid'])
+                if ledger is not None:
+                    ledger.markFailed(job, sorted(set(R['iid'])), Message)
+        if ledger is not None:
+            ledger.markDone(job, [iid for iid in READ if iid not in failed])
+        ROWS.clear()
+        del READ[:]
+        return ok
+
+    own_pool = sessions > 1 and pool is None
+    sessionPool = pool
+    if own_pool:
+        sessionPool = pyslid.utilities.SessionPool(conn, sessions, keepalive=0)
+    if sessions > 1:
+        threads = ThreadPool(sessions)
+        imap = threads.imap_unordered
     else:
-        return False
+        threads = None
+        imap = itertools.imap
+
+    ok = True
+    count = 0
+    try:
+        for DID, iids in images:
+            print 'starting dataset: '+str(DID)
+            for iid, ids, feats, error in imap(read, iids):
+                count += 1
+                if ids is not None and len(ids) == 0:
+                    print str(iid)+' has wrong table'
+                    error = 'Wrong feature table'
+                if error is not None:
+                    if ledger is not None:
+                        ledger.markFailed(job, [iid], error)
+                else:
+                    READ.append(iid)
+                    for feat in feats:
+                        R = ROWS.setdefault(float(feat[4]), {
+                            'iid': [], 'pixels': [], 'channel': [], 'zslice': [],
+                            'timepoint': [], 'features': [],
+                            'feature_ids': list(ids[5:])})
+                        R['iid'].append(long(iid))
+                        R['pixels'].append(long(feat[0]))
+                        R['channel'].append(long(feat[1]))
+                        R['zslice'].append(long(feat[2]))
+                        R['timepoint'].append(long(feat[3]))
+                        R['features'].append(list(feat[5:]))
+                if progress is not None:
+                    progress(count, total, DID)
+            if perDataset:
+                ok = write() and ok
+        ok = write() and ok
+    finally:
+        if threads is not None:
+            threads.close()
+            threads.join()
+        if own_pool:
+            sessionPool.close()
+
+    return ok
+
+def ingest(conn, server, username, scale, iids, featureset, channels=None,
+           field=True, pixels=0, zslice=0, timepoint=0, batch_size=100, did=None):
+    """
+    Calculate the features of a list of images and save them both in the feature table of each
+    image (pyslid.features.linkBatch) and in the DB, so the feature tables don't have to be
+    read back to update the DB. Rows are added to the DB in batches of batch_size rows.
+    @param conn (Blitzgateway)
+    @param server (server name)
+    @param username (user name)
+    @param scale (image feature scale parameter)
+    @param iids (list of image ids)
+    @param featureset (featureset name)
+    @param channels (list of the channel lists used for each feature vector, e.g. [[0], [1]]. By default the features are calculated on every channel of the image)
+    @param field (True if the featureset is for field-level features)
+    @param pixels (pixels index)
+    @param zslice (zslice index)
+    @param timepoint (timpoint index)
+    @param batch_size (number of feature vectors added to the DB at once)
+    @param did (Dataset ID. If did is specified, this function will retrieve the partircular DB that is attached to the dataset. Otherwise it will retrieve the general DB that includes all datasets)
+    @return num_rows (number of feature vectors added to the DB)
+    @return failed (list of the image ids that could not be processed)
+    """
+
+    batch = {'iid': [], 'pixels': [], 'channel': [], 'zslice': [],
+             'timepoint': [], 'features': [], 'feature_ids': None}
+    state = {'num_rows': 0, 'failed': []}
+
+    def flush():
+        if len(batch['iid']) == 0:
+            return
+        answer, Message = updateDataset(
+            conn, server, username, scale, batch['iid'], batch['pixels'],
+            batch['channel'], batch['zslice'], batch['timepoint'],
+            batch['feature_ids'], batch['features'], featureset, did)
+        if answer:
+            state['num_rows'] += len(batch['iid'])
+        else:
+            print 'Unable to update the DB: ' + Message
+            state['failed'].extend(sorted(set(batch['iid'])))
+        for key in ['iid', 'pixels', 'channel', 'zslice', 'timepoint', 'features']:
+            batch[key] = []
+
+    for iid in iids:
+        iid = long(iid)
+        try:
+            [ids, feats, chans] = pyslid.features.clinkChannels(
+                conn, iid, scale, featureset, field, channels, pixels, zslice,
+                timepoint)
+        except Exception as e:
+            print 'Unable to calculate or link features of image %d: %s' % (iid, e)
+            state['failed'].append(iid)
+            continue
+
+        if batch['feature_ids'] is None:
+            batch['feature_ids'] = list(ids)
+        for chan, values in zip(chans, feats):
+            batch['iid'].append(iid)
+            batch['pixels'].append(pixels)
+            batch['channel'].append(chan)
+            batch['zslice'].append(zslice)
+            batch['timepoint'].append(timepoint)
+            batch['features'].append(values)
+        if len(batch['iid']) >= batch_size:
+            flush()
+
+    flush()
+    return state['num_rows'], state['failed']
 
-    
 def update(conn, server, username, scale,
            iid, pixels, channel, zslice, timepoint,
            feature_ids, features, featureset, did=None):
@@ -455,9 +767,10 @@ def update(conn, server, username, scale,
         Data = pickle.load(pkl_file)
         pkl_file.close()
 
-        if scale not in Data:
-            Data[scale] = []
-        num_data = len(Data[scale])
+        db = _getContentDB(Data, scale, feature_ids)
+        Message = _checkFeatures(db, [features])
+        if Message is not None:
+            return False, Message
 
 
         # 1. get the DB file name and tag
@@ -465,29 +778,12 @@ def update(conn, server, username, scale,
 
 
         # 2. update the table2 with new input data
-        IND = num_data + 1
-        tup = []
-        tup.append( long(IND) )   #INDEX
-        tup.append( str(server) )
-        tup.append( str(username) )
-        tup.append( str(server)+'/webclient/metadata_details/image/'+str(iid))
-        tup.append( str(server)+'/webclient/?show=image-' + str(iid))
-        tup.append( str(server)+'/webclient/img_detail/' + str(iid))
-        tup.append( long(iid ) )
-        tup.append( long(pixels) )
-        tup.append( long(channel) ) 
-        tup.append( long(zslice) )  
-        tup.append( long(timepoint) )
-        for j in range(9, len(feature_ids)+9):
-           tup.append( float(features[j-9]) )
-
-        Data[scale].append(tup)
+        db.append(server, username, iid, pixels, channel, zslice, timepoint,
+                  features)
 
         # 3. save it with the new DB file name
         fullpath = OMERO_CONTENTDB_PATH + DBfilename_new
-        output = open(fullpath, 'wb')
-        pickle.dump(Data, output)
-        output.close()
+        _saveDB(Data, fullpath)
 
         # 4. up date the tag with a new file name
         Answer = updateNameTag(conn, tag, DBfilename_new)
@@ -495,7 +791,7 @@ def update(conn, server, username, scale,
         # 5. delete the previous one
         import os
         try:
-            os.remove(result)
+            _removeDB(result)
         except:
             return False, "Couldn't remove the previous contentDB file"
 
@@ -543,9 +839,10 @@ def updateDataset(conn, server, username, scale,
         Data = pickle.load(pkl_file)
         pkl_file.close()
 
-        if scale not in Data:
-            Data[scale] = []
-        num_data = len(Data[scale])
+        db = _getContentDB(Data, scale, feature_ids)
+        Message = _checkFeatures(db, features)
+        if Message is not None:
+            return False, Message
         
 
         # 1. get the DB file name and tag
@@ -553,31 +850,13 @@ def updateDataset(conn, server, username, scale,
         
 
         # 2. update the table2 with new input data
-        num_rows = len(iid)
-        for i in range(num_rows):
-            IND = num_data + i + 1
-            tup=[] # tuple (one row)
-            tup.append( long(IND) )   #INDEX
-            tup.append( str(server) )
-            tup.append( str(username) )
-            tup.append( str(server)+'/webclient/metadata_details/image/'+str(iid[i]))
-            tup.append( str(server)+'/webclient/?show=image-' + str(iid[i]))
-            tup.append( str(server)+'/webclient/img_detail/' + str(iid[i]))
-            tup.append( long(iid[i]) )   
-            tup.append( long(pixels[i]) )
-            tup.append( long(channel[i]) ) 
-            tup.append( long(zslice[i]) )  
-            tup.append( long(timepoint[i]) )
-            for j in range(9, len(feature_ids)+9):
-               tup.append( float(features[i][j-9]) )
-
-            Data[scale].append(tup)
+        if len(iid) > 0:
+            db.append(server, username, iid, pixels, channel, zslice,
+                      timepoint, features)
 
         # 3. save it with the new DB file name
         fullpath = OMERO_CONTENTDB_PATH + DBfilename_new
-        output = open(fullpath, 'wb')
-        pickle.dump(Data, output)
-        output.close()
+        _saveDB(Data, fullpath)
 
         # 4. update the tag with a new file name
         Answer = updateNameTag(conn, tag, DBfilename_new)
@@ -585,7 +864,7 @@ def updateDataset(conn, server, username, scale,
         # 5. delete the previous one
         import os
         try:
-            os.remove(result)
+            _removeDB(result)
         except:
             return False, "Couldn't remove the previous contentDB file"
         
@@ -603,7 +882,7 @@ def chunks(l, n):
     '''
     return [l[i:i+n] for i in range(0, len(l), n)]
 
-def retrieve(conn, featureset, did=None):
+def retrieve(conn, featureset, did=None, features=None, normalize=False):
     """
     Retrieve a DB object(HDF5 file) from OMERO server
     This function is using omero.client object. Thus this function cannot be called from OMERO.web directly.
@@ -611,10 +890,17 @@ def retrieve(conn, featureset, did=None):
     @param conn (Blitzgateway)
     @param featureset (featureset name)
     @param did (Dataset ID. If did is specified, this function will retrieve the partircular DB that is attached to the dataset. Otherwise it will retrieve the general DB that includes all datasets
-    @return data (list of data lists) [ [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
-                                        [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
-                                        [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
+    @param features (id list of the features to return. By default all the features are returned)
+    @param normalize (True to return the features normalized to zero mean and unit variance with ContentDB.zscore.
+                      The statistics of each ContentDB are still those of the stored features, so query
+                      vectors can be normalized the same way with its zscore method)
+    @return data (dictionary with the featureset name under 'info' and a ContentDB for each scale.
+                  Each ContentDB can be read as a list of data lists (len, iteration and indexing)
+                                      [ [IND,server,username,metadata,image,render,iid,pixels,channel,zslice,timepoint,...],
+                                        [IND,server,username,metadata,image,render,iid,pixels,channel,zslice,timepoint,...],
                                         ...]
+                  but it is not a list: callers that modify the rows, or call list methods such as
+                  append with a row, should use ContentDB.rows() to get the list)
     @return Message (Error Message)
     """
     
@@ -626,60 +912,267 @@ def retrieve(conn, featureset, did=None):
         Data = pickle.load(pkl_file)
         pkl_file.close()
         Message = "Good"
+
+        if features is not None:
+            # keep only the requested feature columns of every scale
+            try:
+                for scale in Data.keys():
+                    if scale != 'info':
+                        Data[scale] = _getContentDB(Data, scale, conn=conn).project(
+                            features)
+            except ValueError as e:
+                Data = []
+                Message = str(e)
+
+        if normalize and Data:
+            for scale in Data.keys():
+                if scale != 'info':
+                    db = _getContentDB(Data, scale, conn=conn)
+                    db.features = db.zscore()
     else:
         Message = "There is no table for the featureset"
 
     return Data, Message
 
-def retrieveRemote(conn_local, conn_remote, featureset, did=None):
+def getStats(conn, featureset, scale, did=None):
     """
-    Retrieve a DB object(HDF5 file) from remote OMERO server
-    Also, this function splits the table-reading process for fast reading (from OMERO 4.3.3)
+    Get the per-feature statistics (count, mean, variance, min and max) of the DB for a scale.
+    The statistics are kept up to date by update, updateDataset, sync and removeDuplicates, and
+    are saved in a small file next to the DB file, so they are read without loading the DB.
     @param conn (Blitzgateway)
     @param featureset (featureset name)
+    @param scale (image feature scale parameter)
     @param did (Dataset ID. If did is specified, this function will retrieve the partircular DB that is attached to the dataset. Otherwise it will retrieve the general DB that includes all datasets
-    @return data (list of data lists) [ [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
-                                        [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
-                                        [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
-                                        ...]
+    @return stats (dictionary with the 'feature_ids' and the 'count', 'mean', 'var', 'std', 'min' and 'max' arrays)
     @return Message (Error Message)
     """
-    
+
+    answer, result = has(conn, featureset, did)
+    if answer is False:
+        return None, "There is no table for the featureset"
+
+    # result is the absolute path of the DB file
+    if exists(_statsPath(result)):
+        pkl_file = open(_statsPath(result), 'rb')
+        stats = pickle.load(pkl_file)
+        pkl_file.close()
+        if scale in stats:
+            return stats[scale], "Good"
+
+    # DBs saved without a statistics file, or scales saved as lists of rows
+    pkl_file = open(result, 'rb')
+    Data = pickle.load(pkl_file)
+    pkl_file.close()
+
+    if scale not in Data:
+        return None, "No entries for the request scale"
+
+    stats = _getContentDB(Data, scale, conn=conn).getStats()
+    return stats, "Good"
+
+def retrieveRemote(conn_local, conn_remote, featureset, did=None, sessions=4, pool=None):
+    """
+    Retrieve a DB object(HDF5 file) from remote OMERO server
+    The table is read in row chunks by several sessions at the same time. The chunk size is
+    adapted to the observed read time and the chunks are written into a ContentDB as they arrive
+    @param conn_local (Blitzgateway, not used, kept for compatibility)
+    @param conn_remote (Blitzgateway connected to the remote server)
+    @param featureset (featureset name)
+    @param did (Dataset ID. If did is specified, this function will retrieve the partircular DB that is attached to the dataset. Otherwise it will retrieve the general DB that includes all datasets
+    @param sessions (number of sessions used to read the table)
+    @param pool (utilities.SessionPool for the remote server. By default a pool of clients joined to the session of conn_remote is used)
+    @return data (ContentDB) [ [IND,server,username,metadata,image,render,iid,pixels,channel,zslice,timepoint,...],
+                               ...]
+    @return Message (Error Message)
+    """
+
     data = []
-    
+
     try:
-        answer, result = has(conn_remote, featureset, did)
-        if answer == True:
-            fid = result.getId().getValue()            
+        answer, result = link.has(conn_remote, featureset, did)
+    except:
+        return data, "Not Done Correctly"
+    if answer == False:
+        return data, "There is no table for the featureset"
+
+    fid = result.getId().getValue()
+    try:
+        table = conn_remote.getSharedResources().openTable( omero.model.OriginalFileI( fid, False ) )
+        headers = table.getHeaders()
+        num_row = table.getNumberOfRows()
+        table.close()
+    except:
+        return data, "Not Done Correctly"
+
+    col_numbers = range(len(headers))
+    feature_ids = [col.name for col in headers[link.NUM_KEY_COLUMNS:]]
+    data = ContentDB.allocate(feature_ids, num_row)
+
+    # Rows are handed out from a shared cursor. The chunk size aims for
+    # READ_SECONDS per read, within the row and memory limits
+    max_rows = max(MIN_CHUNK_ROWS, MAX_CHUNK_BYTES / (8 * len(col_numbers)))
+    state = {'start': 0, 'chunk': min(FIRST_CHUNK_ROWS, max_rows), 'errors': []}
+    lock = threading.Lock()
+
+    def nextChunk():
+        with lock:
+            if state['errors'] or state['start'] >= num_row:
+                return None, None
+            start = state['start']
+            stop = min(start + state['chunk'], num_row)
+            state['start'] = stop
+            return start, stop
+
+    def adaptChunk(rows, seconds):
+        with lock:
+            rate = rows / max(seconds, 1e-3)
+            target = int(0.5 * state['chunk'] + 0.5 * rate * READ_SECONDS)
+            state['chunk'] = max(MIN_CHUNK_ROWS, min(target, max_rows))
+
+    def worker():
+        conn = None
+        table = None
+        failed = False
+        try:
+            conn = pool.acquire()
             table = conn.getSharedResources().openTable( omero.model.OriginalFileI( fid, False ) )
+            while True:
+                start, stop = nextChunk()
+                if start is None:
+                    break
+                t0 = time.time()
+                cols = [numpy.asarray(col.values) for col in table.read(col_numbers, start, stop).columns]
+                adaptChunk(stop - start, time.time() - t0)
+
+                if feature_ids:
+                    features = numpy.column_stack(cols[link.NUM_KEY_COLUMNS:])
+                else:
+                    features = numpy.zeros((stop - start, 0))
+                with lock:
+                    data.fill(start, cols[1], cols[2], cols[3], cols[4], cols[5],
+                              cols[6], cols[7], features, index=cols[0])
+        except Exception, e:
+            failed = True
+            with lock:
+                state['errors'].append(e)
+        finally:
+            if table is not None:
+                table.close()
+            if conn is not None:
+                pool.release(conn, failed)
+
+    own_pool = pool is None
+    if own_pool:
+        pool = pyslid.utilities.SessionPool(conn_remote, sessions, keepalive=0)
+    threads = [threading.Thread(target=worker) for i in range(max(1, min(sessions, num_row)))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if own_pool:
+            pool.close()
 
-            num_col = len(table.getHeaders())
-            num_row = table.getNumberOfRows()
+    if state['errors']:
+        return [], "Not Done Correctly"
 
-            chunk_col = chunks(range(num_col), 100) # read every 100 columns
-            chunk_row = chunks(range(num_row), 1000) # read every 1000 columns
-            
-            data = []
-            for row in range(len(chunk_row)):
-                temp_col = []
-                for col in range(len(chunk_col)):
-                    values = table.read(chunk_col[col], chunk_row[row][0], chunk_row[row][-1]+1)
-                    values = values.columns
-                    for cols in values:
-                        column_value_list = cols.values
-                        temp_col.append(list(column_value_list))
-                temp_col = zip(*temp_col)
-                for r in temp_col:
-                    data.append(r)
+    return data, "Good"
 
-            table.close()
-            Message = "Good"
-        else:
-            Message = "There is no table for the featureset"
+def _syncKey(conn, featureset, did):
+    '''
+    Name of an OMERO.tables DB used to store its sync watermark (Internal function)
+    '''
+    gid = conn.getGroupFromContext().getId()
+    return '%s:%s_%s_%s' % (conn.host, gid, did if did is not None else 'all', featureset)
+
+def sync(conn, featureset, scale, did=None, conn_remote=None):
+    """
+    Append to the DB of a scale the rows added to the OMERO.tables DB (database.link) since the last sync.
+    The file id of the table and the INDEX of the last row copied are saved with the DB as a
+    watermark, so only the newer rows are read from the table. If the table has been replaced,
+    e.g. by link.initialize, all its rows are copied. The rows are numbered as they are appended
+    to the DB.
+    @param conn (Blitzgateway)
+    @param featureset (featureset name)
+    @param scale (image feature scale parameter)
+    @param did (Dataset ID. If did is specified, this function will sync the partircular DBs of the dataset. Otherwise it will sync the general DBs that include all datasets)
+    @param conn_remote (Blitzgateway for the server of the OMERO.tables DB. By default it is conn)
+    @return num_rows (number of rows copied, None if it failed)
+    @return Message (Error Message)
+    """
+
+    if conn_remote is None:
+        conn_remote = conn
+
+    answer, result = link.has(conn_remote, featureset, did)
+    if answer is False:
+        return None, "There is no table for the featureset"
+
+    source = result.getId().getValue()
+    table = conn_remote.getSharedResources().openTable( omero.model.OriginalFileI( source, False ) )
+    try:
+        headers = table.getHeaders()
+        feature_ids = [col.name for col in headers[link.NUM_KEY_COLUMNS:]]
+
+        # check the existence of the DB with DBfilename
+        answer, result = has(conn, featureset, did)
+        if answer is False:
+            initialize(conn, feature_ids, featureset, did)
+            answer, result = has(conn, featureset, did)
+        if answer is False:
+            return None, "Could not initialize the contentDB file"
+
+        # result is the absolute path of the DB file
+        pkl_file = open(result, 'rb')
+        Data = pickle.load(pkl_file)
+        pkl_file.close()
+
+        db = _getContentDB(Data, scale, feature_ids)
+        if db.feature_ids != feature_ids:
+            return None, "The features of the DBs do not match"
+
+        # 1. find the rows added since the last sync
+        key = _syncKey(conn_remote, featureset, did)
+        watermark = db.watermarks.get(key, (source, 0))
+        if not isinstance(watermark, tuple):
+            # saved with the INDEX only
+            watermark = (source, watermark)
+        if watermark[0] != source:
+            # the table has been replaced, its INDEX starts again
+            watermark = (source, 0)
+        rows = table.getWhereList('(INDEX > %d)' % watermark[1], {}, 0, 0, 1)
+        if len(rows) == 0:
+            return 0, "Good"
+
+        # 2. read them in chunks and append them to the DB at once
+        blocks = []
+        for chunk in chunks(list(rows), 1000):
+            blocks.append([numpy.asarray(col.values) for col in table.readCoordinates(chunk).columns])
+        cols = [numpy.concatenate(values) for values in zip(*blocks)]
+        db.append(cols[1], cols[2], cols[3], cols[4], cols[5], cols[6], cols[7],
+                  numpy.column_stack(cols[link.NUM_KEY_COLUMNS:]))
+        db.watermarks[key] = (source, max(watermark[1], long(cols[0].max())))
+    finally:
+        table.close()
+
+    # 3. get the DB file name and tag
+    DBfilename_old, DBfilename_new, tag = getRecentName(conn, featureset, did)
+
+    # 4. save it with the new DB file name
+    fullpath = OMERO_CONTENTDB_PATH + DBfilename_new
+    _saveDB(Data, fullpath)
+
+    # 5. update the tag with a new file name
+    Answer = updateNameTag(conn, tag, DBfilename_new)
+
+    # 6. delete the previous one
+    try:
+        _removeDB(result)
     except:
-        Message = "Not Done Correctly"
+        return len(rows), "Couldn't remove the previous contentDB file"
 
-    return data, Message
+    return len(rows), "Good"
 
 def processOMEIDs(cdb_row):
      '''
@@ -755,32 +1248,22 @@ def removeDuplicates(conn, scale, featureset, did=None):
     DBfilename_old, DBfilename_new, tag = getRecentName(conn, featureset, did)
 
     # 2. Remove duplicates, keeping the latest
-    uniqueRows = {}
-    for d in Data[scale]:
-        # 0:IND 1:server 2:username 3:metadata 4:image 5:render,
-        #   6:iid 7:pixels 8:channel 9:zslice 10:timepoint 11:features ....
-        k = tuple([d[1]] + d[4:11])
-        uniqueRows[k] = d
+    db = _getContentDB(Data, scale, conn=conn)
+    db = db.take(db.findLatest())
+    db.renumber()
 
-    # Should be unique, so order doesn't matter
-    uniqueData = uniqueRows.values()
-    for n in xrange(len(uniqueData)):
-        uniqueData[n][0] = n + 1
-
-    Data[scale] = uniqueData
+    Data[scale] = db
 
     # 3. save it with the new DB file name
     fullpath = OMERO_CONTENTDB_PATH + DBfilename_new
-    output = open(fullpath, 'wb')
-    pickle.dump(Data, output)
-    output.close()
+    _saveDB(Data, fullpath)
 
     # 4. update the tag with a new file name
     Answer = updateNameTag(conn, tag, DBfilename_new)
 
     # 5. delete the previous one
     try:
-        os.remove(result)
+        _removeDB(result)
     except:
         return False, "Couldn't remove the previous contentDB file"
 
@@ -34,6 +34,10 @@ import copy
 
 NUM_DIGIT_COUNT = 20
 
+# Number of leading (non-feature) columns in a content DB table
+# 'INDEX', 'server', 'username', 'iid', 'pixels', 'channel', 'zslice', 'timepoint'
+NUM_KEY_COLUMNS = 8
+
 def initializeNameTag(conn, featureset, did=None):
     """
     Initialize a tagAnnotation for image-content DB Name and link it to the ExperimenterGroup.
@@ -633,7 +637,7 @@ def chunks(l, n):
 	'''
     return [l[i:i+n] for i in range(0, len(l), n)]
 
-def retrieve(conn, featureset, did=None):
+def retrieve(conn, featureset, did=None, features=None):
     """
     Retrieve a DB object(HDF5 file) from OMERO server
     This function is using omero.client object. Thus this function cannot be called from OMERO.web directly.
@@ -641,6 +645,7 @@ def retrieve(conn, featureset, did=None):
     @param conn (Blitzgateway)
     @param featureset (featureset name)
     @param did (Dataset ID. If did is specified, this function will retrieve the partircular DB that is attached to the dataset. Otherwise it will retrieve the general DB that includes all datasets
+    @param features (id list of the features to return. By default all the features are returned. Only the key columns and these feature columns are read from the table)
     @return data (list of data lists) [ [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
                                         [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
                                         [IND,server,username,iid,pixels,channel,zslice,timepoint,...],
@@ -654,10 +659,22 @@ def retrieve(conn, featureset, did=None):
         fid = result.getId().getValue()            
         table = conn.getSharedResources().openTable( omero.model.OriginalFileI( fid, False ) )
 
-        num_col = len(table.getHeaders())
+        headers = table.getHeaders()
         num_row = table.getNumberOfRows()
 
-        chunk_col = chunks(range(num_col), 100) # read every 50 columns
+        if features is None:
+            col_numbers = range(len(headers))
+        else:
+            # read only the key columns and the requested feature columns
+            names = [col.name for col in headers]
+            col_numbers = range(NUM_KEY_COLUMNS)
+            for fid in features:
+                if str(fid) not in names:
+                    table.close()
+                    return [], "Unknown feature id: %s" % fid
+                col_numbers.append(names.index(str(fid)))
+
+        chunk_col = chunks(col_numbers, 100) # read every 100 columns
         chunk_row = chunks(range(num_row), 1000) # read every 1000 columns
         
         data = []
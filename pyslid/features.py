@@ -75,12 +75,12 @@ You should have received a copy of the GNU General Public License along with thi
 For additional information visit http://murphylab.web.cmu.edu or send email to murphy@cmu.edu
 '''
 
-import omero, pyslic, pyslid.utilities, pyslid.image
+import omero, pyslic, pyslid.utilities, pyslid.image, pyslid.instrument, pyslid.texture, pyslid.zernike, pyslid.objects, pyslid.intensity
 from utilities import PyslidException
 import omero.callbacks
 from omero.gateway import BlitzGateway
 import omero.util.script_utils as utils
-import numpy, scipy
+import numpy
 
 def getTableInfo(conn, did, set="slf33", field=True, debug=False ):
     '''
@@ -135,17 +135,165 @@ def getTableInfo(conn, did, set="slf33", field=True, debug=False ):
 
     return [num_image, num_image_table]
 
-def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0, channels=[], zslice=0, timepoint=0, threshold=None, debug=False ):
+def _loadPlane( conn, iid, pixels, channel, zslice, timepoint, scale, timings, pyramid ):
+    '''
+    Downloads a plane and resizes it to the given scale with pyslid.image.resize, which keeps the data
+    type of the plane, recording both stages in timings. Planes at scale 1 are not resized.
+
+    The plane and its resized levels are kept in the pyramid dictionary, so every plane is downloaded
+    once per call of calculate whatever the number of scales (Internal function)
+    '''
+
+    key = (pixels, channel, zslice, timepoint)
+    plane = pyramid.get(key)
+    if plane is None:
+        with timings.stage('download'):
+            plane = pyslid.utilities.getPlane(
+                conn, iid, pixels, channel, zslice, timepoint)
+        timings.track(plane)
+        pyramid[key] = plane
+    if scale is None or scale == 1:
+        return plane
+    level = pyramid.get(key + (scale,))
+    if level is None:
+        with timings.stage('resize'):
+            level = pyslid.image.resize(plane, scale)
+        timings.track(level)
+        pyramid[key + (scale,)] = level
+    return level
+
+def _loadSegmentation( conn, iid, pixels, channel, zslice, timepoint, scale, timings, pyramid ):
+    '''
+    Returns a plane, its label image and its number of objects, from pyslid.objects.cache if they were
+    already computed for the same (iid, pixels, channel, zslice, timepoint, scale). Planes are thresholded
+    at full resolution, and the threshold is kept in the pyramid for the other scales (Internal function)
+    '''
+
+    key = (long(iid), pixels, channel, zslice, timepoint, scale)
+    value = pyslid.objects.cache.get(key)
+    if value is None:
+        full = _loadPlane(
+            conn, iid, pixels, channel, zslice, timepoint, None, timings, pyramid)
+        tkey = ('threshold', pixels, channel, zslice, timepoint)
+        if tkey not in pyramid:
+            with timings.stage('segmentation'):
+                pyramid[tkey] = pyslid.objects.threshold(full)
+        plane = _loadPlane(
+            conn, iid, pixels, channel, zslice, timepoint, scale, timings, pyramid)
+        with timings.stage('segmentation'):
+            labels, nobjects = pyslid.objects.segment(plane, pyramid[tkey])
+        timings.track(labels)
+        value = (plane, labels, numpy.array(nobjects))
+        pyslid.objects.cache.put(key, value)
+    plane, labels, nobjects = value
+    return plane, labels, int(nobjects)
+
+def _accumulateStack( conn, iid, pixels, channel, timepoint, timings ):
+    '''
+    Streams the zslices of a channel into a pyslid.image.StackAccumulator, holding one plane at a time,
+    and records their download and accumulation in timings (Internal function)
+    '''
+
+    accumulator = pyslid.image.StackAccumulator()
+    planes = pyslid.utilities.iterPlanes(conn, iid, pixels, channel, None, timepoint)
+    while True:
+        with timings.stage('download'):
+            plane = next(planes, None)
+        if plane is None:
+            break
+        with timings.stage('features'):
+            accumulator.add(plane)
+        if accumulator.count == 1:
+            timings.track(plane, accumulator.maxProjection, accumulator.minProjection, accumulator.sumProjection)
+    return accumulator
+
+def _timedPlanes( planes, timings ):
+    '''
+    Yields the planes of an iterator, recording the time spent getting each plane as download and the
+    time spent by the caller on it as features in timings (Internal function)
+    '''
+
+    while True:
+        with timings.stage('download'):
+            plane = next(planes, None)
+        if plane is None:
+            return
+        with timings.stage('features'):
+            yield plane
+
+def _getMetadata( conn, iid, threshold, debug ):
+    '''
+    Checks that an image can have its features calculated and returns its scale (Internal function)
+    '''
+
+    if not conn.isConnected():
+        raise PyslidException("Unable to connect to OMERO.server")
+
+    if not pyslid.utilities.hasImage( conn, iid ):
+        raise PyslidException("No image found with the given image id:%s", iid)
+    #check input arguments
+    image = conn.getObject("Image", long(iid) )
+
+    if image is None:
+        raise PyslidException("Unable to retrieve image with iid:%s", iid)
+    else:
+        try:
+            #if threshold is empty use default value
+            if threshold == None:
+                threshold = 10*1024;
+
+            #check if image size is greater than threshold value
+            #icaoberg 19/02/2013
+            if image.getPixelSizeY() > threshold:
+                raise PyslidException("Image size is greater than threshold value")
+            #icaoberg 19/02/2013
+            elif image.getPixelSizeY() > threshold:
+                raise PyslidException("Image size is greater than threshold value")
+            else:
+                #set scale value
+                imgScale = pyslid.image.getScale( conn, iid, debug )
+                imgScale = imgScale[0]        
+        except:
+            #if no scale value is present, pyslic will set a scale value of .23
+            #to avoid that we prevent feature calculation
+            raise PyslidException("Unable to retrieve resolution or resolution was not set")
+
+    return imgScale
+
+def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0, channels=[], zslice=0, timepoint=0, threshold=None, debug=False, timings=None, scales=None ):
     '''
     Calculates and returns a feature ids vector, a feature vector and the output scale given a valid
     image identification (iid). It currently can calculate SLF33, SLF34, SLF35 and SLF36.
 
+    The haralick set computes the 13 Haralick texture features of the first channel (SLF27.66-78, the
+    mean over the four directions) with pyslid.texture instead of pyslic.
+
+    The zernike set computes the Zernike moments up to degree 12 of the first channel with pyslid.zernike,
+    on a circle of radius half the smallest side of the image centered on its center of mass, as in SLF.
+
+    The objects and objects-dna sets compute the SLF object features SLF1.1-SLF1.8 of the first channel
+    (and SLF2.17-SLF2.22, of its objects relative to the second, DNA, channel) with pyslid.objects. The
+    label images are cached, so they are computed once per (iid, channel, scale) whatever the sets
+    calculated. The cache holds up to pyslid.objects.MAX_CACHE_BYTES, and clinkPlanes drops the label
+    images of an image once its features are linked.
+
+    The min_max_mean, intensity (min, max, mean, std, integrated intensity and saturation fraction) and
+    percentiles sets are computed by pyslid.intensity in a single pass over the pixels of the plane.
+
+    The projections and stack_min_max_mean sets stream the zslices of the first channel one at a time
+    (the zslice argument is ignored). The first computes the minimum, maximum and mean of the maximum,
+    mean and sum intensity projections, the second the minimum, maximum, mean and standard deviation
+    of the voxels of the stack.
+
     This method will try to retrieve the resolution of the image from the annotations. 
 
     If the method is unable to connect to the OMERO.server, then the method will return None.
 
     If the method doesn't find an image associated with the given image id (iid), then the method will return None.
 
+    With scales, the image metadata is read and every plane is downloaded once, then resized to each
+    scale. Thresholds of the objects sets are computed once at full resolution.
+
     For detailed outputs, set debug flag to True.
     
     :param conn: connection
@@ -172,40 +320,34 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
     :type threshold: integer
     :param debug: debug flag
     :type debug: boolean
-    :rtype: a list of feature ids, a feature vector and the scale at which the features where calculated
+    :param timings: if given, the time and memory of each stage (metadata, download, resize, features) are recorded in it
+    :type timings: pyslid.instrument.Timings
+    :param scales: if given, the features are calculated at each of these scales instead of scale, from a single download of the planes
+    :type scales: list of doubles
+    :rtype: a list of feature ids, a feature vector and the scale at which the features where calculated, followed by the record of the image if timings is given. If scales is given, a list of those, one per scale
     '''
-   
-    if not conn.isConnected():
-        raise PyslidException("Unable to connect to OMERO.server")
 
-    if not pyslid.utilities.hasImage( conn, iid ):
-        raise PyslidException("No image found with the given image id:%s", iid)
-    #check input arguments
-    image = conn.getObject("Image", long(iid) )
+    pyramid = {}
+    if scales is None:
+        return _calculate(conn, iid, scale, set, field, rid, pixels, channels, zslice, timepoint, threshold, debug, timings, pyramid)
+    return [_calculate(conn, iid, s, set, field, rid, pixels, channels, zslice, timepoint, threshold, debug, timings, pyramid)
+            for s in scales]
 
-    if image is None:
-        raise PyslidException("Unable to retrieve image with iid:%s", iid)
-    else:
-        try:
-            #if threshold is empty use default value
-            if threshold == None:
-                threshold = 10*1024;
+def _calculate( conn, iid, scale, set, field, rid, pixels, channels, zslice, timepoint, threshold, debug, timings, pyramid ):
+    '''
+    Calculates the features of an image at one scale, see calculate. The pyramid dictionary holds the
+    metadata and planes shared by the scales of a call (Internal function)
+    '''
 
-            #check if image size is greater than threshold value
-            #icaoberg 19/02/2013
-            if image.getPixelSizeY() > threshold:
-                raise PyslidException("Image size is greater than threshold value")
-            #icaoberg 19/02/2013
-            elif image.getPixelSizeY() > threshold:
-                raise PyslidException("Image size is greater than threshold value")
-            else:
-                #set scale value
-                imgScale = pyslid.image.getScale( conn, iid, debug )
-                imgScale = imgScale[0]        
-        except:
-            #if no scale value is present, pyslic will set a scale value of .23
-            #to avoid that we prevent feature calculation
-            raise PyslidException("Unable to retrieve resolution or resolution was not set")
+    record = timings
+    if timings is None:
+        timings = pyslid.instrument.Timings()
+    timings.start(iid)
+
+    with timings.stage('metadata'):
+        if 'imgScale' not in pyramid:
+            pyramid['imgScale'] = _getMetadata(conn, iid, threshold, debug)
+        imgScale = pyramid['imgScale']
 
     #set resolution based on the scale
     print 'scale:%f imgScale:%f' %(scale, imgScale)
@@ -234,15 +376,15 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
 
         for c in xrange(2):
             img.channels[ labels[c] ] = channels[c]
-            plane = pyslid.utilities.getPlane(
-                conn, iid, pixels, channels[c], zslice, timepoint)
-            img.channeldata[ labels[c] ] = scipy.misc.imresize(plane, scale)
+            img.channeldata[ labels[c] ] = _loadPlane(
+                conn, iid, pixels, channels[c], zslice, timepoint, scale, timings, pyramid)
         
         img.loaded=True
         features = []
 
         try:
-            features = pyslic.computefeatures(img,'field-dna+')
+            with timings.stage('features'):
+                features = pyslic.computefeatures(img,'field-dna+')
             result = [feature_ids[0:173], features, scale]
         except:
             print "Unable to calculate features"
@@ -255,9 +397,8 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
 
         print 'scale: %f' % scale
         img.channels[ 'protein' ] = channels[0]
-        plane = pyslid.utilities.getPlane(
-            conn, iid, pixels, channels[0], zslice, timepoint)
-        img.channeldata[ 'protein' ] = scipy.misc.imresize( plane, scale )
+        img.channeldata[ 'protein' ] = _loadPlane(
+            conn, iid, pixels, channels[0], zslice, timepoint, scale, timings, pyramid)
 
         img.loaded=True
         print 'img:%s shape:%s' % (img, img.channeldata['protein'].shape)
@@ -269,7 +410,8 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
             ids.append( feature_ids[indices[i]-1] )
 
         try:
-            features = pyslic.computefeatures(img,'field+')
+            with timings.stage('features'):
+                features = pyslic.computefeatures(img,'field+')
             result = [ids, features, scale]
         except:
             print "Unable to calculate features"
@@ -286,16 +428,16 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
 
         for channel in channels:
             img.channels[ labels[channel] ] = channel
-            plane = pyslid.utilities.getPlane(
-                conn, iid, pixels, channel, zslice, timepoint)
-            img.channeldata[ labels[channel] ] = scipy.misc.imresize( plane, scale )
+            img.channeldata[ labels[channel] ] = _loadPlane(
+                conn, iid, pixels, channel, zslice, timepoint, scale, timings, pyramid)
 
         img.loaded=True
         ids = []
         features = []
 
         try:
-            values = pyslic.computefeatures(img,'field-dna+')
+            with timings.stage('features'):
+                values = pyslic.computefeatures(img,'field-dna+')
             indices = [12,10,11,1,18,17,6,7,8,9,20,2,3,19,4,5,21,22,13,14,15,16]
             for i in range(len(indices)):
                 ids.append( feature_ids[indices[i]-1] )
@@ -316,15 +458,16 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
 
         for channel in channels:
             img.channels[ labels[channel] ] = channel
-            img.channeldata[ labels[channel] ] = pyslid.utilities.getPlane(
-                conn, iid, pixels, channel, zslice, timepoint)
+            img.channeldata[ labels[channel] ] = _loadPlane(
+                conn, iid, pixels, channel, zslice, timepoint, None, timings, pyramid)
 
         img.loaded=True
         ids = []
         features = []
 
         try:
-            values = pyslic.computefeatures(img,'field-dna+')
+            with timings.stage('features'):
+                values = pyslic.computefeatures(img,'field-dna+')
             indices =[170,77,119,13,25,100,167,85,173,160,3,165,83,82,30,16,134,96,114,35,94,98,168]
             for i in range(len(indices)):
                 ids.append( feature_ids[indices[i]-1] )
@@ -333,14 +476,71 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
         except:
             print "Unable to calculate features"
             raise
-    elif set=="min_max_mean":
+    elif set in pyslid.intensity.SETS:
+        if len(channels) != 1:
+            raise PyslidException("Expected 1 channel for featureset %s" % set)
+
+        plane = _loadPlane(
+            conn, iid, pixels, channels[0], zslice, timepoint, None, timings, pyramid)
+        ids = getIds(set)
+        with timings.stage('features'):
+            features = pyslid.intensity.features(plane, set)
+        result = [ids, features, scale]
+    elif set=="projections" or set=="stack_min_max_mean":
+        if len(channels) != 1:
+            raise PyslidException("Expected 1 channel for featureset %s" % set)
+
+        accumulator = _accumulateStack(
+            conn, iid, pixels, channels[0], timepoint, timings)
+        ids = getIds(set)
+        with timings.stage('features'):
+            if set=="projections":
+                features = []
+                for projection in [accumulator.maxProjection, accumulator.meanProjection(), accumulator.sumProjection]:
+                    features += [projection.min(), projection.max(), projection.mean()]
+            else:
+                stats = accumulator.getStats()
+                features = [stats['min'], stats['max'], stats['mean'], stats['std']]
+        result = [ids, features, scale]
+    elif set=="haralick":
+        if len(channels) != 1:
+            raise PyslidException("Expected 1 channel for featureset %s" % set)
+
+        plane = _loadPlane(
+            conn, iid, pixels, channels[0], zslice, timepoint, scale, timings, pyramid)
+        ids = getIds(set)
+        with timings.stage('features'):
+            features = pyslid.texture.haralick(
+                pyslid.texture.quantize(plane)).mean(axis=0)
+        result = [ids, features, scale]
+    elif set=="zernike":
         if len(channels) != 1:
             raise PyslidException("Expected 1 channel for featureset %s" % set)
 
-        plane = pyslid.utilities.getPlane(
-            conn, iid, pixels, channels[0], zslice, timepoint)
+        plane = _loadPlane(
+            conn, iid, pixels, channels[0], zslice, timepoint, scale, timings, pyramid)
         ids = getIds(set)
-        features = numpy.array([plane.min(), plane.max(), plane.mean()])
+        with timings.stage('features'):
+            features = pyslid.zernike.moments(
+                plane, min(plane.shape) / 2.0, pyslid.zernike.DEGREE)
+        result = [ids, features, scale]
+    elif set=="objects" or set=="objects-dna":
+        nchannels = 2 if set=="objects-dna" else 1
+        if len(channels) != nchannels:
+            raise PyslidException("Expected %d channels for featureset %s" % (nchannels, set))
+
+        segmented = [_loadSegmentation(
+            conn, iid, pixels, channel, zslice, timepoint, scale, timings, pyramid)
+            for channel in channels]
+        ids = getIds(set)
+        with timings.stage('features'):
+            plane, labels, nobjects = segmented[0]
+            if nchannels == 2:
+                features = pyslid.objects.objectFeatures(
+                    plane, labels, nobjects, segmented[1][0], segmented[1][1])
+            else:
+                features = pyslid.objects.objectFeatures(
+                    plane, labels, nobjects)
         result = [ids, features, scale]
     else:
         raise PyslidException("Invalid feature set name")
@@ -352,6 +552,8 @@ def calculate( conn, iid, scale=1, set="slf33", field=True, rid=None, pixels=0,
             "Mismatch between featureids and feature values"
             "\nfids:%s\nfeatures:%s" % (result[0], result[1]))
 
+    if record is not None:
+        result.append(timings.images[-1])
     return result
 
 		
@@ -667,7 +869,8 @@ def hasTable( conn, iid, featureset="slf33", field=True, rid=None, debug=False )
 def getIds( set="slf33", debug=False ):
     '''
     Returns a list of feature ids given a valid feature set name. 
-    The only recognized featured sets are SLF33, SLF34, SLF35 and SLF36.
+    The only recognized featured sets are SLF33, SLF34, SLF35, SLF36, min_max_mean, intensity, percentiles,
+    projections, stack_min_max_mean, haralick, zernike, objects and objects-dna.
 
     :param set: feature set name
     :type set: string
@@ -700,8 +903,20 @@ def getIds( set="slf33", debug=False ):
         for i in range(len(indices)):
             ids.append( feature_ids[indices[i]-1] )
         return ids
-    elif set=="min_max_mean":
-        return ["min", "max", "mean"]
+    elif set in pyslid.intensity.SETS:
+        return list(pyslid.intensity.SETS[set])
+    elif set=="projections":
+        return [p + "_projection_" + s for p in ["max", "mean", "sum"] for s in ["min", "max", "mean"]]
+    elif set=="stack_min_max_mean":
+        return ["stack_min", "stack_max", "stack_mean", "stack_std"]
+    elif set=="haralick":
+        return feature_ids[0:13]
+    elif set=="zernike":
+        return ["zernike_%d_%d" % o for o in pyslid.zernike.orders()]
+    elif set=="objects":
+        return list(pyslid.objects.IDS)
+    elif set=="objects-dna":
+        return pyslid.objects.IDS + pyslid.objects.DNA_IDS
     else:
         print "Unrecognized feature set name: " + set
         return None
@@ -739,6 +954,43 @@ def link(conn, iid, scale, fids, features, set, field=True, rid=None, pixels=0,
     :type debug: boolean
     :rtype: true if feature if it successfully added feature vector to feature table, false otherwise
     '''
+
+    return linkBatch( conn, iid, scale, fids, [features], set, field, rid,
+                      [pixels], [channel], [zslice], [timepoint], debug )
+
+def linkBatch(conn, iid, scale, fids, features, set, field=True, rid=None, pixels=[0], channels=[0], zslices=[0], timepoints=[0], debug=False):
+    '''
+    Same as features.link for several feature vectors of the same image, which are
+    written to the feature table in a single call.
+
+    :param conn: connection
+    :type conn: BlitzGateway connection
+    :param iid: image id
+    :type iid: long
+    :param scale: scale at which the features where calculated, or list of the scale of every feature vector
+    :type scale: double or list of doubles
+    :param fids: feature ids list
+    :type fids: list of strings
+    :param features: feature vectors
+    :type features: list of lists of features
+    :param set: feature set name
+    :type set: string
+    :param field: true if field features, false otherwise
+    :type field: boolean
+    :param rid: region id
+    :type rid: long
+    :param pixels: pixel index of every feature vector
+    :type pixels: list of integers
+    :param channels: channel index of every feature vector
+    :type channels: list of integers
+    :param zslices: zslice index of every feature vector
+    :type zslices: list of integers
+    :param timepoints: time point index of every feature vector
+    :type timepoints: list of integers
+    :param debug: debug flag
+    :type debug: boolean
+    :rtype: true if feature if it successfully added the feature vectors to feature table, false otherwise
+    '''
      
     if not conn.isConnected():
         print "Unable to connect to OMERO.server"
@@ -752,12 +1004,20 @@ def link(conn, iid, scale, fids, features, set, field=True, rid=None, pixels=0,
     if image is None:
         raise PyslidException("Unable to retrieve image with id:%s", iid)
 
-    # generate a row-worth data in the OMERO.tables format
+    if isinstance( scale, (list, tuple) ):
+        scales = scale
+    else:
+        scales = [scale] * len(features)
+
+    if not ( len(features) == len(scales) == len(pixels) == len(channels) == len(zslices) == len(timepoints) ):
+        raise PyslidException("Expected one scale, pixels, channel, zslice and timepoint index per feature vector")
+
+    # generate the rows in the OMERO.tables format
 
     #if the feature ids/names is empty, generate a list feature name given by their index in list
     if not fids:
         fids = []
-        for i in range(len(features)):
+        for i in range(len(features[0])):
             fids.append( "feature" + str(i) )
     
     columns = []
@@ -769,8 +1029,8 @@ def link(conn, iid, scale, fids, features, set, field=True, rid=None, pixels=0,
 
     for fid in fids:
         columns.append(omero.grid.DoubleColumn( str(fid), str(fid), [] ))
-	
-    # if there is already a feature table attached to the image, this will add the features row to the table
+
+    # if there is already a feature table attached to the image, this will add the features rows to the table
     [answer, result] = hasTable( conn, iid, set, field )
 	
     if answer:
@@ -778,20 +1038,6 @@ def link(conn, iid, scale, fids, features, set, field=True, rid=None, pixels=0,
 
         table = conn.getSharedResources().openTable(
             omero.model.OriginalFileI(fid, False), conn.SERVICE_OPTS)
-
-        # append the new data
-        columns[0].values.append( long(pixels) )
-        columns[1].values.append( long(channel) ) 
-        columns[2].values.append( long(zslice) )  
-        columns[3].values.append( long(timepoint) )
-        #icaoberg april 20, 2012
-        columns[4].values.append( float(scale) )
-        for i in range(5, len(fids)+5):
-            columns[i].values.append( float(features[i-5]) ) 
-
-        table.addData(columns)
-        table.close()
-        return True
     else:
         # create a new table and link it to the image
         if field==True:
@@ -820,39 +1066,220 @@ def link(conn, iid, scale, fids, features, set, field=True, rid=None, pixels=0,
             table.close()
             raise PyslidException("Unable to create file annotation link")
 
-
-        # append the new data
-        columns[0].values.append( long(pixels) )
-        columns[1].values.append( long(channel) ) 
-        columns[2].values.append( long(zslice) )  
-        columns[3].values.append( long(timepoint) )
+    # append the new data
+    for row in range(len(features)):
+        columns[0].values.append( long(pixels[row]) )
+        columns[1].values.append( long(channels[row]) ) 
+        columns[2].values.append( long(zslices[row]) )  
+        columns[3].values.append( long(timepoints[row]) )
         #icaoberg april 20, 2012
-        columns[4].values.append( float(scale) )
+        columns[4].values.append( float(scales[row]) )
         for i in range(5, len(fids)+5):
-            columns[i].values.append( float(features[i-5]) )
-
-        try:
-            table.addData( columns )
-        except:
-            table.close()
-            raise PyslidException("Unable to add data to the table")
+            columns[i].values.append( float(features[row][i-5]) )
 
-        #return true because it linked/update a table
+    try:
+        table.addData( columns )
+    except:
         table.close()
-        return True
+        raise PyslidException("Unable to add data to the table")
+
+    #return true because it linked/update a table
+    table.close()
+    return True
 		
-def calculateOnDataset( conn, did, set="slf33", field=True, debug=False):
+def clinkChannels( conn, iid, scale=1, set="slf33", field=True, channels=None, pixels=0, zslice=0, timepoint=0, debug=False, timings=None, scales=None ):
+    '''
+    Calculates a feature vector for each channel list of an image and links all of them to the
+    image in a single call to features.linkBatch. Each vector is recorded with the first
+    channel of its list.
+
+    :param conn: connection
+    :type conn: BlitzGateway connection
+    :param iid: image id
+    :type iid: long
+    :param scale: image scale
+    :type scale: double
+    :param set: feature set name
+    :type set: string
+    :param field: true if field features, false otherwise
+    :type field: boolean
+    :param channels: list of the channel lists used for each feature vector, by default every channel on its own
+    :type channels: list of lists of integers
+    :param pixels: pixel index associated with the image
+    :type pixels: integer
+    :param zslice: zslice index
+    :type zslice: integer
+    :param timepoint: time point index
+    :type timepoint: integer
+    :param debug: debug flag
+    :type debug: boolean
+    :param timings: if given, the time and memory of each stage of calculate, and of the link, are recorded in it
+    :type timings: pyslid.instrument.Timings
+    :param scales: if given, a feature vector is calculated at each of these scales for every channel list, from a single download
+    :type scales: list of doubles
+    :rtype: a list of feature ids, the list of feature vectors (ordered by channel list, then by scale) and the channel index of each vector
+    '''
+
+    ids, feats, planes = clinkPlanes(conn, iid, scale, set, field, channels, [zslice], [timepoint], pixels, debug, timings, scales)
+    return [ids, feats, [plane[0] for plane in planes]]
+
+def _calculatePlane( conn, iid, scales, set, field, pixels, channels, zslice, timepoint, debug, timings, metadata ):
+    '''
+    Calculates the features of a channel list of a plane at every scale, reusing the metadata of the image.
+    Only the planes of the channel list are held in memory (Internal function)
+    '''
+    pyramid = dict(metadata)
+    return [_calculate(conn, long(iid), s, set, field, None, pixels, channels, zslice, timepoint, None, debug, timings, pyramid)
+            for s in scales]
+
+def _streamIntensity( conn, iid, scales, set, pixels, channels, zslices, timepoints, timings ):
+    '''
+    Calculates an intensity feature set for every channel list of every (zslice, timepoint) plane. The
+    zslices of each channel are streamed with pyslid.utilities.iterPlanes and their features computed in
+    batches by pyslid.intensity.features. Returns the results in the order of the tasks of clinkPlanes
+    (Internal function)
+    '''
+
+    ids = getIds(set)
+    values = {}
+    for t in timepoints:
+        for c, chans in enumerate(channels):
+            if len(chans) != 1:
+                raise PyslidException("Expected 1 channel for featureset %s" % set)
+            timings.start(iid)
+            planes = _timedPlanes(pyslid.utilities.iterPlanes(conn, iid, pixels, chans[0], zslices, t), timings)
+            for z, row in zip(zslices, pyslid.intensity.features(planes, set)):
+                values[c, z, t] = row
+    return [[[ids, values[c, z, t], s, None] for s in scales]
+            for t in timepoints for z in zslices for c in range(len(channels))]
+
+def clinkPlanes( conn, iid, scale=1, set="slf33", field=True, channels=None, zslices=None, timepoints=None, pixels=0, debug=False, timings=None, scales=None, executor=None ):
+    '''
+    Calculates a feature vector for each channel list of every (zslice, timepoint) plane of an image, or of
+    a selection of them, and links all of them to the image in a single call to features.linkBatch. Each
+    vector is recorded with the first channel of its list.
+
+    The planes of one channel list are downloaded at a time, so the whole image is never held in memory.
+    If an executor is given, the channel lists of all the planes are calculated in parallel on its threads.
+    Otherwise the intensity sets (see pyslid.intensity) stream the zslices of every channel through a single
+    raw pixels store and compute their features in batches. The segmentations of the image are dropped from
+    pyslid.objects.cache when it is done.
+
+    :param conn: connection
+    :type conn: BlitzGateway connection
+    :param iid: image id
+    :type iid: long
+    :param scale: image scale
+    :type scale: double
+    :param set: feature set name
+    :type set: string
+    :param field: true if field features, false otherwise
+    :type field: boolean
+    :param channels: list of the channel lists used for each feature vector, by default every channel on its own
+    :type channels: list of lists of integers
+    :param zslices: zslice indices, by default all of them (only zslice 0 for the projections and stack_min_max_mean sets, which cover the whole stack)
+    :type zslices: list of integers
+    :param timepoints: time point indices, by default all of them
+    :type timepoints: list of integers
+    :param pixels: pixel index associated with the image
+    :type pixels: integer
+    :param debug: debug flag
+    :type debug: boolean
+    :param timings: if given, the time and memory of each stage of calculate, and of the link, are recorded in it
+    :type timings: pyslid.instrument.Timings
+    :param scales: if given, a feature vector is calculated at each of these scales for every channel list, from a single download
+    :type scales: list of doubles
+    :param executor: if given, the planes are calculated on its threads
+    :type executor: pyslid.asynchronous.Executor
+    :rtype: a list of feature ids, the list of feature vectors (ordered by time point, zslice, channel list and scale) and the (channel, zslice, timepoint, scale) of each vector
+    '''
+
+    if timings is None:
+        timings = pyslid.instrument.Timings()
+    if scales is None:
+        scales = [scale]
+
+    image = conn.getObject("Image", long(iid))
+    if image is None:
+        raise PyslidException("Unable to retrieve image with id:%s", iid)
+    if channels is None:
+        channels = [[c] for c in range(image.getSizeC())]
+    if zslices is None:
+        if set in ["projections", "stack_min_max_mean"]:
+            zslices = [0]
+        else:
+            zslices = range(image.getSizeZ())
+    if timepoints is None:
+        timepoints = range(image.getSizeT())
+    metadata = {'imgScale': _getMetadata(conn, iid, None, debug)}
+
+    tasks = [(chans, z, t) for t in timepoints for z in zslices for chans in channels]
+    try:
+        if set in pyslid.intensity.SETS and executor is None:
+            results = _streamIntensity(conn, iid, scales, set, pixels, channels, zslices, timepoints, timings)
+        elif executor is None:
+            results = [_calculatePlane(conn, iid, scales, set, field, pixels, chans, z, t, debug, timings, metadata)
+                       for (chans, z, t) in tasks]
+        else:
+            futures = [executor.submit(_calculatePlane, iid, scales, set, field, pixels, chans, z, t, debug, timings, metadata)
+                       for (chans, z, t) in tasks]
+            results = [future.result() for future in futures]
+    finally:
+        pyslid.objects.forget(iid)
+
+    ids = []
+    feats = []
+    planes = []
+    for (chans, z, t), result in zip(tasks, results):
+        for [ids, values, fscale, record] in result:
+            feats.append(list(values))
+            planes.append((chans[0], z, t, fscale))
+
+    n = len(feats)
+    with timings.stage('link'):
+        linkBatch(conn, long(iid), [plane[3] for plane in planes], ids, feats, set, field, None, [pixels]*n,
+                  [plane[0] for plane in planes], [plane[1] for plane in planes], [plane[2] for plane in planes], debug)
+
+    return [ids, feats, planes]
+
+def calculateOnDataset( conn, did, set="slf33", field=True, debug=False, scale=1, ledger=None, timings=None, scales=None, zslices=None, timepoints=None, executor=None ):
     '''
     Helper method that will calculate and link features on all images in a dataset
 
+    Features are calculated for every channel of every (zslice, timepoint) plane of the images, or of the
+    selected zslices and time points, and the rows of an image are written in a single table write (see
+    clinkPlanes). If an executor is given, the planes of an image are calculated in parallel on its threads.
+
+    If a ledger is given, the state of every image is recorded in it and the images that are
+    already done are skipped without querying the server, so an interrupted run can be resumed
+    by calling this method again with the same ledger. Otherwise the images that already have a
+    feature table are skipped.
+
     :param conn: connection
     :type conn: BlitzGateway connection
     :param did: dataset id
     :type did: long
+    :param set: feature set name
+    :type set: string
     :param field: true if field features, false otherwise
     :type field: boolean
     :param debug: debug flag
     :type debug: boolean
+    :param scale: image scale
+    :type scale: double
+    :param ledger: job ledger
+    :type ledger: pyslid.jobs.Ledger
+    :param timings: if given, the time and memory of each stage are recorded in it for every image; timings.summary() aggregates them over the run
+    :type timings: pyslid.instrument.Timings
+    :param scales: if given, the features are calculated at each of these scales instead of scale, from a single download of every image
+    :type scales: list of doubles
+    :param zslices: zslice indices, by default all of them
+    :type zslices: list of integers
+    :param timepoints: time point indices, by default all of them
+    :type timepoints: list of integers
+    :param executor: if given, the planes of every image are calculated on its threads
+    :type executor: pyslid.asynchronous.Executor
+    :rtype: number of images in the dataset and number of images whose features were calculated
     '''
 	
     if not conn.isConnected():
@@ -868,34 +1295,33 @@ def calculateOnDataset( conn, did, set="slf33", field=True, debug=False):
     if not isinstance( field, bool ):
         return [0,0]
 	
-    num_image = 0
-    num_image_calculate = 0
-    
     ds = conn.getObject("Dataset", long(did))
-    img_gen = ds.getChildLinks()
-    for im in img_gen:
-        num_image +=1
-        iid = long(im.getId())
-        [answer, result] = hasTable(conn, iid, featureset, field)
-        session = conn.c.sf
-        if not answer:
-            num_image_calculate +=1
-            print iid
-            image = conn.getObject("Image", long(iid))
-            sizeC = image.getSizeC()
-
-            field = True
-            rid = []
-            pixel = 0
-            zslice = 0    #Currently, this code does NOT deal with 3D stack images yet.
-            timepoint = 0 #Currently, this code does NOT deal with time-series images yet.
-            threshold = None
-            for channel in range(sizeC):
-                [ids, feats] = calculate(conn, long(iid), featureset, field, rid, pixel, [channel], zslice, timepoint, threshold);
-                print len(feats)
-                #the following line should be changed with a regular pslid package function
-                answer2 = link(conn, long(iid), ids, feats,  featureset, field, rid, pixel, channel,zslice, timepoint)
-                print answer2
+    iids = [long(im.getId()) for im in ds.listChildren()]
+    num_image = len(iids)
+    num_image_calculate = 0
+
+    if ledger is not None:
+        job = 'calculateOnDataset:%s:%s:%s:%s' % (did, set, field, scale if scales is None else scales)
+        ledger.add(job, iids)
+        iids = [long(iid) for iid in ledger.getRemaining(job)]
+
+    for iid in iids:
+        try:
+            [answer, result] = hasTable(conn, iid, set, field)
+            if not answer:
+                if debug:
+                    print iid
+                clinkPlanes(conn, iid, scale, set, field, None, zslices, timepoints, 0, debug, timings, scales, executor)
+                num_image_calculate += 1
+        except Exception as e:
+            if ledger is None:
+                raise
+            print "Unable to calculate features of image %d: %s" % (iid, e)
+            ledger.markFailed(job, [iid], e)
+            continue
+
+        if ledger is not None:
+            ledger.markDone(job, [iid])
 
     return [num_image, num_image_calculate]
 
@@ -51,6 +51,11 @@ from utilities import PyslidException
 import omero.util.script_utils as utils
 from omero.rtypes import *
 from omero.gateway import BlitzGateway
+import numpy
+import threading
+
+# Float buffers reused by resize, one set per thread
+_workspace = threading.local()
 
 def getNomimalMagnification( conn, iid, debug=False ):
     '''
@@ -180,3 +185,159 @@ def getList( conn, debug=False ):
       return iids 
    except:
        raise PyslidException("Unable to run query")
+
+def _buffer( name, shape ):
+    '''
+    Returns a float buffer of the current thread, reallocated only when the shape changes (Internal function)
+    '''
+    buffers = _workspace.__dict__.setdefault('buffers', {})
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape:
+        buf = numpy.empty(shape, numpy.double)
+        buffers[name] = buf
+    return buf
+
+def _resample( src, dst, axis, scale, name ):
+    '''
+    Resamples src into dst along an axis: area averaging when scale < 1, linear interpolation otherwise (Internal function)
+    '''
+    n = src.shape[axis]
+    size = dst.shape[axis]
+    # shape of the weights, broadcast along the other axis
+    wshape = (-1, 1) if axis == 0 else (1, -1)
+    if scale < 1:
+        # dst[o] is the mean of src over [p[o], p[o+1]), computed from the
+        # cumulative sums of src at the fractional positions p
+        p = numpy.minimum(numpy.arange(size + 1) / float(scale), n)
+        i = numpy.minimum(numpy.floor(p), n - 1).astype(numpy.intp)
+        shape = list(src.shape)
+        shape[axis] = n + 1
+        csum = _buffer(name + 'csum', tuple(shape))
+        shape[axis] = size + 1
+        lower = _buffer(name + 'lower', tuple(shape))
+        upper = _buffer(name + 'upper', tuple(shape))
+        first = csum[:1] if axis == 0 else csum[:, :1]
+        first[...] = 0
+        numpy.cumsum(src, axis=axis, out=csum[1:] if axis == 0 else csum[:, 1:])
+        numpy.take(csum, i, axis=axis, out=lower)
+        numpy.take(src, i, axis=axis, out=upper)
+        upper *= (p - i).reshape(wshape)
+        lower += upper
+        if axis == 0:
+            numpy.subtract(lower[1:], lower[:-1], out=dst)
+        else:
+            numpy.subtract(lower[:, 1:], lower[:, :-1], out=dst)
+        dst /= numpy.diff(p).reshape(wshape)
+    else:
+        p = numpy.clip((numpy.arange(size) + 0.5) / float(scale) - 0.5, 0, n - 1)
+        i = numpy.floor(p).astype(numpy.intp)
+        lower = _buffer(name + 'lower', dst.shape)
+        upper = _buffer(name + 'upper', dst.shape)
+        numpy.take(src, i, axis=axis, out=lower)
+        numpy.take(src, numpy.minimum(i + 1, n - 1), axis=axis, out=upper)
+        upper -= lower
+        upper *= (p - i).reshape(wshape)
+        numpy.add(lower, upper, out=dst)
+
+def resize( plane, scale, out=None ):
+    '''
+    Resizes a plane by a scale factor, keeping its data type. Downscaling averages the pixels
+    over the area of each output pixel, upscaling interpolates linearly. Intermediate values are
+    kept in float buffers of the calling thread that are reused from one call to the next.
+
+    @param plane (2D array)
+    @param scale (scale factor, the output has int(rows * scale) x int(columns * scale) pixels)
+    @param out (optional preallocated output array)
+    @return resized plane, the plane itself if scale is 1
+    '''
+
+    if scale <= 0:
+        raise PyslidException("Scale must be positive")
+    plane = numpy.asarray(plane)
+    if scale == 1:
+        if out is None:
+            return plane
+        out[...] = plane
+        return out
+
+    shape = tuple(max(1, int(n * scale)) for n in plane.shape)
+    if out is None:
+        out = numpy.empty(shape, plane.dtype)
+    elif out.shape != shape:
+        raise PyslidException("Expected an output array of shape %s" % (shape,))
+
+    src = _buffer('src', plane.shape)
+    src[...] = plane
+    rows = _buffer('rows', (shape[0], plane.shape[1]))
+    _resample(src, rows, 0, scale, 'r')
+    both = _buffer('both', shape)
+    _resample(rows, both, 1, scale, 'c')
+    if out.dtype.kind in 'ui':
+        numpy.rint(both, out=both)
+    numpy.copyto(out, both, casting='unsafe')
+    return out
+
+class StackAccumulator(object):
+    '''
+    Maximum, minimum and sum intensity projections and voxel statistics of a
+    stack, updated one plane at a time so the stack is never held in memory.
+    '''
+
+    def __init__( self ):
+        self.count = 0
+        self.maxProjection = None
+        self.minProjection = None
+        self.sumProjection = None
+        self._voxels = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add( self, plane ):
+        '''
+        Adds a plane to the projections and statistics
+        @param plane (2D array)
+        '''
+        plane = numpy.asarray( plane )
+        if self.count == 0:
+            self.maxProjection = plane.copy()
+            self.minProjection = plane.copy()
+            self.sumProjection = plane.astype( numpy.double )
+        else:
+            if plane.shape != self.sumProjection.shape:
+                raise PyslidException( "Expected planes of shape %s" % (self.sumProjection.shape,) )
+            numpy.maximum( self.maxProjection, plane, out=self.maxProjection )
+            numpy.minimum( self.minProjection, plane, out=self.minProjection )
+            self.sumProjection += plane
+        self.count += 1
+
+        # merge the mean and sum of squared deviations of the plane with
+        # those of the previous planes (Chan et al.)
+        n = plane.size
+        mean = plane.mean( dtype=numpy.double )
+        m2 = ((plane - mean) ** 2).sum()
+        total = self._voxels + n
+        delta = mean - self._mean
+        self._mean += delta * n / total
+        self._m2 += m2 + delta ** 2 * self._voxels * n / total
+        self._voxels = total
+
+    def meanProjection( self ):
+        '''
+        @return mean intensity projection
+        '''
+        if self.count == 0:
+            raise PyslidException( "No planes were added" )
+        return self.sumProjection / self.count
+
+    def getStats( self ):
+        '''
+        @return dictionary with the 'min', 'max', 'mean' and 'std' of the voxels of the stack
+        '''
+        if self.count == 0:
+            raise PyslidException( "No planes were added" )
+        return {
+            'min': self.minProjection.min(),
+            'max': self.maxProjection.max(),
+            'mean': self._mean,
+            'std': numpy.sqrt( self._m2 / self._voxels ),
+            }
@@ -0,0 +1,407 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+
+# Number of recent latencies kept for every metric to estimate percentiles
+NUM_SAMPLES = 1024
+
+# Gateway methods that return a service, and the name used for the service
+SERVICES = {
+    'getQueryService': 'query',
+    'getUpdateService': 'update',
+    'getSharedResources': 'sharedResources',
+    'getPixelsService': 'pixels',
+    'createRawPixelsStore': 'rawPixelsStore',
+    'createThumbnailStore': 'thumbnailStore',
+    }
+
+# Service methods that return a service or a table
+SUB_SERVICES = {
+    'openTable': 'table',
+    'newTable': 'table',
+    }
+
+
+def _columnBytes(columns):
+    '''
+    Estimate the size of OMERO.tables columns (Internal function)
+    '''
+    size = 0
+    for col in columns:
+        values = getattr(col, 'values', None) or []
+        if values and isinstance(values[0], basestring):
+            size += sum(len(v) for v in values)
+        else:
+            size += 8 * len(values)
+    return size
+
+
+def _resultBytes(name, args, result):
+    '''
+    Bytes transferred by a call, for pixel reads and table reads and writes (Internal function)
+    '''
+    try:
+        if name in ('getPlane', 'getTile', 'getStack', 'getTimepoint', 'getRegion'):
+            return len(result)
+        if name in ('read', 'readCoordinates', 'slice'):
+            return _columnBytes(result.columns)
+        if name == 'addData':
+            return _columnBytes(args[0])
+    except Exception:
+        pass
+    return 0
+
+
+def _caller():
+    '''
+    Name of the innermost pyslid function in the call stack (Internal function)
+    '''
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('pyslid') and module != __name__:
+            return '%s.%s' % (module, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'other'
+
+
+class Metric(object):
+    """
+    Count, total and recent latencies and bytes of a kind of call
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.samples = []
+
+    def add(self, seconds, size, error):
+        self.count += 1
+        self.errors += int(error)
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += size
+        if len(self.samples) < NUM_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            self.samples[self.count % NUM_SAMPLES] = seconds
+
+    def snapshot(self):
+        samples = sorted(self.samples)
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'seconds': self.seconds,
+            'mean': self.seconds / self.count if self.count else 0.0,
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': self.max_seconds,
+            'bytes': self.bytes,
+            }
+
+
+class Stats(object):
+    """
+    Counters of the OMERO calls made through instrumented connections, by
+    service method ('query.findByQuery', 'table.read', ...) and by the
+    pyslid function that made them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._callers = {}
+        self._stop = None
+
+    def record(self, name, caller, seconds, size=0, error=False):
+        """
+        Record a call
+        @param name (service and method name)
+        @param caller (name of the calling function)
+        @param seconds (duration of the call)
+        @param size (bytes transferred)
+        @param error (True if the call raised an exception)
+        """
+        with self._lock:
+            for table, key in ((self._calls, name), (self._callers, caller)):
+                if key not in table:
+                    table[key] = Metric()
+                table[key].add(seconds, size, error)
+
+    def reset(self):
+        """
+        Clear the counters
+        """
+        with self._lock:
+            self._calls = {}
+            self._callers = {}
+
+    def snapshot(self):
+        """
+        @return dictionary with 'calls' and 'callers', each a dictionary of name ->
+                {count, errors, seconds, mean, p50, p90, p99, max, bytes}
+        """
+        with self._lock:
+            return {
+                'calls': dict((k, m.snapshot()) for k, m in self._calls.items()),
+                'callers': dict((k, m.snapshot()) for k, m in self._callers.items()),
+                }
+
+    def summary(self):
+        """
+        @return one line summary of the counters, slowest calls first
+        """
+        calls = self.snapshot()['calls']
+        items = sorted(calls.items(), key=lambda kv: -kv[1]['seconds'])
+        return ' '.join(
+            '%s=%d/%.3fs/p90:%.1fms/%dB' % (name, m['count'], m['seconds'],
+                                          1000 * m['p90'], m['bytes'])
+            for name, m in items)
+
+    def startLogging(self, interval=60, logger=None):
+        """
+        Log the summary every interval seconds, until stopLogging is called
+        @param interval (seconds)
+        @param logger (logging.Logger, by default the 'pyslid.instrument' logger)
+        """
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.stopLogging()
+        stop = self._stop = threading.Event()
+        def log():
+            while not stop.wait(interval):
+                logger.info(self.summary())
+        thread = threading.Thread(target=log)
+        thread.daemon = True
+        thread.start()
+
+    def stopLogging(self):
+        """
+        Stop the periodic logging
+        """
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+
+class _Proxy(object):
+    '''
+    Wraps an object so the calls of its methods are recorded (Internal class)
+    '''
+
+    def __init__(self, target, name, stats, services):
+        self.__dict__['_target'] = target
+        self.__dict__['_name'] = name
+        self.__dict__['stats'] = stats
+        self.__dict__['_services'] = services
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if not callable(value) or attr.startswith('_'):
+            return value
+
+        name = '%s.%s' % (self._name, attr)
+        stats = self.stats
+        service = self._services.get(attr)
+        def call(*args, **kwargs):
+            caller = _caller()
+            start = time.time()
+            try:
+                result = value(*args, **kwargs)
+            except:
+                stats.record(name, caller, time.time() - start, 0, True)
+                raise
+            stats.record(name, caller, time.time() - start,
+                         _resultBytes(attr, args, result))
+            if service is not None and result is not None:
+                result = _Proxy(result, service, stats, SUB_SERVICES)
+            return result
+        return call
+
+    def __setattr__(self, attr, value):
+        setattr(self._target, attr, value)
+
+
+class InstrumentedGateway(_Proxy):
+    """
+    BlitzGateway wrapper that records the calls of the gateway and of the
+    services and tables obtained from it in a Stats object. It can be used
+    wherever a BlitzGateway is expected.
+    """
+
+    def __init__(self, conn, stats):
+        _Proxy.__init__(self, conn, 'gateway', stats, SERVICES)
+
+    def getConnection(self):
+        """
+        @return the wrapped BlitzGateway
+        """
+        return self._target
+
+
+def instrument(conn, stats=None):
+    """
+    Wrap a connection so the OMERO calls made with it are recorded
+    @param conn (Blitzgateway)
+    @param stats (Stats, by default a new one)
+    @return InstrumentedGateway (its stats attribute holds the Stats)
+    """
+    if stats is None:
+        stats = Stats()
+    if isinstance(conn, InstrumentedGateway):
+        conn = conn.getConnection()
+    return InstrumentedGateway(conn, stats)
+
+
+class Timings(object):
+    """
+    Wall time, CPU time and peak array bytes of the stages (metadata, download,
+    resize, features, link) of the images processed by features.calculate and
+    its batch variants. CPU time is that of the whole process, so it includes
+    other threads when images are processed in parallel.
+
+    Every thread adds to its own current record, so one Timings can be shared
+    by the threads of a parallel run.
+    """
+
+    def __init__(self):
+        self.images = []
+        self._local = threading.local()
+        # id of a tracked array -> weak reference to it, released when it is freed
+        self._tracked = {}
+        self._lock = threading.RLock()
+
+    @property
+    def _current(self):
+        '''
+        Record of the image being processed by the calling thread (Internal property)
+        '''
+        return getattr(self._local, 'current', None)
+
+    def start(self, iid):
+        """
+        Start the record of an image. Later stages and arrays are added to it.
+        @param iid (image id)
+        @return the record, a dictionary with 'iid', 'stages' (name -> {wall, cpu}),
+                'bytes' (tracked arrays that are still held) and 'peak_bytes' (largest 'bytes' so far)
+        """
+        current = {'iid': iid, 'stages': {}, 'peak_bytes': 0, 'bytes': 0}
+        self._local.current = current
+        self.images.append(current)
+        return current
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager that adds the time spent in its block to a stage of the current image
+        @param name (stage name)
+        """
+        if self._current is None:
+            self.start(None)
+        record = self._current['stages'].setdefault(
+            name, {'wall': 0.0, 'cpu': 0.0})
+        wall = time.time()
+        cpu = sum(os.times()[:2])
+        try:
+            yield
+        finally:
+            record['wall'] += time.time() - wall
+            record['cpu'] += sum(os.times()[:2]) - cpu
+
+    def _release(self, key, current, size):
+        '''
+        Weak reference callback of a tracked array that has been freed (Internal function)
+        '''
+        def release(ref):
+            with self._lock:
+                current['bytes'] -= size
+                if self._tracked.get(key) is ref:
+                    del self._tracked[key]
+        return release
+
+    def track(self, *arrays):
+        """
+        Count arrays held while processing the current image towards its bytes until they are freed,
+        so its peak bytes are the largest size of the arrays held at the same time. An array is only
+        counted once, however many times it is tracked.
+        @param arrays (numpy arrays)
+        """
+        if self._current is None:
+            self.start(None)
+        current = self._current
+        with self._lock:
+            for a in arrays:
+                key = id(a)
+                if key in self._tracked and self._tracked[key]() is a:
+                    continue
+                size = getattr(a, 'nbytes', 0)
+                try:
+                    self._tracked[key] = weakref.ref(a, self._release(key, current, size))
+                except TypeError:
+                    # no weak references, counted until the end
+                    pass
+                current['bytes'] += size
+            current['peak_bytes'] = max(current['peak_bytes'], current['bytes'])
+
+    def summary(self):
+        """
+        Aggregate the records of all the images
+        @return dictionary with 'images' (number of records), 'stages' (name -> {wall,
+                cpu, max_wall, fraction}, fraction being the share of the wall time of
+                all stages) and 'peak_bytes' (largest peak of an image)
+        """
+        stages = {}
+        for image in self.images:
+            for name, record in image['stages'].items():
+                total = stages.setdefault(
+                    name, {'wall': 0.0, 'cpu': 0.0, 'max_wall': 0.0})
+                total['wall'] += record['wall']
+                total['cpu'] += record['cpu']
+                total['max_wall'] = max(total['max_wall'], record['wall'])
+        wall = sum(total['wall'] for total in stages.values())
+        for total in stages.values():
+            total['fraction'] = total['wall'] / wall if wall else 0.0
+        return {
+            'images': len(self.images),
+            'stages': stages,
+            'peak_bytes': max([image['peak_bytes'] for image in self.images] or [0]),
+            }
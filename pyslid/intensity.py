@@ -0,0 +1,188 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import numpy
+from utilities import PyslidException
+
+PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+
+# Number of histograms computed at a time by features
+CHUNK = 64
+
+# Feature ids of the intensity feature sets
+SETS = {
+    'min_max_mean': ['min', 'max', 'mean'],
+    'intensity': ['min', 'max', 'mean', 'std', 'integrated_intensity',
+                  'saturation_fraction'],
+    'percentiles': ['percentile_%d' % p for p in PERCENTILES],
+    }
+
+
+def _hasHistogram(plane):
+    '''
+    True if the statistics of a plane are computed from its histogram (Internal function)
+    '''
+    return plane.dtype.kind in 'ub' and plane.dtype.itemsize <= 2
+
+
+def histogram(plane, hist=None):
+    """
+    Histogram of an 8 or 16 bit unsigned plane, in a single pass. Histograms of the tiles of a plane can be added with hist.
+    @param plane (2D array, or tile of a plane)
+    @param hist (histogram to add the counts to)
+    @return array of counts of every value from 0 to the largest value of the type
+    """
+    plane = numpy.asarray(plane)
+    if not _hasHistogram(plane):
+        raise PyslidException("Expected an 8 or 16 bit unsigned plane")
+    levels = 1 << (8 * plane.dtype.itemsize)
+    counts = numpy.bincount(plane.ravel(), minlength=levels)
+    if hist is None:
+        return counts
+    hist += counts
+    return hist
+
+
+def histogramStats(hists, saturation=None):
+    """
+    Statistics of planes computed from their histograms, for all of them at once
+    @param hists (array of histograms, one row per plane)
+    @param saturation (saturated value, by default the last value of the histograms)
+    @return dictionary of arrays with one value per plane: 'min', 'max', 'mean', 'std', 'integrated_intensity', 'saturation_fraction' and 'percentile_<p>' for p in PERCENTILES
+    """
+    hists = numpy.atleast_2d(hists)
+    levels = hists.shape[1]
+    if saturation is None:
+        saturation = levels - 1
+    values = numpy.arange(levels, dtype=numpy.double)
+    nonzero = hists > 0
+    if not nonzero.any(axis=1).all():
+        raise PyslidException("Empty histogram")
+    counts = hists.sum(axis=1)
+    cumsum = numpy.cumsum(hists, axis=1)
+
+    stats = {}
+    stats['min'] = nonzero.argmax(axis=1)
+    stats['max'] = levels - 1 - nonzero[:, ::-1].argmax(axis=1)
+    total = hists.dot(numpy.arange(levels, dtype=numpy.int64))
+    stats['integrated_intensity'] = total
+    mean = total / counts.astype(numpy.double)
+    stats['mean'] = mean
+    stats['std'] = numpy.sqrt(numpy.maximum(
+        hists.dot(values ** 2) / counts - mean ** 2, 0))
+    stats['saturation_fraction'] = hists[:, int(saturation)] / counts.astype(
+        numpy.double)
+
+    # linear interpolation between the values at the two closest ranks,
+    # like numpy.percentile. The value at rank k is the first one whose
+    # cumulative count is larger than k; offsetting every row makes the
+    # cumulative counts of all the planes a single sorted array
+    offsets = numpy.arange(len(hists)) * (counts.max() + 1)
+    flat = (cumsum + offsets[:, None]).ravel()
+    start = numpy.arange(len(hists)) * levels
+    for p in PERCENTILES:
+        rank = p / 100.0 * (counts - 1)
+        lower = numpy.floor(rank)
+        below = numpy.searchsorted(flat, lower + offsets, 'right') - start
+        above = numpy.searchsorted(flat, lower + 1 + offsets, 'right') - start
+        above = numpy.minimum(above, stats['max'])
+        stats['percentile_%d' % p] = below + (rank - lower) * (above - below)
+    return stats
+
+
+def _reductionStats(plane, saturation):
+    '''
+    Statistics of a plane that has no histogram, computed with numpy reductions (Internal function)
+    '''
+    flat = numpy.asarray(plane).ravel()
+    low = flat.min()
+    high = flat.max()
+    if saturation is None:
+        saturation = high
+    total = flat.sum(dtype=numpy.double)
+    mean = total / flat.size
+    stats = {
+        'min': low,
+        'max': high,
+        'mean': mean,
+        'std': flat.std(dtype=numpy.double),
+        'integrated_intensity': total,
+        'saturation_fraction': numpy.count_nonzero(flat == saturation) / float(flat.size),
+        }
+    for p, value in zip(PERCENTILES, numpy.percentile(flat, PERCENTILES)):
+        stats['percentile_%d' % p] = value
+    return stats
+
+
+def _fill(rows, index, hists, set, saturation):
+    '''
+    Fill the rows of planes from their histograms (Internal function)
+    '''
+    stats = histogramStats(hists, saturation)
+    for row, i in enumerate(index):
+        rows[i] = [stats[name][row] for name in SETS[set]]
+
+
+def features(planes, set='intensity', saturation=None):
+    """
+    Intensity features of a plane, or of many planes in one call. The statistics of 8 and 16 bit
+    unsigned planes come from a single histogram pass over their pixels, and are computed for
+    CHUNK planes at a time from their histograms. Planes can come from an iterator, such as
+    utilities.iterPlanes, in which case only one plane is held at a time.
+    @param planes (2D array, or 3D array, list or iterator of 2D arrays)
+    @param set (name of a feature set of SETS)
+    @param saturation (saturated value, by default the largest value of the type for unsigned planes and the largest value of the plane otherwise)
+    @return array of len(SETS[set]) features, or array of shape (planes, len(SETS[set]))
+    """
+    if set not in SETS:
+        raise PyslidException("Unknown intensity feature set: %s" % set)
+    single = not hasattr(planes, 'next') and numpy.ndim(planes) == 2
+    if single:
+        planes = [planes]
+
+    rows = []
+    pending = {}
+    for i, plane in enumerate(planes):
+        plane = numpy.asarray(plane)
+        rows.append(None)
+        if _hasHistogram(plane):
+            index, hists = pending.setdefault(plane.dtype, ([], []))
+            index.append(i)
+            hists.append(histogram(plane))
+            if len(index) == CHUNK:
+                _fill(rows, index, hists, set, saturation)
+                del pending[plane.dtype]
+        else:
+            stats = _reductionStats(plane, saturation)
+            rows[i] = [stats[name] for name in SETS[set]]
+    for index, hists in pending.values():
+        _fill(rows, index, hists, set, saturation)
+
+    values = numpy.array(rows, numpy.double).reshape((len(rows), len(SETS[set])))
+    if single:
+        return values[0]
+    return values
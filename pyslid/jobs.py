@@ -0,0 +1,393 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import SimpleXMLRPCServer
+import sqlite3
+import threading
+import time
+import xmlrpclib
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Ledger(object):
+    """
+    Persistent record of the state of the items of long running jobs, such
+    as the images of features.calculateOnDataset or
+    database.direct.updatePerDataset, stored in a SQLite file.
+
+    Every item of a job is pending, done or failed (with the error message).
+    A job that is run again with the same ledger skips the items that are
+    already done, without querying the server for them, and retries the
+    pending and failed items.
+    """
+
+    def __init__(self, path):
+        """
+        Open a ledger, creating the SQLite file if needed
+        @param path (path of the SQLite file, or ':memory:')
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            ' job TEXT NOT NULL,'
+            ' item TEXT NOT NULL,'
+            ' state TEXT NOT NULL,'
+            ' error TEXT,'
+            ' updated REAL NOT NULL,'
+            ' PRIMARY KEY (job, item))')
+        self._db.commit()
+
+    def close(self):
+        """
+        Close the SQLite file
+        """
+        with self._lock:
+            self._db.close()
+
+    def add(self, job, items):
+        """
+        Add items to a job as pending. Items that are already in the job keep their state.
+        @param job (job name)
+        @param items (list of item ids)
+        @return number of new items
+        """
+        now = time.time()
+        with self._lock:
+            cur = self._db.executemany(
+                'INSERT OR IGNORE INTO items VALUES (?, ?, ?, NULL, ?)',
+                [(job, str(item), PENDING, now) for item in items])
+            self._db.commit()
+            return cur.rowcount
+
+    def _set(self, job, items, state, error):
+        '''
+        Set the state of items (Internal function)
+        '''
+        now = time.time()
+        items = [str(item) for item in items]
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO items VALUES (?, ?, ?, NULL, ?)',
+                [(job, item, PENDING, now) for item in items])
+            self._db.executemany(
+                'UPDATE items SET state = ?, error = ?, updated = ?'
+                ' WHERE job = ? AND item = ?',
+                [(state, error, now, job, item) for item in items])
+            self._db.commit()
+
+    def markDone(self, job, items):
+        """
+        Mark items of a job as done
+        @param job (job name)
+        @param items (list of item ids)
+        """
+        self._set(job, items, DONE, None)
+
+    def markFailed(self, job, items, error):
+        """
+        Mark items of a job as failed
+        @param job (job name)
+        @param items (list of item ids)
+        @param error (error message)
+        """
+        self._set(job, items, FAILED, str(error))
+
+    def getItems(self, job, state=None):
+        """
+        Get the items of a job
+        @param job (job name)
+        @param state (PENDING, DONE or FAILED. By default all the items are returned)
+        @return list of item ids (as strings)
+        """
+        with self._lock:
+            if state is None:
+                cur = self._db.execute(
+                    'SELECT item FROM items WHERE job = ? ORDER BY rowid',
+                    (job,))
+            else:
+                cur = self._db.execute(
+                    'SELECT item FROM items WHERE job = ? AND state = ?'
+                    ' ORDER BY rowid', (job, state))
+            return [row[0] for row in cur.fetchall()]
+
+    def getRemaining(self, job):
+        """
+        Get the items of a job that are not done yet (pending or failed)
+        @param job (job name)
+        @return list of item ids (as strings)
+        """
+        with self._lock:
+            cur = self._db.execute(
+                'SELECT item FROM items WHERE job = ? AND state != ?'
+                ' ORDER BY rowid', (job, DONE))
+            return [row[0] for row in cur.fetchall()]
+
+    def getErrors(self, job):
+        """
+        Get the errors of the failed items of a job
+        @param job (job name)
+        @return dictionary of item id -> error message
+        """
+        with self._lock:
+            cur = self._db.execute(
+                'SELECT item, error FROM items WHERE job = ? AND state = ?',
+                (job, FAILED))
+            return dict(cur.fetchall())
+
+    def getCounts(self, job):
+        """
+        Count the items of a job in each state
+        @param job (job name)
+        @return dictionary of state -> number of items
+        """
+        counts = {PENDING: 0, DONE: 0, FAILED: 0}
+        with self._lock:
+            cur = self._db.execute(
+                'SELECT state, COUNT(*) FROM items WHERE job = ?'
+                ' GROUP BY state', (job,))
+            counts.update(dict(cur.fetchall()))
+        return counts
+
+
+class WorkQueue(object):
+    """
+    Queue of work items shared by several workers, stored in a SQLite file.
+
+    Workers lease items for a limited time and renew the lease with
+    heartbeat() while they work on them. When a lease expires, because the
+    worker died or lost its connection, the item is put back in the queue.
+    Items that fail max_attempts times are left as failed.
+
+    Workers on other hosts can use the queue through serve() and
+    connect() instead of opening the SQLite file.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        """
+        Open a queue, creating the SQLite file if needed
+        @param path (path of the SQLite file, or ':memory:')
+        @param lease_seconds (time a lease lasts without a heartbeat)
+        @param max_attempts (number of times an item is leased before it is left as failed)
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS queue ('
+            ' item TEXT PRIMARY KEY,'
+            ' state TEXT NOT NULL,'
+            ' worker TEXT,'
+            ' expires REAL,'
+            ' attempts INTEGER NOT NULL,'
+            ' error TEXT,'
+            ' result TEXT)')
+
+    def _transaction(self, function):
+        '''
+        Run function(cursor) in a transaction that locks the SQLite file, so
+        several processes can share it (Internal function)
+        '''
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                value = function(cur)
+            except:
+                cur.execute('ROLLBACK')
+                raise
+            cur.execute('COMMIT')
+            return value
+
+    def _expire(self, cur, now):
+        '''
+        Put the items with an expired lease back in the queue (Internal function)
+        '''
+        cur.execute(
+            "UPDATE queue SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+            " worker = NULL, expires = NULL,"
+            " error = CASE WHEN attempts >= ? THEN 'Lease expired' ELSE error END"
+            " WHERE state = ? AND expires < ?",
+            (self.max_attempts, FAILED, PENDING, self.max_attempts, LEASED,
+             now))
+
+    def close(self):
+        """
+        Close the SQLite file
+        """
+        with self._lock:
+            self._db.close()
+
+    def put(self, items):
+        """
+        Add items to the queue. Items that are already in the queue keep their state.
+        @param items (list of item ids)
+        @return number of new items
+        """
+        def put(cur):
+            cur.executemany(
+                'INSERT OR IGNORE INTO queue VALUES (?, ?, NULL, NULL, 0, NULL, NULL)',
+                [(str(item), PENDING) for item in items])
+            return cur.rowcount
+        return self._transaction(put)
+
+    def lease(self, worker, num_items=1):
+        """
+        Lease pending items
+        @param worker (worker name)
+        @param num_items (maximum number of items)
+        @return list of item ids (empty if there are no pending items)
+        """
+        def lease(cur):
+            now = time.time()
+            self._expire(cur, now)
+            cur.execute(
+                'SELECT item FROM queue WHERE state = ? ORDER BY rowid LIMIT ?',
+                (PENDING, int(num_items)))
+            items = [row[0] for row in cur.fetchall()]
+            cur.executemany(
+                'UPDATE queue SET state = ?, worker = ?, expires = ?,'
+                ' attempts = attempts + 1 WHERE item = ?',
+                [(LEASED, str(worker), now + self.lease_seconds, item)
+                 for item in items])
+            return items
+        return self._transaction(lease)
+
+    def heartbeat(self, worker, items):
+        """
+        Renew the leases of a worker
+        @param worker (worker name)
+        @param items (list of item ids)
+        @return list of the items still leased by the worker
+        """
+        def heartbeat(cur):
+            now = time.time()
+            self._expire(cur, now)
+            held = []
+            for item in items:
+                cur.execute(
+                    'UPDATE queue SET expires = ?'
+                    ' WHERE item = ? AND state = ? AND worker = ?',
+                    (now + self.lease_seconds, str(item), LEASED, str(worker)))
+                if cur.rowcount:
+                    held.append(str(item))
+            return held
+        return self._transaction(heartbeat)
+
+    def complete(self, worker, item, result=''):
+        """
+        Report that a leased item is done
+        @param worker (worker name)
+        @param item (item id)
+        @param result (result summary)
+        @return True if the worker still held the lease
+        """
+        def complete(cur):
+            cur.execute(
+                'UPDATE queue SET state = ?, worker = ?, expires = NULL,'
+                ' error = NULL, result = ?'
+                ' WHERE item = ? AND state = ? AND worker = ?',
+                (DONE, str(worker), str(result), str(item), LEASED,
+                 str(worker)))
+            return cur.rowcount > 0
+        return self._transaction(complete)
+
+    def fail(self, worker, item, error):
+        """
+        Report that a leased item failed. It is put back in the queue until it has been tried max_attempts times.
+        @param worker (worker name)
+        @param item (item id)
+        @param error (error message)
+        @return True if the worker still held the lease
+        """
+        def fail(cur):
+            cur.execute(
+                'UPDATE queue SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,'
+                ' worker = NULL, expires = NULL, error = ?'
+                ' WHERE item = ? AND state = ? AND worker = ?',
+                (self.max_attempts, FAILED, PENDING, str(error), str(item),
+                 LEASED, str(worker)))
+            return cur.rowcount > 0
+        return self._transaction(fail)
+
+    def getCounts(self):
+        """
+        Count the items in each state
+        @return dictionary of state -> number of items
+        """
+        def count(cur):
+            self._expire(cur, time.time())
+            cur.execute('SELECT state, COUNT(*) FROM queue GROUP BY state')
+            return cur.fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(self._transaction(count)))
+        return counts
+
+    def getErrors(self):
+        """
+        Get the errors of the failed items
+        @return dictionary of item id -> error message
+        """
+        def errors(cur):
+            cur.execute('SELECT item, error FROM queue WHERE state = ?',
+                        (FAILED,))
+            return cur.fetchall()
+        return dict(self._transaction(errors))
+
+
+def serve(queue, host='localhost', port=8642):
+    """
+    Serve a WorkQueue over XML-RPC, so workers on other hosts can use it. This call doesn't return.
+    @param queue (WorkQueue)
+    @param host (address to listen on)
+    @param port (port to listen on)
+    """
+    server = SimpleXMLRPCServer.SimpleXMLRPCServer(
+        (host, port), logRequests=False, allow_none=True)
+    for name in ['put', 'lease', 'heartbeat', 'complete', 'fail',
+                 'getCounts', 'getErrors']:
+        server.register_function(getattr(queue, name), name)
+    server.serve_forever()
+
+
+def connect(host='localhost', port=8642):
+    """
+    Connect to a WorkQueue served with serve()
+    @param host (address of the queue server)
+    @param port (port of the queue server)
+    @return proxy with the put, lease, heartbeat, complete, fail, getCounts and getErrors methods of the queue
+    """
+    return xmlrpclib.ServerProxy('http://%s:%d' % (host, port),
+                                 allow_none=True)
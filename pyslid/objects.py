@@ -0,0 +1,220 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import numpy
+import scipy.ndimage
+import utilities
+from utilities import PyslidException
+
+# SLF ids of the object features of one channel, and of the features added
+# when a DNA channel is given. NAMES and DNA_NAMES describe the feature at
+# the same position.
+IDS = ['SLF1.%d' % i for i in range(1, 9)]
+DNA_IDS = ['SLF2.%d' % i for i in range(17, 23)]
+NAMES = [
+    'number_of_objects',
+    'euler_number',
+    'average_object_size',
+    'variance_object_size',
+    'ratio_max_min_object_size',
+    'average_object_distance_to_cof',
+    'variance_object_distance_to_cof',
+    'ratio_max_min_object_distance_to_cof',
+    ]
+DNA_NAMES = [
+    'average_object_distance_to_dna_cof',
+    'variance_object_distance_to_dna_cof',
+    'ratio_max_min_object_distance_to_dna_cof',
+    'distance_between_cof_and_dna_cof',
+    'ratio_area_to_dna_area',
+    'fraction_overlapping_dna',
+    ]
+
+# Default memory limit of the segmentation cache, in bytes. A 2048x2048
+# uint16 plane and its labels take 24 MB, so it holds a few large planes
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Cache of the planes and their labels, keyed by
+# (iid, pixels, channel, zslice, timepoint, scale). It is shared by the
+# threads of the process, so the objects and objects-dna sets of a plane
+# segment it once. features.clinkPlanes drops the entries of an image with
+# forget() when the image is done, so long-running workers only keep the
+# segmentations of the images they are working on
+cache = utilities.ArrayCache(MAX_CACHE_BYTES)
+
+
+def forget(iid):
+    """
+    Drop the cached segmentations of an image
+    @param iid (image id)
+    @return number of planes dropped
+    """
+    iid = long(iid)
+    return cache.discard(lambda key: key[0] == iid)
+
+
+def threshold(img):
+    """
+    Ridler-Calvard threshold of an image, computed on its histogram. The
+    candidate thresholds are scanned upwards as in mahotas.thresholding.rc.
+    @param img (2D array)
+    @return threshold value
+    """
+    img = numpy.asarray(img)
+    if img.dtype.kind in 'ui' and img.min() >= 0:
+        counts = numpy.bincount(img.ravel())
+        counts = counts[:numpy.flatnonzero(counts)[-1] + 1]
+        values = numpy.arange(len(counts), dtype=numpy.double)
+    else:
+        values, counts = numpy.unique(img, return_counts=True)
+        values = values.astype(numpy.double)
+    if len(values) == 1:
+        return values[0]
+
+    # mean of the values <= values[k] and of the values > values[k]
+    ccounts = numpy.cumsum(counts, dtype=numpy.double)[:-1]
+    csums = numpy.cumsum(counts * values)[:-1]
+    rcounts = counts.sum() - ccounts
+    valid = (ccounts > 0) & (rcounts > 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        res = (csums / ccounts + ((counts * values).sum() - csums) / rcounts) / 2
+    # candidates without pixels on one side keep the previous threshold
+    last = numpy.maximum.accumulate(
+        numpy.where(valid, numpy.arange(len(res)), -1))
+    res = numpy.where(last >= 0, res[numpy.maximum(last, 0)], values[-1])
+
+    stop = numpy.flatnonzero(values[1:-1] >= res[:-1])
+    if len(stop):
+        return res[stop[0]]
+    return res[-1]
+
+
+def segment(img, level=None):
+    """
+    Threshold an image and label the connected objects (8-connectivity)
+    @param img (2D array)
+    @param level (pixels above it are foreground, by default the Ridler-Calvard threshold)
+    @return label image (0 for the background) and number of objects
+    """
+    if level is None:
+        level = threshold(img)
+    return scipy.ndimage.label(numpy.asarray(img) > level,
+                               numpy.ones((3, 3)))
+
+
+def regionStats(labels, nobjects, img=None):
+    """
+    Statistics of all the objects of a label image, computed with one numpy.bincount per statistic
+    @param labels (label image, see segment)
+    @param nobjects (number of objects)
+    @param img (intensity image. If given, the centroids are weighted by the intensities)
+    @return dictionary of 'area', 'mass', 'cy' and 'cx' arrays, with one value per object
+    """
+    labels = numpy.asarray(labels)
+    flat = labels.ravel()
+    rows, cols = labels.shape
+    y = numpy.repeat(numpy.arange(rows, dtype=numpy.double), cols)
+    x = numpy.tile(numpy.arange(cols, dtype=numpy.double), rows)
+    size = nobjects + 1
+
+    area = numpy.bincount(flat, minlength=size)[1:].astype(numpy.double)
+    if img is None:
+        weights = None
+        mass = area
+    else:
+        weights = numpy.asarray(img, numpy.double).ravel()
+        mass = numpy.bincount(flat, weights, minlength=size)[1:]
+    if weights is not None:
+        y = y * weights
+        x = x * weights
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cy = numpy.bincount(flat, y, minlength=size)[1:] / mass
+        cx = numpy.bincount(flat, x, minlength=size)[1:] / mass
+    return {'area': area, 'mass': mass, 'cy': cy, 'cx': cx}
+
+
+def _cof(img):
+    '''
+    Center of fluorescence of an image (Internal function)
+    '''
+    return scipy.ndimage.center_of_mass(numpy.asarray(img, numpy.double))
+
+
+def _ratio(values):
+    '''
+    Ratio of the largest to the smallest value, 0 if the smallest is 0 (Internal function)
+    '''
+    if not len(values) or values.min() == 0:
+        return 0.
+    return values.max() / values.min()
+
+
+def _distances(stats, center):
+    '''
+    Statistics of the distances of the objects to a point (Internal function)
+    '''
+    d = numpy.hypot(stats['cy'] - center[0], stats['cx'] - center[1])
+    if not len(d):
+        return [0., 0., 0.]
+    return [d.mean(), d.var(), _ratio(d)]
+
+
+def objectFeatures(img, labels, nobjects, dna=None, dna_labels=None):
+    """
+    Object features of an image, and optionally of its objects relative to a DNA channel
+    @param img (2D array)
+    @param labels (label image of img, see segment)
+    @param nobjects (number of objects in labels)
+    @param dna (2D array of the DNA channel)
+    @param dna_labels (label image of dna)
+    @return list of values, with the ids in IDS, followed by DNA_IDS if dna is given
+    """
+    stats = regionStats(labels, nobjects, img)
+    mask = labels > 0
+    # background components touching the border are not holes
+    border = scipy.ndimage.label(~mask)[0]
+    edges = numpy.concatenate(
+        [border[0], border[-1], border[:, 0], border[:, -1]])
+    holes = border.max() - len(numpy.setdiff1d(numpy.unique(edges), [0]))
+
+    area = stats['area']
+    cof = _cof(img)
+    values = [nobjects, nobjects - holes,
+              area.mean() if nobjects else 0., area.var() if nobjects else 0.,
+              _ratio(area)] + _distances(stats, cof)
+    if dna is None:
+        return values
+
+    dna_cof = _cof(dna)
+    dna_area = (dna_labels > 0).sum()
+    total = numpy.asarray(img, numpy.double)[mask].sum()
+    overlap = numpy.asarray(img, numpy.double)[mask & (dna_labels > 0)].sum()
+    values += _distances(stats, dna_cof)
+    values += [numpy.hypot(cof[0] - dna_cof[0], cof[1] - dna_cof[1]),
+               mask.sum() / float(dna_area) if dna_area else 0.,
+               overlap / total if total else 0.]
+    return values
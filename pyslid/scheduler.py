@@ -0,0 +1,149 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import os
+import socket
+import threading
+import time
+import pyslid.features
+import pyslid.jobs
+import pyslid.utilities
+from utilities import PyslidException
+
+
+def listImages( conn, dids=[], plids=[], sids=[] ):
+    '''
+    Lists the ids of the images in datasets, plates and screens, without duplicates.
+    @param connection (conn)
+    @param list of dataset ids (dids)
+    @param list of plate ids (plids)
+    @param list of screen ids (sids)
+    @return list of image ids
+    '''
+
+    plates = []
+    for sid in sids:
+        screen = pyslid.utilities.getScreen( conn, sid )
+        if screen is None:
+            raise PyslidException("No screen found with the given screen id:%s" % sid)
+        plates.extend( screen.listChildren() )
+
+    for plid in plids:
+        plate = pyslid.utilities.getPlate( conn, plid )
+        if plate is None:
+            raise PyslidException("No plate found with the given plate id:%s" % plid)
+        plates.append( plate )
+
+    iids = []
+    for did in dids:
+        dataset = conn.getObject( "Dataset", long(did) )
+        if dataset is None:
+            raise PyslidException("No dataset found with the given dataset id:%s" % did)
+        iids.extend( long(image.getId()) for image in dataset.listChildren() )
+
+    for plate in plates:
+        for well in plate.listChildren():
+            for index in range( well.countWellSample() ):
+                image = well.getImage( index )
+                if image is not None:
+                    iids.append( long(image.getId()) )
+
+    seen = set()
+    return [iid for iid in iids if not (iid in seen or seen.add(iid))]
+
+def enqueue( conn, queue, dids=[], plids=[], sids=[] ):
+    '''
+    Adds the images in datasets, plates and screens to a work queue.
+    @param connection (conn)
+    @param queue (pyslid.jobs.WorkQueue, or a proxy from pyslid.jobs.connect)
+    @param list of dataset ids (dids)
+    @param list of plate ids (plids)
+    @param list of screen ids (sids)
+    @return number of images added to the queue
+    '''
+
+    return queue.put( listImages( conn, dids, plids, sids ) )
+
+def runWorker( conn, queue, scale=1, set="slf33", field=True, channels=None, worker=None, heartbeat=60, poll=10, debug=False ):
+    '''
+    Leases images from a work queue, calculates and links their features with
+    features.clinkChannels, and reports the results until the queue has no
+    pending or leased items. The leases are renewed every heartbeat seconds
+    while an image is processed.
+    @param connection (conn)
+    @param queue (pyslid.jobs.WorkQueue, or a proxy from pyslid.jobs.connect)
+    @param scale
+    @param feature set name (set)
+    @param field
+    @param list of channel lists (channels)
+    @param worker name (by default host:pid)
+    @param heartbeat (seconds between lease renewals)
+    @param poll (seconds to wait for leases of other workers to finish or expire)
+    @param debug
+    @return number of images done by this worker
+    '''
+
+    if worker is None:
+        worker = '%s:%d' % ( socket.gethostname(), os.getpid() )
+
+    num_done = 0
+    while True:
+        items = queue.lease( worker, 1 )
+        if not items:
+            counts = queue.getCounts()
+            if counts[pyslid.jobs.PENDING] == 0 and counts[pyslid.jobs.LEASED] == 0:
+                return num_done
+            time.sleep( poll )
+            continue
+
+        item = items[0]
+        stop = threading.Event()
+        def renew():
+            while not stop.wait( heartbeat ):
+                if not queue.heartbeat( worker, [item] ):
+                    break
+        # the queue is only used by the heartbeat thread while the features
+        # are calculated, as XML-RPC proxies are not thread safe
+        thread = threading.Thread( target=renew )
+        thread.daemon = True
+        thread.start()
+
+        try:
+            [ids, feats, chans] = pyslid.features.clinkChannels(
+                conn, long(item), scale, set, field, channels, debug=debug )
+        except Exception as e:
+            if debug:
+                print 'Unable to calculate features of image %s: %s' % ( item, e )
+            stop.set()
+            thread.join()
+            queue.fail( worker, item, str(e) )
+            continue
+
+        stop.set()
+        thread.join()
+        if queue.complete( worker, item, str(len(feats)) ):
+            num_done += 1
@@ -0,0 +1,199 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import numpy
+from utilities import PyslidException
+
+# Pixel offsets (rows, columns) of the four co-occurrence directions:
+# horizontal, diagonal (nw-se), vertical and diagonal (ne-sw)
+DIRECTIONS = [(0, 1), (1, 1), (1, 0), (1, -1)]
+
+LABELS = [
+    'Angular Second Moment',
+    'Contrast',
+    'Correlation',
+    'Sum of Squares: Variance',
+    'Inverse Difference Moment',
+    'Sum Average',
+    'Sum Variance',
+    'Sum Entropy',
+    'Entropy',
+    'Difference Variance',
+    'Difference Entropy',
+    'Information Measure of Correlation 1',
+    'Information Measure of Correlation 2',
+    ]
+
+# Largest number of grey levels of a co-occurrence matrix
+MAX_LEVELS = 4096
+
+
+def quantize(img, levels=256):
+    """
+    Map an image to integer grey levels 0 .. levels-1. Integer images that already fit are returned unchanged.
+    @param img (2D array)
+    @param levels (number of grey levels)
+    @return integer array
+    """
+    img = numpy.asarray(img)
+    if img.dtype.kind in 'ui' and img.size and img.min() >= 0 and \
+            img.max() < levels:
+        return img
+    low = img.min()
+    high = img.max()
+    if high == low:
+        return numpy.zeros(img.shape, numpy.intp)
+    scaled = (img - low) * ((levels - 1) / float(high - low))
+    return numpy.rint(scaled).astype(numpy.intp)
+
+
+def cooccurrence(img, directions=DIRECTIONS, distance=1, symmetric=True):
+    """
+    Grey level co-occurrence matrices of an image, counted with numpy.bincount over the codes of the pixel pairs
+    @param img (2D array of non negative integers, see quantize)
+    @param directions (list of (rows, columns) offsets)
+    @param distance (distance between the pixels of a pair)
+    @param symmetric (True to count every pair in both orders)
+    @return array of shape (len(directions), levels, levels), levels being img.max() + 1
+    """
+    img = numpy.asarray(img)
+    if img.ndim != 2 or img.dtype.kind not in 'ui':
+        raise PyslidException("Expected a 2D integer image")
+    if img.size and img.min() < 0:
+        raise PyslidException("Expected non negative grey levels")
+    levels = int(img.max()) + 1 if img.size else 1
+    if levels > MAX_LEVELS:
+        raise PyslidException(
+            "Image has %d grey levels, quantize it to at most %d" %
+            (levels, MAX_LEVELS))
+
+    codes = img.astype(numpy.intp) * levels
+    rows, cols = img.shape
+    cmats = numpy.empty((len(directions), levels, levels), numpy.double)
+    for d, (dy, dx) in enumerate(directions):
+        dy *= distance
+        dx *= distance
+        # the pixel pairs (y, x), (y + dy, x + dx) inside the image
+        first = codes[max(0, -dy):rows - max(0, dy),
+                      max(0, -dx):cols - max(0, dx)]
+        second = img[max(0, dy):rows + min(0, dy),
+                     max(0, dx):cols + min(0, dx)]
+        counts = numpy.bincount((first + second).ravel(),
+                                minlength=levels * levels)
+        cmats[d] = counts.reshape((levels, levels))
+    if symmetric:
+        cmats += cmats.transpose((0, 2, 1))
+    return cmats
+
+
+def _entropy(p, axes):
+    '''
+    Entropy of distributions, with 0 log 0 = 0 (Internal function)
+    '''
+    return -(p * numpy.log2(numpy.where(p == 0, 1, p))).sum(axis=axes)
+
+
+def haralickFeatures(cmats, ignore_zeros=False):
+    """
+    The 13 Haralick statistics of co-occurrence matrices, computed for all of them at once
+    @param cmats (array of shape (directions, levels, levels), see cooccurrence)
+    @param ignore_zeros (True to ignore the pairs with a zero pixel)
+    @return array of shape (directions, 13), in the order of LABELS
+    """
+    cmats = numpy.array(cmats, numpy.double)
+    if ignore_zeros:
+        cmats[:, 0, :] = 0
+        cmats[:, :, 0] = 0
+    totals = cmats.sum(axis=(1, 2))
+    if not totals.all():
+        raise PyslidException("Empty co-occurrence matrix")
+
+    ndirs, levels = cmats.shape[:2]
+    p = cmats / totals[:, None, None]
+    k = numpy.arange(levels, dtype=numpy.double)
+    i, j = numpy.mgrid[:levels, :levels]
+
+    px = p.sum(axis=1)
+    py = p.sum(axis=2)
+    ux = px.dot(k)
+    uy = py.dot(k)
+    vx = px.dot(k ** 2) - ux ** 2
+    vy = py.dot(k ** 2) - uy ** 2
+    sxsy = numpy.sqrt(vx) * numpy.sqrt(vy)
+
+    # distributions of i + j and |i - j|, for all the directions in one bincount
+    offsets = numpy.arange(ndirs)[:, None, None]
+    px_plus_y = numpy.bincount(
+        (offsets * 2 * levels + (i + j)).ravel(), weights=p.ravel(),
+        minlength=ndirs * 2 * levels).reshape((ndirs, 2 * levels))
+    px_minus_y = numpy.bincount(
+        (offsets * levels + abs(i - j)).ravel(), weights=p.ravel(),
+        minlength=ndirs * levels).reshape((ndirs, levels))
+    tk = numpy.arange(2 * levels, dtype=numpy.double)
+
+    feats = numpy.empty((ndirs, 13))
+    feats[:, 0] = (p * p).sum(axis=(1, 2))
+    feats[:, 1] = px_minus_y.dot(k ** 2)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        feats[:, 2] = numpy.where(
+            sxsy == 0, 1.0,
+            ((p * (i * j)).sum(axis=(1, 2)) - ux * uy) / sxsy)
+    feats[:, 3] = vx
+    feats[:, 4] = (p / (1.0 + (i - j) ** 2)).sum(axis=(1, 2))
+    feats[:, 5] = px_plus_y.dot(tk)
+    feats[:, 6] = px_plus_y.dot(tk ** 2) - feats[:, 5] ** 2
+    feats[:, 7] = _entropy(px_plus_y, 1)
+    feats[:, 8] = _entropy(p, (1, 2))
+    feats[:, 9] = px_minus_y.var(axis=1)
+    feats[:, 10] = _entropy(px_minus_y, 1)
+
+    hx = _entropy(px, 1)
+    hy = _entropy(py, 1)
+    cross = px[:, :, None] * py[:, None, :]
+    cross = numpy.where(cross == 0, 1, cross)
+    hxy1 = -(p * numpy.log2(cross)).sum(axis=(1, 2))
+    hxy2 = -(cross * numpy.log2(cross)).sum(axis=(1, 2))
+    hmax = numpy.maximum(hx, hy)
+    feats[:, 11] = (feats[:, 8] - hxy1) / numpy.where(hmax == 0, 1, hmax)
+    feats[:, 12] = numpy.sqrt(numpy.maximum(
+        0, 1 - numpy.exp(-2 * (hxy2 - feats[:, 8]))))
+    return feats
+
+
+def haralick(img, ignore_zeros=False, distance=1, levels=None):
+    """
+    Haralick texture features of an image in the four directions
+    @param img (2D array)
+    @param ignore_zeros (True to ignore the pairs with a zero pixel)
+    @param distance (distance between the pixels of a pair)
+    @param levels (if given, the image is first quantized to this number of grey levels)
+    @return array of shape (4, 13), one row per direction of DIRECTIONS
+    """
+    if levels is not None:
+        img = quantize(img, levels)
+    return haralickFeatures(cooccurrence(img, distance=distance),
+                            ignore_zeros)
@@ -31,6 +31,11 @@ import omero, pyslic
 import omero.util.script_utils as utils
 from omero.rtypes import *
 from omero.gateway import BlitzGateway
+import collections
+import contextlib
+import instrument
+import threading
+import time
 
 
 class PyslidException(Exception):
@@ -53,6 +58,315 @@ def connect( server, port, username, password ):
     except:
         return None
 
+def cloneConnection( conn ):
+    '''
+    Helper method that opens a new client joined to the session of an
+    existing connection, in the same group. Gateways are not thread safe,
+    so each thread that talks to the server should use its own clone.
+    Close it with clone.c.closeSession(), which leaves the session of conn
+    open.
+    @param connection (conn)
+    @returns connection
+    '''
+
+    client = conn.c.createClient( secure=True )
+    clone = BlitzGateway( client_obj=client )
+    gid = conn.SERVICE_OPTS.getOmeroGroup()
+    if gid is not None:
+        clone.SERVICE_OPTS.setOmeroGroup( gid )
+    if isinstance( conn, instrument.InstrumentedGateway ):
+        # Calls made with the clone are counted with those of conn
+        clone = instrument.instrument( clone, conn.stats )
+    return clone
+
+class SessionPool(object):
+    '''
+    Pool of connections for threads that talk to the server in parallel.
+
+    By default the connections are clients joined to the session of conn
+    (see cloneConnection). To open separate sessions, give a factory that
+    returns a new connection, e.g.
+    lambda: connect( server, port, username, password ).
+
+    Connections are opened when needed, up to size at a time. Idle
+    connections, and the connections pinned to a thread with get(), are
+    kept alive every keepalive seconds. Connections that are found closed
+    or that fail are replaced transparently; a pinned connection that is
+    found closed is replaced on the next get() of its thread.
+    '''
+
+    def __init__( self, conn=None, size=4, keepalive=60, factory=None ):
+        '''
+        @param connection whose session is joined (conn)
+        @param maximum number of connections (size)
+        @param seconds between keepalives of idle connections (keepalive)
+        @param function that opens a new connection (factory), used instead of conn
+        '''
+        if factory is None:
+            if conn is None:
+                raise PyslidException( "Either conn or factory is required" )
+            factory = lambda: cloneConnection( conn )
+
+        self.size = size
+        self.keepalive = keepalive
+        self._factory = factory
+        self._idle = []
+        # connections pinned to a thread by get(), and those of them that
+        # failed a keepalive
+        self._pinned = set()
+        self._expired = set()
+        self._num_open = 0
+        self._closed = False
+        self._local = threading.local()
+        self._condition = threading.Condition()
+
+        self._stop = threading.Event()
+        self._thread = None
+        if keepalive:
+            self._thread = threading.Thread( target=self._keepAlive )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _keepAlive( self ):
+        '''
+        Keep the idle and pinned connections alive (Internal function)
+        '''
+        while not self._stop.wait( self.keepalive ):
+            with self._condition:
+                idle = self._idle
+                self._idle = []
+                pinned = list( self._pinned )
+            for conn in pinned:
+                if not self._isAlive( conn ):
+                    with self._condition:
+                        if conn in self._pinned:
+                            self._expired.add( conn )
+            alive = []
+            for conn, used in idle:
+                if self._isAlive( conn ):
+                    alive.append( ( conn, time.time() ) )
+                else:
+                    self._discard( conn )
+            with self._condition:
+                self._idle.extend( alive )
+                self._condition.notify_all()
+
+    def _isAlive( self, conn ):
+        '''
+        Check a connection with a round trip to the server (Internal function)
+        '''
+        try:
+            return conn.keepAlive()
+        except:
+            return False
+
+    def _close( self, conn ):
+        '''
+        Close a connection (Internal function)
+        '''
+        try:
+            conn.c.closeSession()
+        except:
+            pass
+
+    def _discard( self, conn ):
+        '''
+        Close a connection and free its place in the pool (Internal function)
+        '''
+        self._close( conn )
+        with self._condition:
+            self._num_open -= 1
+            self._condition.notify_all()
+
+    def acquire( self ):
+        '''
+        Takes a connection from the pool, waiting if size connections are in use.
+        Give it back with release().
+        @returns connection
+        '''
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PyslidException( "The session pool is closed" )
+                if self._idle:
+                    conn, used = self._idle.pop()
+                    break
+                if self._num_open < self.size:
+                    self._num_open += 1
+                    conn = None
+                    break
+                self._condition.wait()
+
+        if conn is not None:
+            # check connections that were idle longer than a keepalive period
+            if not self.keepalive or time.time() - used < self.keepalive or \
+                    self._isAlive( conn ):
+                return conn
+            # replace it, keeping its place in the pool
+            self._close( conn )
+
+        try:
+            return self._factory()
+        except:
+            with self._condition:
+                self._num_open -= 1
+                self._condition.notify_all()
+            raise
+
+    def release( self, conn, failed=False ):
+        '''
+        Gives a connection back to the pool.
+        @param connection (conn)
+        @param True if a call on the connection failed (failed). The connection is replaced if it is closed.
+        '''
+        if self._closed or ( failed and not self._isAlive( conn ) ):
+            self._discard( conn )
+            return
+        with self._condition:
+            self._idle.append( ( conn, time.time() ) )
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def connection( self ):
+        '''
+        Context manager that takes a connection from the pool and gives it back.
+        '''
+        conn = self.acquire()
+        try:
+            yield conn
+        except:
+            self.release( conn, failed=True )
+            raise
+        self.release( conn )
+
+    def get( self ):
+        '''
+        Returns the connection of the current thread, taking one from the pool the first time.
+        The connection is kept alive while it is pinned to the thread, and replaced if it was
+        found closed. Give it back with releaseThread().
+        @returns connection
+        '''
+        conn = getattr( self._local, 'conn', None )
+        if conn is not None:
+            with self._condition:
+                expired = conn in self._expired
+                if expired:
+                    self._expired.discard( conn )
+                    self._pinned.discard( conn )
+            if not expired:
+                return conn
+            self._local.conn = None
+            self._discard( conn )
+
+        conn = self.acquire()
+        with self._condition:
+            self._pinned.add( conn )
+        self._local.conn = conn
+        return conn
+
+    def releaseThread( self ):
+        '''
+        Gives the connection of the current thread back to the pool.
+        '''
+        conn = getattr( self._local, 'conn', None )
+        if conn is not None:
+            self._local.conn = None
+            with self._condition:
+                self._pinned.discard( conn )
+                self._expired.discard( conn )
+            self.release( conn )
+
+    def close( self ):
+        '''
+        Closes the idle connections. Connections in use are closed when they are released.
+        '''
+        self._stop.set()
+        with self._condition:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+        for conn, used in idle:
+            self._discard( conn )
+        if self._thread is not None:
+            self._thread.join()
+
+class ArrayCache(object):
+    """
+    Least recently used cache of tuples of numpy arrays, with a limit on the
+    memory they use. A value larger than the limit is not cached.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        @param max_bytes (memory limit in bytes)
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """
+        Get a cached value
+        @param key (hashable key)
+        @return tuple of arrays, or None if the key isn't cached
+        """
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        """
+        Cache a value, dropping the least recently used ones to stay under the limit
+        @param key (hashable key)
+        @param value (tuple of arrays)
+        @return True if the value was cached
+        """
+        size = sum(array.nbytes for array in value)
+        with self._lock:
+            if size > self.max_bytes:
+                return False
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= sum(array.nbytes for array in old)
+            while self._items and self.nbytes + size > self.max_bytes:
+                old = self._items.popitem(last=False)[1]
+                self.nbytes -= sum(array.nbytes for array in old)
+            self._items[key] = value
+            self.nbytes += size
+            return True
+
+    def discard(self, match):
+        """
+        Drop the cached values whose key matches
+        @param match (function of a key, True for the keys to drop)
+        @return number of values dropped
+        """
+        with self._lock:
+            keys = [key for key in self._items if match(key)]
+            for key in keys:
+                old = self._items.pop(key)
+                self.nbytes -= sum(array.nbytes for array in old)
+            return len(keys)
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
 def getDataset( conn, did ):
     '''
     Returns a dataset with the given dataset id (did).
@@ -220,6 +534,39 @@ def getPlane( conn, iid, pixels=0, channel=0, zslice=0, timepoint=0 ):
     #return plane
     return plane
 
+def iterPlanes( conn, iid, pixels=0, channel=0, zslices=None, timepoint=0 ):
+    '''
+    Yields the zslices of a channel of an image one at a time, so only one plane is held in memory.
+    The planes are downloaded with a single raw pixels store, which is closed when the iteration ends.
+    @param connection (conn)
+    @param image id (iid)
+    @param pixels index
+    @param channel index
+    @param zslice indices (zslices), by default all of them
+    @param timepoint index
+    @return iterator of planes
+    '''
+
+    if not conn.isConnected():
+        raise PyslidException( "Unable to connect to OMERO.server" )
+
+    image = conn.getObject( "Image", long(iid) )
+    if image is None:
+        raise PyslidException( "No image found with the given image id:%s" % iid )
+
+    pid = image.getPixelsId()
+    description = conn.getPixelsService().retrievePixDescription( pid )
+    if zslices is None:
+        zslices = range( image.getSizeZ() )
+
+    rawPixelsStore = conn.createRawPixelsStore()
+    try:
+        rawPixelsStore.setPixelsId( pid, True )
+        for zslice in zslices:
+            yield utils.downloadPlane( rawPixelsStore, description, zslice, channel, timepoint )
+    finally:
+        rawPixelsStore.close()
+
 def getProject( conn, prid ):
     '''
     Returns a project with the given project id (prid).
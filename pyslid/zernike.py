@@ -0,0 +1,174 @@
+"""
+Created: October 19, 2026
+
+Copyright (C) 2026 Murphy Lab
+Lane Center for Computational Biology
+School of Computer Science
+Carnegie Mellon University
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published
+by the Free Software Foundation; either version 2 of the License,
+or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301, USA.
+
+For additional information visit http://murphylab.web.cmu.edu or
+send email to murphy@cmu.edu
+"""
+
+import math
+import numpy
+import utilities
+from utilities import PyslidException
+
+# Default maximum degree of the moments
+DEGREE = 12
+
+# Default memory limit of the basis cache, in bytes
+MAX_CACHE_BYTES = 16 * 1024 * 1024
+
+
+def orders(degree=DEGREE):
+    """
+    The (n, l) orders of the Zernike moments up to a degree, in the order they are returned by moments
+    @param degree (maximum degree)
+    @return list of (n, l) tuples
+    """
+    return [(n, l) for n in xrange(degree + 1) for l in xrange(n + 1)
+            if (n - l) % 2 == 0]
+
+
+# Cache of the bases, keyed by degree
+cache = utilities.ArrayCache(MAX_CACHE_BYTES)
+
+
+def _polymul(p, q):
+    '''
+    Product of two polynomials in x and y, given as arrays of the coefficients of x**a * y**b (Internal function)
+    '''
+    out = numpy.zeros((p.shape[0] + q.shape[0] - 1, p.shape[1] + q.shape[1] - 1),
+                      numpy.complex)
+    for a, b in zip(*numpy.nonzero(p)):
+        out[a:a + q.shape[0], b:b + q.shape[1]] += p[a, b] * q
+    return out
+
+
+def basis(degree=DEGREE):
+    """
+    Get the Zernike basis of a degree from the cache, computing it if needed. The complex conjugate
+    of every Zernike polynomial is a polynomial in the coordinates x and y of the pixels (relative
+    to the center, divided by the radius), so the basis is the same for every image shape, circle
+    and center.
+    @param degree (maximum degree)
+    @return complex array of shape (len(orders(degree)), degree + 1, degree + 1), the coefficients of x**a * y**b
+            of every (n, l) order, scaled by (n + 1) / pi
+    """
+    key = int(degree)
+    value = cache.get(key)
+    if value is None:
+        # powers of x**2 + y**2 and of x - iy
+        square = numpy.zeros((3, 3), numpy.complex)
+        square[2, 0] = square[0, 2] = 1
+        conj = numpy.zeros((2, 2), numpy.complex)
+        conj[1, 0] = 1
+        conj[0, 1] = -1j
+        squares = [numpy.ones((1, 1), numpy.complex)]
+        conjs = [numpy.ones((1, 1), numpy.complex)]
+        for p in xrange(degree):
+            squares.append(_polymul(squares[-1], square))
+            conjs.append(_polymul(conjs[-1], conj))
+
+        fact = math.factorial
+        matrix = numpy.zeros((len(orders(degree)), degree + 1, degree + 1),
+                             numpy.complex)
+        for row, (n, l) in enumerate(orders(degree)):
+            # R_nl(r) exp(-il theta) = sum of c_m r**(n - 2m - l) (x - iy)**l
+            for m in xrange((n - l) // 2 + 1):
+                c = (-1) ** m * fact(n - m) / float(
+                    fact(m) * fact((n + l) // 2 - m) * fact((n - l) // 2 - m))
+                term = _polymul(squares[(n - l) // 2 - m], conjs[l])
+                matrix[row, :term.shape[0], :term.shape[1]] += c * term
+            matrix[row] *= (n + 1) / math.pi
+        value = (matrix,)
+        cache.put(key, value)
+    return value[0]
+
+
+def centerOfMass(img):
+    """
+    Intensity center of mass of an image, the default center of the Zernike moments of SLF
+    @param img (2D array)
+    @return (row, column)
+    """
+    img = numpy.asarray(img, numpy.double)
+    total = img.sum()
+    if total <= 0:
+        raise PyslidException("Image has no positive pixels")
+    return (img.sum(axis=1).dot(numpy.arange(img.shape[0])) / total,
+            img.sum(axis=0).dot(numpy.arange(img.shape[1])) / total)
+
+
+def _geometric(img, radius, degree, center):
+    '''
+    Geometric moments sum(f * x**a * y**b) of the positive pixels of an image inside the circle, with
+    the coordinates of the basis, and the sum of those pixels. Only the bounding box of the circle is
+    read (Internal function)
+    '''
+    rows, cols = img.shape
+    top = max(0, int(math.floor(center[0] - radius)))
+    bottom = min(rows, int(math.ceil(center[0] + radius)) + 1)
+    left = max(0, int(math.floor(center[1] - radius)))
+    right = min(cols, int(math.ceil(center[1] + radius)) + 1)
+    y = (numpy.arange(top, bottom) - center[0]) / float(radius)
+    x = (numpy.arange(left, right) - center[1]) / float(radius)
+
+    weights = numpy.maximum(img[top:bottom, left:right], 0).astype(numpy.double)
+    weights[numpy.hypot(y[:, None], x[None, :]) > 1.] = 0
+    powers = numpy.arange(degree + 1)
+    ypow = y[:, None] ** powers
+    xpow = x[:, None] ** powers
+    return xpow.T.dot(weights.T.dot(ypow)), weights.sum()
+
+
+def moments(img, radius, degree=DEGREE, center=None):
+    """
+    Absolute Zernike moments of an image, or of a stack of images of the same shape. They are computed from
+    the geometric moments of the pixels inside the circle and the cached basis, without evaluating the
+    polynomials at every pixel. Non positive pixels are ignored.
+    @param img (2D array, or 3D array of images)
+    @param radius (radius of the circle in pixels, pixels outside it are ignored)
+    @param degree (maximum degree)
+    @param center ((row, column) of the center of the circle, by default the center of mass of each image, as in SLF)
+    @return array of len(orders(degree)) moments, or array of shape (images, len(orders(degree)))
+    """
+    img = numpy.asarray(img)
+    if img.ndim not in (2, 3):
+        raise PyslidException("Expected a 2D image or a stack of 2D images")
+    stack = img.reshape((-1,) + img.shape[-2:])
+
+    matrix = basis(degree)
+    geometric = numpy.empty((len(stack), (degree + 1) ** 2))
+    totals = numpy.empty(len(stack))
+    for i, plane in enumerate(stack):
+        c = center
+        if c is None:
+            c = centerOfMass(plane)
+        g, totals[i] = _geometric(plane, radius, degree, c)
+        geometric[i] = g.ravel()
+    if not totals.all():
+        raise PyslidException("Image has no positive pixels inside the circle")
+
+    z = geometric.dot(matrix.reshape((len(matrix), -1)).T)
+    z = abs(z / totals[:, None])
+    if img.ndim == 2:
+        return z[0]
+    return z
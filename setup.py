@@ -42,12 +42,21 @@ setup(name='pyslid',
         'pyslid.database.link',
         'pyslid.image',
         'pyslid.database.direct',
+        'pyslid.database.content',
         'pyslid.table',
+        'pyslid.jobs',
+        'pyslid.scheduler',
+        'pyslid.asynchronous',
+        'pyslid.instrument',
+        'pyslid.texture',
+        'pyslid.zernike',
+        'pyslid.objects',
+        'pyslid.intensity',
         ],
       install_requires = [
         # pip install numpy and scipy just doesn't work, so make sure you
         # manually install them first
-        'numpy>=1.4.1',
+        'numpy>=1.9',
         'scipy>=0.7.2',
         # Note: mahotas requires the freeimage library
         'mahotas==0.9.4',
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+#
+# Throughput of pyslid against the in-memory FakeGateway, so it can be
+# measured without an OMERO server:
+#
+#   python tests/Benchmark.py --sizes 1000,10000,100000 --latency 0.001 \
+#       --json benchmark.json
+#
+# For each size N it creates N images, then measures features.calculate,
+# link, hasTable and get on every image, direct.update on a ContentDB of N
+# rows and direct.retrieve of that ContentDB.
+#
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+
+from FakeGateway import FakeGateway
+
+from pyslid import features
+from pyslid.database import direct
+
+OPERATIONS = ['calculate', 'link', 'hasTable', 'get', 'update', 'retrieve']
+FEATURESET = 'min_max_mean'
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Discard what pyslid prints
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def measure(results, op, size, count, function):
+    """
+    Time function(), which does count operations, and add the result
+    """
+    with quiet():
+        start = time.time()
+        function()
+        seconds = time.time() - start
+    result = {
+        'op': op,
+        'size': size,
+        'count': count,
+        'seconds': seconds,
+        'rate': count / seconds if seconds else float('inf'),
+        }
+    results.append(result)
+    print '%-10s %8d %8d %10.3fs %12.1f/s' % (
+        op, size, count, seconds, result['rate'])
+    sys.stdout.flush()
+
+
+def run(size, latency, ops, updates, image_size):
+    """
+    Run the benchmark for one size
+    @return list of results
+    """
+    conn = FakeGateway(latency)
+    plane = numpy.arange(image_size * image_size, dtype=numpy.uint8).reshape(
+        (image_size, image_size))
+    iids = [conn.createImage(plane) for i in xrange(size)]
+    ids = features.getIds(FEATURESET)
+    feats = [1.0, 2.0, 3.0]
+    results = []
+
+    if 'calculate' in ops:
+        measure(results, 'calculate', size, size, lambda: [
+            features.calculate(conn, iid, 1.0, FEATURESET, channels=[0])
+            for iid in iids])
+
+    if 'link' in ops:
+        measure(results, 'link', size, size, lambda: [
+            features.link(conn, iid, 1.0, ids, feats, FEATURESET)
+            for iid in iids])
+
+    if 'hasTable' in ops:
+        measure(results, 'hasTable', size, size, lambda: [
+            features.hasTable(conn, iid, FEATURESET) for iid in iids])
+
+    if 'get' in ops and 'link' in ops:
+        measure(results, 'get', size, size, lambda: [
+            features.get(conn, 'features', iid, 1.0, FEATURESET)
+            for iid in iids])
+
+    if 'update' in ops or 'retrieve' in ops:
+        tempdir = tempfile.mkdtemp(prefix='omero_searcher_content_db-')
+        try:
+            direct.set_contentdb_path(tempdir)
+            direct.clearNameCache()
+            with quiet():
+                direct.updateDataset(
+                    conn, 'fake', 'user', 1.0, iids, [0] * size, [0] * size,
+                    [0] * size, [0] * size, ids, [feats] * size, FEATURESET)
+
+            if 'update' in ops:
+                measure(results, 'update', size, updates, lambda: [
+                    direct.update(conn, 'fake', 'user', 1.0, iids[0], 0, 0,
+                                  0, 0, ids, feats, FEATURESET)
+                    for i in xrange(updates)])
+
+            if 'retrieve' in ops:
+                # rows per second
+                measure(results, 'retrieve', size, size,
+                        lambda: direct.retrieve(conn, FEATURESET))
+        finally:
+            shutil.rmtree(tempdir)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark pyslid against an in-memory OMERO stand-in')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of images and rows')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every service call')
+    parser.add_argument('--ops', default=','.join(OPERATIONS),
+                        help='comma separated operations (%s)' %
+                        ','.join(OPERATIONS))
+    parser.add_argument('--updates', type=int, default=10,
+                        help='number of direct.update calls for each size')
+    parser.add_argument('--image-size', type=int, default=16,
+                        help='width and height of the images')
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+
+    ops = args.ops.split(',')
+    unknown = set(ops) - set(OPERATIONS)
+    if unknown:
+        parser.error('Unknown operations: %s' % ', '.join(sorted(unknown)))
+
+    print '%-10s %8s %8s %11s %14s' % ('op', 'size', 'count', 'time', 'rate')
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        results.extend(run(size, args.latency, ops, args.updates,
+                           args.image_size))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'latency': args.latency, 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+#
+# Compare the two ContentDB backends, database.direct (pickle files) and
+# database.link (OMERO.tables, here the tables of the in-memory
+# FakeGateway), as the DB grows:
+#
+#   python tests/BenchmarkContentDB.py --sizes 1000,10000,100000 \
+#       --json contentdb.json
+#
+# For each backend and size it fills the 'all' DB with synthetic feature
+# vectors in bulk, then reports the bulk insert throughput, the latency of
+# single inserts, the retrieve time, the peak RSS and the size of the DB.
+# Every backend and size runs in its own process, so the peak RSS is not
+# shared between them.
+#
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+
+from FakeGateway import FakeGateway
+
+from pyslid.database import direct
+from pyslid.database import link
+
+BACKENDS = ['direct', 'link']
+FEATURESET = 'test'
+
+
+def createFeatures(num_rows, num_features, offset=0):
+    """
+    Synthetic feature vectors and image ID metadata, like createFeatures in TestDatabaseDirect
+    @return iids, pixels, channels, zslices, timepoints, feature ids, features
+    """
+    iids = range(offset + 1, offset + num_rows + 1)
+    zeros = [0] * num_rows
+    fids = ['f%d' % i for i in xrange(num_features)]
+    feats = numpy.random.RandomState(offset).rand(num_rows, num_features)
+    return iids, zeros, zeros, zeros, zeros, fids, feats.tolist()
+
+
+def insert(backend, conn, iids, pixels, channels, zslices, timepoints, fids,
+           feats):
+    """
+    Add rows to the 'all' DB of a backend
+    """
+    if backend == 'direct':
+        a, m = direct.updateDataset(
+            conn, 'fake', 'user', 1.0, iids, pixels, channels, zslices,
+            timepoints, fids, feats, FEATURESET)
+    else:
+        a, m = link.updateDataset(
+            conn, 'fake', 'user', iids, pixels, channels, zslices,
+            timepoints, fids, feats, FEATURESET)
+    if not a:
+        raise Exception(m)
+
+
+def retrieve(backend, conn):
+    """
+    Read the 'all' DB of a backend
+    @return number of rows
+    """
+    if backend == 'direct':
+        data, m = direct.retrieve(conn, FEATURESET)
+        return len(data[1.0])
+    data, m = link.retrieve(conn, FEATURESET)
+    return len(data)
+
+
+def fileSize(backend, conn):
+    """
+    Size of the 'all' DB of a backend, for link an estimate of the HDF5 data
+    """
+    if backend == 'direct':
+        answer, path = direct.has(conn, FEATURESET)
+        return os.path.getsize(path)
+    answer, result = link.has(conn, FEATURESET)
+    table = conn.getSharedResources().openTable(result)
+    return table.getSize()
+
+
+def run(backend, size, args):
+    """
+    Measure one backend at one size
+    @return dictionary of results
+    """
+    conn = FakeGateway(args.latency)
+    tempdir = tempfile.mkdtemp(prefix='omero_searcher_content_db-')
+    direct.set_contentdb_path(tempdir)
+    direct.clearNameCache()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        iids, pixels, channels, zslices, timepoints, fids, feats = \
+            createFeatures(size, args.features)
+        start = time.time()
+        for i in xrange(0, size, args.batch):
+            batch = slice(i, i + args.batch)
+            insert(backend, conn, iids[batch], pixels[batch],
+                   channels[batch], zslices[batch], timepoints[batch], fids,
+                   feats[batch])
+        bulk = time.time() - start
+
+        latencies = []
+        for i in xrange(args.inserts):
+            row = createFeatures(1, args.features, size + i)
+            start = time.time()
+            insert(backend, conn, *row)
+            latencies.append(time.time() - start)
+
+        start = time.time()
+        num_rows = retrieve(backend, conn)
+        retrieve_seconds = time.time() - start
+        file_size = fileSize(backend, conn)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(tempdir)
+
+    return {
+        'backend': backend,
+        'rows': size,
+        'features': args.features,
+        'latency': args.latency,
+        'bulk_seconds': bulk,
+        'bulk_rows_per_second': size / bulk if bulk else float('inf'),
+        'insert_mean': numpy.mean(latencies) if latencies else None,
+        'insert_max': max(latencies) if latencies else None,
+        'retrieve_rows': num_rows,
+        'retrieve_seconds': retrieve_seconds,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'file_size': file_size,
+        }
+
+
+def runInProcess(backend, size, args):
+    """
+    Run a measure in a child process, so it has its own peak RSS
+    """
+    queue = multiprocessing.Queue()
+    def target():
+        try:
+            queue.put(run(backend, size, args))
+        except Exception as e:
+            queue.put({'backend': backend, 'rows': size, 'error': str(e)})
+    process = multiprocessing.Process(target=target)
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the direct and link ContentDB backends')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated numbers of rows')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help='comma separated backends (%s)' %
+                        ','.join(BACKENDS))
+    parser.add_argument('--features', type=int, default=100,
+                        help='number of features per row')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='rows per bulk insert')
+    parser.add_argument('--inserts', type=int, default=10,
+                        help='number of single row inserts after the bulk insert')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every OMERO service call')
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+
+    backends = args.backends.split(',')
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error('Unknown backends: %s' % ', '.join(sorted(unknown)))
+
+    print '%-7s %8s %12s %10s %10s %10s %10s %12s' % (
+        'backend', 'rows', 'bulk rows/s', 'insert', 'insert max',
+        'retrieve', 'peak RSS', 'file size')
+    results = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for backend in backends:
+            r = runInProcess(backend, size, args)
+            results.append(r)
+            if 'error' in r:
+                print '%-7s %8d failed: %s' % (backend, size, r['error'])
+            else:
+                print '%-7s %8d %12.1f %9.4fs %9.4fs %9.3fs %8.1fMB %10.1fMB' % (
+                    backend, size, r['bulk_rows_per_second'],
+                    r['insert_mean'] or 0, r['insert_max'] or 0,
+                    r['retrieve_seconds'], r['peak_rss'] / 2.0 ** 20,
+                    r['file_size'] / 2.0 ** 20)
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,635 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+# In-memory stand-in for a BlitzGateway connected to an OMERO server.
+#
+# It implements the subset of the gateway used by pyslid: getObject, the
+# query service (for the HQL queries issued by pyslid), the update service,
+# OMERO.tables through the shared resources, and the raw pixels store. It
+# uses the model, rtypes and grid classes of the omero package, but does not
+# need a server, so tests and benchmarks can run anywhere.
+#
+# Every service call sleeps for the latency given to the gateway, to model
+# the round-trip to a real server.
+#
+
+import re
+import threading
+import time
+import numpy
+import omero
+import omero.grid
+import omero.model
+from omero.gateway import ServiceOptsDict
+from omero.rtypes import rint, rlong, robject, rstring, unwrap
+
+
+class FakeStore(object):
+    """
+    Server side state shared by a FakeGateway and its clones
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.next_id = 1
+        self.images = {}
+        self.datasets = {}
+        self.annotations = {}
+        self.links = []
+        # links by (link class, parent id), as the server indexes them
+        self.parents = {}
+        self.files = {}
+        self.tables = {}
+
+    def addLink(self, link):
+        self.links.append(link)
+        key = (link.__class__, link.getParent().getId().getValue())
+        self.parents.setdefault(key, []).append(link)
+
+    def getLinks(self, cls, parent):
+        return self.parents.get((cls, parent), [])
+
+    def newId(self):
+        with self.lock:
+            oid = self.next_id
+            self.next_id += 1
+            return oid
+
+
+class FakeImage(object):
+    """
+    Image returned by FakeGateway.getObject('Image', iid)
+    """
+
+    def __init__(self, iid, name, planes, physical_size):
+        self.id = iid
+        self.name = name
+        # planes are stored as [z, c, t, y, x]
+        self.planes = planes
+        self.physical_size = physical_size
+
+    def getId(self):
+        return self.id
+
+    def getName(self):
+        return self.name
+
+    def getPixelsId(self):
+        return self.id
+
+    def getSizeZ(self):
+        return self.planes.shape[0]
+
+    def getSizeC(self):
+        return self.planes.shape[1]
+
+    def getSizeT(self):
+        return self.planes.shape[2]
+
+    def getSizeY(self):
+        return self.planes.shape[3]
+
+    def getSizeX(self):
+        return self.planes.shape[4]
+
+    def getPixelSizeX(self):
+        return self.physical_size[0]
+
+    def getPixelSizeY(self):
+        return self.physical_size[1]
+
+    def getPixelSizeZ(self):
+        return self.physical_size[2]
+
+
+class FakeDataset(object):
+    """
+    Dataset returned by FakeGateway.getObject('Dataset', did)
+    """
+
+    def __init__(self, store, did, name):
+        self._store = store
+        self.id = did
+        self.name = name
+        self.iids = []
+
+    def getId(self):
+        return self.id
+
+    def getName(self):
+        return self.name
+
+    def listChildren(self):
+        return [self._store.images[iid] for iid in self.iids]
+
+    def getChildLinks(self):
+        return self.listChildren()
+
+
+class FakeTable(object):
+    """
+    Handle on an OMERO.table kept in memory
+    """
+
+    def __init__(self, gateway, ofile):
+        self._gateway = gateway
+        self._ofile = ofile
+        self._data = gateway._store.tables.setdefault(
+            ofile.getId().getValue(), {'headers': None, 'values': None})
+
+    def _column(self, header, values):
+        '''
+        Copy of a column with other values (Internal function)
+        '''
+        if isinstance(header, omero.grid.StringColumn):
+            return omero.grid.StringColumn(
+                header.name, header.description, header.size, values)
+        return header.__class__(header.name, header.description, values)
+
+    def getOriginalFile(self):
+        return self._ofile
+
+    def initialize(self, columns):
+        self._gateway._wait('table')
+        self._data['headers'] = [self._column(c, []) for c in columns]
+        self._data['values'] = [[] for c in columns]
+
+    def getHeaders(self):
+        self._gateway._wait('table')
+        return [self._column(c, []) for c in self._data['headers']]
+
+    def getNumberOfRows(self):
+        self._gateway._wait('table')
+        values = self._data['values']
+        return len(values[0]) if values else 0
+
+    def addData(self, columns):
+        self._gateway._wait('table')
+        with self._gateway._store.lock:
+            for values, column in zip(self._data['values'], columns):
+                values.extend(column.values)
+
+    def _rows(self, colNumbers, rowNumbers):
+        '''
+        omero.grid.Data with the given columns and rows (Internal function)
+        '''
+        data = omero.grid.Data()
+        data.rowNumbers = list(rowNumbers)
+        data.lastModification = long(time.time() * 1000)
+        data.columns = []
+        for i in colNumbers:
+            values = self._data['values'][i]
+            data.columns.append(self._column(
+                self._data['headers'][i], [values[r] for r in rowNumbers]))
+        return data
+
+    def read(self, colNumbers, start, stop):
+        self._gateway._wait('table')
+        stop = min(stop, len(self._data['values'][0]))
+        return self._rows(colNumbers, range(start, stop))
+
+    def readCoordinates(self, rowNumbers):
+        self._gateway._wait('table')
+        return self._rows(range(len(self._data['headers'])), rowNumbers)
+
+    def slice(self, colNumbers, rowNumbers):
+        self._gateway._wait('table')
+        return self._rows(colNumbers, rowNumbers)
+
+    def getWhereList(self, condition, variables, start, stop, step):
+        self._gateway._wait('table')
+        names = dict((h.name, numpy.array(v)) for h, v in
+                     zip(self._data['headers'], self._data['values']))
+        if variables:
+            names.update(dict((k, unwrap(v)) for k, v in variables.items()))
+        mask = eval(condition, {'__builtins__': {}}, names)
+        rows = numpy.nonzero(mask)[0]
+        if stop <= 0:
+            stop = len(self._data['values'][0])
+        rows = rows[(rows >= start) & (rows < stop)]
+        return [long(r) for r in rows[::max(step, 1)]]
+
+    def close(self):
+        pass
+
+    def delete(self):
+        self._gateway._delete([self._ofile.getId().getValue()])
+
+    def getSize(self):
+        """
+        Estimate of the size of the data of the table in an HDF5 file
+        """
+        size = 0
+        for header, values in zip(self._data['headers'], self._data['values']):
+            if isinstance(header, omero.grid.StringColumn):
+                size += header.size * len(values)
+            else:
+                size += 8 * len(values)
+        return size
+
+
+class FakeSharedResources(object):
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+
+    def newTable(self, repo, name, ctx=None):
+        self._gateway._wait('table')
+        store = self._gateway._store
+        ofile = omero.model.OriginalFileI(store.newId(), True)
+        ofile.setName(rstring(name))
+        ofile.setMimetype(rstring('OMERO.tables'))
+        with store.lock:
+            store.files[ofile.getId().getValue()] = ofile
+        return FakeTable(self._gateway, ofile)
+
+    def openTable(self, ofile, ctx=None):
+        self._gateway._wait('table')
+        ofile = self._gateway._store.files.get(ofile.getId().getValue())
+        if ofile is None:
+            raise omero.ApiUsageException(None, None, 'No such table')
+        return FakeTable(self._gateway, ofile)
+
+
+class FakeRawPixelsStore(object):
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+        self._image = None
+
+    def setPixelsId(self, pid, bypass, ctx=None):
+        self._gateway._wait('pixels')
+        self._image = self._gateway._store.images[long(pid)]
+
+    def getPlane(self, z, c, t, ctx=None):
+        self._gateway._wait('pixels')
+        plane = self._image.planes[z, c, t]
+        return plane.astype(plane.dtype.newbyteorder('>')).tostring()
+
+    def close(self):
+        pass
+
+
+class FakePixelsService(object):
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+
+    def retrievePixDescription(self, pid, ctx=None):
+        self._gateway._wait('pixels')
+        image = self._gateway._store.images[long(pid)]
+        pixels = omero.model.PixelsI(long(pid), True)
+        pixels.setSizeX(rint(image.getSizeX()))
+        pixels.setSizeY(rint(image.getSizeY()))
+        pixels.setSizeZ(rint(image.getSizeZ()))
+        pixels.setSizeC(rint(image.getSizeC()))
+        pixels.setSizeT(rint(image.getSizeT()))
+        ptype = omero.model.PixelsTypeI()
+        ptype.setValue(rstring(str(image.planes.dtype)))
+        pixels.setPixelsType(ptype)
+        return pixels
+
+
+class FakeQueryService(object):
+    """
+    Answers the HQL queries issued by pyslid. Other queries raise an
+    ApiUsageException, so a new query in pyslid shows up as a test failure.
+    """
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+        self._queries = [
+            (r'select (f|iml) from ImageAnnotationLink .* where img\.id ?= ?:iid'
+             r' and (f\.name|fileAnn\.file\.name) ?= ?:filename',
+             self._imageFiles),
+            (r'select (grl|ann) from ExperimenterGroupAnnotationLink .*'
+             r' where grl\.parent\.id ?= ?:gid and ann\.ns ?= ?:namesp',
+             self._groupTags),
+            (r'select f from OriginalFile f where f\.name ?= ?:filename'
+             r' and f\.mimetype ?= ?:mimetype', self._files),
+            (r'select (f|dsl|fileAnn) from DatasetAnnotationLink .*'
+             r' where ds\.id ?= ?:did and f\.name ?= ?:filename',
+             self._datasetFiles),
+            (r'select count\(\*\) from OriginalFile f where f\.id ?= ?:fid',
+             self._countFiles),
+            (r'select i from Image i join fetch i\.objectiveSettings',
+             lambda match, params: []),
+            (r'select i\.id from Image i where i\.details\.owner\.id',
+             self._imageIds),
+            ]
+
+    def _run(self, string, params):
+        '''
+        Matching objects, in the order of the query (Internal function)
+        '''
+        self._gateway._wait('query')
+        string = ' '.join(string.split())
+        values = dict((k, unwrap(v)) for k, v in params.map.items())
+        for pattern, function in self._queries:
+            match = re.match(pattern, string)
+            if match:
+                with self._gateway._store.lock:
+                    results = function(match, values)
+                if 'order by' in string and 'desc' in string:
+                    results.reverse()
+                return results
+        raise omero.ApiUsageException(None, None, 'Unsupported query: ' + string)
+
+    def _imageFiles(self, match, values):
+        results = []
+        for link in self._gateway._store.getLinks(
+                omero.model.ImageAnnotationLinkI, values['iid']):
+            ofile = link.getChild().getFile()
+            if ofile.getName().getValue() == values['filename']:
+                results.append(ofile if match.group(1) == 'f' else link)
+        return results
+
+    def _groupTags(self, match, values):
+        results = []
+        for link in self._gateway._store.getLinks(
+                omero.model.ExperimenterGroupAnnotationLinkI, values['gid']):
+            ann = link.getChild()
+            if ann.getNs().getValue() == values['namesp']:
+                results.append(ann if match.group(1) == 'ann' else link)
+        return results
+
+    def _files(self, match, values):
+        files = self._gateway._store.files
+        return [files[fid] for fid in sorted(files)
+                if files[fid].getName().getValue() == values['filename'] and
+                files[fid].getMimetype().getValue() == values['mimetype']]
+
+    def _datasetFiles(self, match, values):
+        results = []
+        for link in self._gateway._store.getLinks(
+                omero.model.DatasetAnnotationLinkI, values['did']):
+            ofile = link.getChild().getFile()
+            if ofile.getName().getValue() == values['filename']:
+                results.append({'f': ofile, 'dsl': link,
+                                'fileAnn': link.getChild()}[match.group(1)])
+        return results
+
+    def _countFiles(self, match, values):
+        return [rlong(int(values['fid'] in self._gateway._store.files))]
+
+    def _imageIds(self, match, values):
+        return [rlong(iid) for iid in sorted(self._gateway._store.images)]
+
+    def findByQuery(self, string, params, ctx=None):
+        results = self._run(string, params)
+        return results[0] if results else None
+
+    def findAllByQuery(self, string, params, ctx=None):
+        return self._run(string, params)
+
+    def projection(self, string, params, ctx=None):
+        return [[r if isinstance(r, omero.RType) else robject(r)]
+                for r in self._run(string, params)]
+
+
+class FakeUpdateService(object):
+    """
+    Saves model objects in the FakeStore, giving ids to the new ones
+    """
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+
+    def _save(self, obj):
+        '''
+        Give ids to a new object and the new objects it links (Internal function)
+        '''
+        store = self._gateway._store
+        if isinstance(obj, (omero.model.ImageAnnotationLinkI,
+                            omero.model.DatasetAnnotationLinkI,
+                            omero.model.ExperimenterGroupAnnotationLinkI)):
+            self._save(obj.getChild())
+            if obj.getId() is None:
+                obj.setId(rlong(store.newId()))
+                store.addLink(obj)
+        elif isinstance(obj, omero.model.DatasetImageLinkI):
+            did = obj.getParent().getId().getValue()
+            store.datasets[did].iids.append(obj.getChild().getId().getValue())
+        elif isinstance(obj, omero.model.DatasetI):
+            if obj.getId() is None:
+                obj.setId(rlong(store.newId()))
+                name = unwrap(obj.getName())
+                did = obj.getId().getValue()
+                store.datasets[did] = FakeDataset(store, did, name)
+        elif isinstance(obj, omero.model.Annotation):
+            if obj.getId() is None:
+                obj.setId(rlong(store.newId()))
+            store.annotations[obj.getId().getValue()] = obj
+        return obj
+
+    def saveObject(self, obj, ctx=None):
+        self._gateway._wait('update')
+        with self._gateway._store.lock:
+            self._save(obj)
+
+    def saveAndReturnObject(self, obj, ctx=None):
+        self._gateway._wait('update')
+        with self._gateway._store.lock:
+            return self._save(obj)
+
+    def deleteObject(self, obj, ctx=None):
+        self._gateway._wait('update')
+        self._gateway._delete([obj.getId().getValue()])
+
+
+class FakeAdminService(object):
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+
+    def getEventContext(self):
+        return self._gateway.getEventContext()
+
+
+class FakeGroup(object):
+
+    def __init__(self, gid, name):
+        self.id = gid
+        self.name = name
+
+    def getId(self):
+        return self.id
+
+    def getName(self):
+        return self.name
+
+
+class FakeEventContext(object):
+
+    def __init__(self, gid, uid, username):
+        self.groupId = gid
+        self.userId = uid
+        self.userName = username
+
+
+class FakeClient(object):
+    """
+    Stand-in for omero.client. New sessions are made with FakeGateway.clone,
+    so give pyslid.utilities.SessionPool factory=conn.clone.
+    """
+
+    def closeSession(self):
+        pass
+
+
+class FakeGateway(object):
+    """
+    In-memory stand-in for a BlitzGateway
+
+    latency is the number of seconds every service call sleeps, either one
+    number or a dictionary with the latency of the 'query', 'update',
+    'table', 'pixels' and 'gateway' calls.
+    """
+
+    def __init__(self, latency=0.0, store=None):
+        self._store = store if store is not None else FakeStore()
+        self.latency = latency
+        self.host = 'fake'
+        self.c = FakeClient()
+        self.SERVICE_OPTS = ServiceOptsDict()
+        self._group = FakeGroup(3L, 'fake-group')
+        self._context = FakeEventContext(3L, 2L, 'fake-user')
+
+    def _wait(self, kind):
+        '''
+        Sleep for the latency of a kind of call (Internal function)
+        '''
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(kind, 0.0)
+        if latency:
+            time.sleep(latency)
+
+    def _delete(self, ids):
+        '''
+        Delete annotations, links and table files by id, and the links to the deleted annotations (Internal function)
+        '''
+        store = self._store
+        ids = set(ids)
+        with store.lock:
+            for oid in ids:
+                store.annotations.pop(oid, None)
+                store.files.pop(oid, None)
+                store.tables.pop(oid, None)
+            links = store.links
+            store.links = []
+            store.parents = {}
+            for link in links:
+                if (link.getId().getValue() not in ids and
+                    link.getChild().getId().getValue() not in ids):
+                    store.addLink(link)
+
+    def clone(self):
+        """
+        @return a new gateway on the same store, with the same latency
+        """
+        return FakeGateway(self.latency, self._store)
+
+    def createImage(self, planes, sizeZ=1, sizeC=1, sizeT=1, name='fake',
+                    physical_size=(1.0, 1.0, 1.0), did=None):
+        """
+        Add an image
+        @param planes (array of the sizeZ * sizeC * sizeT planes, in the order of
+                       BlitzGateway.createImageFromNumpySeq: t varies fastest, then c, then z)
+        @param physical_size (pixel size in x, y and z)
+        @param did (dataset to add the image to)
+        @return the image id
+        """
+        planes = numpy.asarray(planes)
+        sizeY, sizeX = planes.shape[-2:]
+        planes = planes.reshape((sizeZ, sizeC, sizeT, sizeY, sizeX))
+        iid = self._store.newId()
+        with self._store.lock:
+            self._store.images[iid] = FakeImage(iid, name, planes,
+                                                physical_size)
+            if did is not None:
+                self._store.datasets[did].iids.append(iid)
+        return iid
+
+    def createDataset(self, name='fake', iids=[]):
+        """
+        Add a dataset
+        @param iids (ids of the images in the dataset)
+        @return the dataset id
+        """
+        did = self._store.newId()
+        with self._store.lock:
+            self._store.datasets[did] = FakeDataset(self._store, did, name)
+            self._store.datasets[did].iids.extend(iids)
+        return did
+
+    def isConnected(self):
+        return True
+
+    def connect(self):
+        return True
+
+    def keepAlive(self):
+        return True
+
+    def close(self):
+        pass
+
+    def getEventContext(self):
+        return self._context
+
+    def getGroupFromContext(self):
+        return self._group
+
+    def getObject(self, obj_type, oid=None):
+        self._wait('gateway')
+        if obj_type == 'Image':
+            return self._store.images.get(long(oid))
+        if obj_type == 'Dataset':
+            return self._store.datasets.get(long(oid))
+        return None
+
+    def deleteObjects(self, graph_spec, obj_ids, deleteAnns=False,
+                      deleteChildren=False):
+        self._wait('update')
+        ids = [long(oid) for oid in obj_ids]
+        # pyslid passes the id of the table file of a file annotation
+        with self._store.lock:
+            ids.extend(oid for oid, ann in self._store.annotations.items()
+                       if isinstance(ann, omero.model.FileAnnotationI) and
+                       ann.getFile().getId().getValue() in ids)
+        self._delete(ids)
+
+    def getQueryService(self):
+        return FakeQueryService(self)
+
+    def getUpdateService(self):
+        return FakeUpdateService(self)
+
+    def getAdminService(self):
+        return FakeAdminService(self)
+
+    def getSharedResources(self):
+        return FakeSharedResources(self)
+
+    def getPixelsService(self):
+        return FakePixelsService(self)
+
+    def createRawPixelsStore(self):
+        return FakeRawPixelsStore(self)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import threading
+from numpy import array
+
+from ClientHelper import ClientHelper
+
+from pyslid import asynchronous
+from pyslid import features
+from pyslid import utilities
+
+
+
+class TestFuture(unittest.TestCase):
+    """
+    Test pyslid.asynchronous.Future, does not need an OMERO server
+    """
+
+    def test_result(self):
+        f = asynchronous.Future()
+        called = []
+        f.addCallback(called.append)
+        self.assertFalse(f.done())
+        self.assertFalse(f.wait(0.01))
+        self.assertRaises(RuntimeError, f.result, 0.01)
+
+        threading.Timer(0.01, f._set, (3, None)).start()
+        self.assertEqual(f.result(), 3)
+        self.assertTrue(f.done())
+        self.assertIsNone(f.exception())
+        self.assertEqual(called, [f])
+
+        f.addCallback(called.append)
+        self.assertEqual(called, [f, f])
+
+    def test_exception(self):
+        f = asynchronous.Future()
+        try:
+            raise ValueError('x')
+        except ValueError:
+            f._set(None, sys.exc_info())
+        self.assertRaises(ValueError, f.result)
+        self.assertIsInstance(f.exception(), ValueError)
+
+
+class TestExecutor(ClientHelper):
+    """
+    Test pyslid.asynchronous.Executor
+    """
+
+    def setUp(self):
+        super(TestExecutor, self).setUp()
+        self.executor = asynchronous.Executor(self.conn, workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(TestExecutor, self).tearDown()
+
+    def test_getPlane(self):
+        iids = [self.createImage() for i in range(3)]
+        planes = asynchronous.gather(
+            [self.executor.getPlane(iid) for iid in iids])
+        for iid, plane in zip(iids, planes):
+            self.assertTrue(
+                (plane == utilities.getPlane(self.conn, iid)).all())
+
+    def test_link_hasTable(self):
+        iid = self.createImageWithRes()
+        f = self.executor.hasTable(iid, 'test')
+        self.assertFalse(f.result()[0])
+
+        f = self.executor.link(iid, 0.5, ['f1', 'f2'], array([1.0, 2.0]),
+                               'test')
+        self.assertTrue(f.result())
+        self.assertTrue(self.executor.hasTable(iid, 'test').result()[0])
+
+        ids, feats = self.executor.get('vector', iid, set='test').result()
+        self.assertEqual(list(feats[0][-2:]), [1.0, 2.0])
+        self.assertRaises(ValueError, self.executor.get, 'table', iid)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import numpy
+import pickle
+
+from pyslid.database.content import ContentDB
+
+
+
+class TestContentDB(unittest.TestCase):
+    """
+    Test pyslid.database.content.ContentDB, does not need an OMERO server
+    """
+
+    def createRows(self):
+        rows = [
+            [1, 'host', 'user', 'host/webclient/metadata_details/image/1',
+             'host/webclient/?show=image-1', 'host/webclient/img_detail/1',
+             1, 0, 0, 0, 0, 5.1, 5.2],
+            [2, 'host', 'other', 'host/webclient/metadata_details/image/2',
+             'host/webclient/?show=image-2', 'host/webclient/img_detail/2',
+             2, 0, 1, 0, 0, 1.0, 1.0],
+            [3, 'host', 'user', 'host/webclient/metadata_details/image/1',
+             'host/webclient/?show=image-1', 'host/webclient/img_detail/1',
+             1, 0, 0, 0, 0, 7.1, 7.2],
+            ]
+        return rows
+
+    def test_fromRows(self):
+        rows = self.createRows()
+        db = ContentDB.fromRows(rows, ['f1', 'f2'])
+        self.assertEqual(len(db), 3)
+        self.assertEqual(db.features.shape, (3, 2))
+        self.assertEqual(db[0], rows[0])
+        self.assertEqual(db[-1], rows[2])
+        self.assertEqual(list(db), rows)
+        self.assertEqual(db[1:], rows[1:])
+        self.assertEqual(db.usernames, ['user', 'other'])
+
+    def test_append(self):
+        db = ContentDB(['f1', 'f2'])
+        db.append('host', 'user', 1, 0, 0, 0, 0, [5.1, 5.2])
+        db.append('host', ['user', 'other'], [1, 2], 0, [0, 1], 0, 0,
+                  [[7.1, 7.2], [1.0, 1.0]])
+        self.assertEqual(len(db), 3)
+        self.assertEqual(list(db.index), [1, 2, 3])
+        self.assertEqual(db[2][:3], [3, 'host', 'other'])
+        self.assertEqual(db.getImageURL(2), 'host/webclient/?show=image-2')
+
+        self.assertRaises(ValueError, db.append,
+                          'host', 'user', 1, 0, 0, 0, 0, [1.0])
+
+    def test_appendGrowth(self):
+        db = ContentDB(['f1', 'f2'])
+        buffers = set()
+        for i in range(1000):
+            db.append('host', 'user', i, 0, 0, 0, 0, [i, -i])
+            buffers.add(id(db._buffers['features']))
+        # the buffers double when full, so they are reallocated few times
+        self.assertTrue(len(buffers) <= 12)
+        self.assertEqual(db.features.shape, (1000, 2))
+        self.assertEqual(list(db.iid), range(1000))
+        self.assertEqual(db.features[-1].tolist(), [999, -999])
+
+        # a column replaced by the caller is copied into a new buffer
+        db.features = db.zscore()
+        db.append('host', 'user', 1000, 0, 0, 0, 0, [0, 0])
+        self.assertEqual(len(db), 1001)
+        self.assertEqual(db.features[-1].tolist(), [0, 0])
+
+        db2 = pickle.loads(pickle.dumps(db, 2))
+        self.assertEqual(db2.features.shape, (1001, 2))
+        db2.append('host', 'user', 1001, 0, 0, 0, 0, [1, 1])
+        self.assertEqual(len(db2), 1002)
+        self.assertEqual(len(db), 1001)
+
+    def test_allocate(self):
+        rows = self.createRows()
+        db = ContentDB.allocate(['f1', 'f2'], 3)
+        self.assertEqual(len(db), 3)
+        # Blocks can be filled in any order
+        db.fill(1, 'host', ['other', 'user'], [2, 1], 0, [1, 0], 0, 0,
+                [rows[1][11:], rows[2][11:]])
+        db.fill(0, 'host', 'user', 1, 0, 0, 0, 0, rows[0][11:])
+        self.assertEqual(db.rows(), rows)
+        self.assertEqual(list(db.getStats()['count']), [3, 3])
+        self.assertRaises(ValueError, db.fill, 2, 'host', 'user', [1, 2],
+                          0, 0, 0, 0, [[0, 0], [0, 0]])
+
+    def test_findLatest(self):
+        db = ContentDB.fromRows(self.createRows(), ['f1', 'f2'])
+        pos = db.findLatest()
+        self.assertEqual(list(pos), [1, 2])
+
+        db = db.take(pos)
+        db.renumber()
+        self.assertEqual(list(db.index), [1, 2])
+        self.assertEqual(db[1][6:], [1, 0, 0, 0, 0, 7.1, 7.2])
+
+    def test_project(self):
+        db = ContentDB.fromRows(self.createRows(), ['f1', 'f2'])
+        db2 = db.project(['f2'])
+        self.assertEqual(db2.feature_ids, ['f2'])
+        self.assertEqual(db2.features.shape, (3, 1))
+        self.assertEqual(db2[0], db[0][:-2] + [5.2])
+        self.assertRaises(ValueError, db.project, ['f3'])
+
+        # contiguous features are a view, others a copy
+        self.assertTrue(numpy.may_share_memory(db2.features, db.features))
+        db3 = db.project(['f2', 'f1'])
+        self.assertEqual(db3[0][-2:], [5.2, 5.1])
+        self.assertFalse(numpy.may_share_memory(db3.features, db.features))
+
+    def test_select(self):
+        db = ContentDB.fromRows(self.createRows(), ['f1', 'f2'])
+        self.assertEqual(list(db.select(iid=1)), [0, 2])
+        self.assertEqual(list(db.select(username='user', channel=0)), [0, 2])
+        self.assertEqual(list(db.select(username='other', channel=0)), [])
+        self.assertEqual(list(db.select(username='nobody')), [])
+        self.assertEqual(list(db.select(iid_in=[2, 1, 5])), [0, 1, 2])
+        self.assertEqual(list(db.select()), [0, 1, 2])
+        self.assertRaises(ValueError, db.select, features=1)
+
+        # Indexes are rebuilt after the DB changes
+        db.append('host', 'other', 1, 0, 0, 0, 0, [0.0, 0.0])
+        self.assertEqual(list(db.select(iid=1)), [0, 2, 3])
+        self.assertEqual(list(db.select(iid=1, username='other')), [3])
+
+    def test_getStats(self):
+        rows = self.createRows()
+        db = ContentDB(['f1', 'f2'])
+        # Add rows in blocks to check the statistics are merged correctly
+        db.append('host', 'user', 1, 0, 0, 0, 0, rows[0][11:])
+        db.append('host', 'user', [2, 1], 0, 0, 0, 0,
+                  [rows[1][11:], rows[2][11:]])
+        feats = numpy.array([r[11:] for r in rows])
+
+        stats = db.getStats()
+        self.assertEqual(list(stats['count']), [3, 3])
+        self.assertTrue(numpy.allclose(stats['mean'], feats.mean(axis=0)))
+        self.assertTrue(numpy.allclose(stats['var'], feats.var(axis=0)))
+        self.assertTrue(numpy.allclose(stats['min'], feats.min(axis=0)))
+        self.assertTrue(numpy.allclose(stats['max'], feats.max(axis=0)))
+
+        z = db.zscore()
+        self.assertTrue(numpy.allclose(
+            z, (feats - feats.mean(axis=0)) / feats.std(axis=0)))
+
+        # Subsets recompute their statistics
+        stats = db.take([0, 2]).getStats()
+        self.assertEqual(list(stats['max']), [7.1, 7.2])
+        stats = db.project(['f2']).getStats()
+        self.assertEqual(stats['feature_ids'], ['f2'])
+        self.assertEqual(list(stats['min']), [1.0])
+
+    def test_pickle(self):
+        db = ContentDB.fromRows(self.createRows(), ['f1', 'f2'])
+        db.watermarks['source'] = 3
+        db2 = pickle.loads(pickle.dumps(db, 2))
+        self.assertEqual(db2.rows(), db.rows())
+        self.assertEqual(db2.feature_ids, ['f1', 'f2'])
+        self.assertEqual(db2.watermarks, {'source': 3})
+        self.assertEqual(db2.take([0]).watermarks, {'source': 3})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
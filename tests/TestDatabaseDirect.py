@@ -38,6 +38,9 @@ import tempfile
 from ClientHelper import ClientHelper
 
 from pyslid.database import direct as pysliddb
+from pyslid.database import link as pyslidlink
+import pyslid.features
+import pyslid.utilities
 from pyslid.utilities import PyslidException
 
 
@@ -58,6 +61,7 @@ class TestDatabaseDirect(ClientHelper):
 
         # Override the OMERO.searcher contentdb path
         pysliddb.set_contentdb_path(self.tempdir)
+        pysliddb.clearNameCache()
 
     def tearDown(self):
         shutil.rmtree(self.tempdir)
@@ -308,6 +312,33 @@ class TestDatabaseDirect(ClientHelper):
             self.gid, str(self.fake_did), self.fake_ftset, 3)
         self.assertEqual(dbn1, dbn3)
 
+    def test_getRecentName_cache(self):
+        ns, dbn1 = pysliddb.initializeNameTag(self.conn, self.fake_ftset)
+        p1 = os.path.join(self.tempdir, dbn1)
+        with open(p1, 'w') as f:
+            pass
+
+        dbn0, dbnx, tag = pysliddb.getRecentName(self.conn, self.fake_ftset)
+        self.assertEqual(dbn0, dbn1)
+
+        # Another client replaces the DB file and updates the tag
+        dbn2 = '%d_%s_%s_content_db_%020d.pkl' % (
+            self.gid, 'all', self.fake_ftset, 2)
+        self.assertEqual(dbnx, dbn2)
+        tag2 = self.conn.getObject('TagAnnotation', unwrap(tag.getId()))._obj
+        tag2.setTextValue(wrap(dbn2))
+        self.conn.getUpdateService().saveObject(tag2)
+        with open(os.path.join(self.tempdir, dbn2), 'w') as f:
+            pass
+
+        # The cached name is still valid while the old file exists
+        dbn0, dbnx, tag = pysliddb.getRecentName(self.conn, self.fake_ftset)
+        self.assertEqual(dbn0, dbn1)
+
+        os.remove(p1)
+        dbn0, dbnx, tag = pysliddb.getRecentName(self.conn, self.fake_ftset)
+        self.assertEqual(dbn0, dbn2)
+
     def noautorun_has(self):
         # Run by test_has_deleteTableLink()
         a, r = pysliddb.has(self.conn, self.fake_ftset, did=None)
@@ -418,9 +449,36 @@ class TestDatabaseDirect(ClientHelper):
         self.assertEqual(d.keys(), ['info'])
 
 
-    @unittest.skip('todo (not used?)')
     def test_updatePerDataset(self):
-        pysliddb.updatePerDataset(conn, server, username, dataset_id_list, featureset, field=True, did=None)
+        iid1, scale, px, ch, z, t, fids, feats, fts = self.createFeatures()
+        iid2 = self.createImageWithRes()
+        pyslid.features.link(self.conn, iid1, scale, fids, feats, fts,
+                             pixels=px, channel=ch, zslice=z, timepoint=t)
+        pyslid.features.linkBatch(self.conn, iid2, 1.0, fids,
+                                  [feats + 1.0, feats + 2.0], fts,
+                                  pixels=[0, 0], channels=[0, 1],
+                                  zslices=[0, 0], timepoints=[0, 0])
+
+        did = pyslid.utilities.createDataset(self.conn, 'test_updatePerDataset')
+        pyslid.utilities.addImage2Dataset(self.conn, iid1, did)
+        pyslid.utilities.addImage2Dataset(self.conn, iid2, did)
+
+        calls = []
+        def progress(done, total, d):
+            calls.append((done, total, d))
+
+        a = pysliddb.updatePerDataset(self.conn, 'host', 'user', [did], fts,
+                                      sessions=2, progress=progress)
+        self.assertTrue(a)
+        self.assertEqual(calls, [(1, 2, did), (2, 2, did)])
+
+        d, m = pysliddb.retrieve(self.conn, fts)
+        self.assertEqual(sorted(k for k in d.keys() if k != 'info'),
+                         [scale, 1.0])
+        self.assertEqual(list(d[scale].iid), [iid1])
+        self.assertEqual(d[scale][0][6:], [iid1, px, ch, z, t, 1.0, 2.0])
+        self.assertEqual(list(d[1.0].iid), [iid2, iid2])
+        self.assertEqual(list(d[1.0].channel), [0, 1])
 
 
     def test_update(self):
@@ -563,10 +621,91 @@ class TestDatabaseDirect(ClientHelper):
         d, m = pysliddb.retrieve(self.conn, self.fake_ftset, did=self.fake_did)
         self.assertEqual(d, [4, 5, 6])
 
+    def test_retrieve_features(self):
+        iid, scale, px, ch, z, t, fids, feats, fts = self.createFeatures()
+        a, m = pysliddb.update(self.conn, 'host', 'user', scale,
+                               iid, px, ch, z, t, fids, feats, fts, did=None)
+        self.assertTrue(a)
+
+        d, m = pysliddb.retrieve(self.conn, self.fake_ftset, did=None,
+                                 features=['f2'])
+        self.assertEqual(m, 'Good')
+        self.assertEqual(len(d[0.5]), 1)
+        self.assertEqual(d[0.5][0][6:], [iid, px, ch, z, t, feats[1]])
 
-    @unittest.skip('todo')
-    def test_retrieveRemote(self):
-        pysliddb.retrieveRemote(conn_local, conn_remote, featureset, did=None)
+        d, m = pysliddb.retrieve(self.conn, self.fake_ftset, did=None,
+                                 features=['f3'])
+        self.assertEqual(d, [])
+
+    def test_getStats(self):
+        iid, scale, px, ch, z, t, fids, feats, fts = zip(
+            self.createFeatures(0, 0.0), self.createFeatures(1, 1.0))
+        scale = scale[0]
+        fids = fids[0]
+        fts = fts[0]
+
+        a, m = pysliddb.updateDataset(self.conn, 'host', 'user', scale,
+                             iid, px, ch, z, t, fids, feats, fts, did=None)
+        self.assertTrue(a)
+
+        s, m = pysliddb.getStats(self.conn, self.fake_ftset, scale, did=None)
+        self.assertEqual(m, 'Good')
+        self.assertEqual(s['feature_ids'], ['f1', 'f2'])
+        self.assertEqual(list(s['count']), [2, 2])
+        self.assertEqual(list(s['mean']), [1.5, 2.5])
+        self.assertEqual(list(s['min']), [1.0, 2.0])
+        self.assertEqual(list(s['max']), [2.0, 3.0])
+
+        s, m = pysliddb.getStats(self.conn, self.fake_ftset, 1.0, did=None)
+        self.assertIsNone(s)
+
+
+    def test_ingest(self):
+        iid1 = self.createImageWithRes(sizeC=2)
+        iid2 = self.createImageWithRes()
+        fts = 'min_max_mean'
+
+        n, failed = pysliddb.ingest(self.conn, 'host', 'user', 1.0,
+                                    [iid1, iid2], fts, batch_size=2)
+        self.assertEqual((n, failed), (3, []))
+
+        d, m = pysliddb.retrieve(self.conn, fts)
+        db = d[1.0]
+        self.assertEqual(db.feature_ids, ['min', 'max', 'mean'])
+        self.assertEqual(list(db.iid), [iid1, iid1, iid2])
+        self.assertEqual(list(db.channel), [0, 1, 0])
+
+        scales = pyslid.features.getScales(self.conn, iid1, fts)
+        self.assertEqual(list(scales), [1.0])
+
+    def test_sync(self):
+        iid, scale, px, ch, z, t, fids, feats, fts = self.createFeatures()
+        did = self.fake_did
+        try:
+            a, m = pyslidlink.update(self.conn, 'host', 'user', iid, px, ch,
+                                     z, t, fids, feats, fts, did=None)
+            self.assertTrue(a)
+
+            n, m = pysliddb.sync(self.conn, fts, scale, did=None)
+            self.assertEqual((n, m), (1, 'Good'))
+            n, m = pysliddb.sync(self.conn, fts, scale, did=None)
+            self.assertEqual((n, m), (0, 'Good'))
+
+            a, m = pyslidlink.update(self.conn, 'host', 'other', iid, px, ch,
+                                     z, t, fids, feats + 1.0, fts, did=None)
+            n, m = pysliddb.sync(self.conn, fts, scale, did=None)
+            self.assertEqual((n, m), (1, 'Good'))
+
+            d, m = pysliddb.retrieve(self.conn, fts, did=None)
+            db = d[scale]
+            self.assertEqual(len(db), 2)
+            self.assertEqual(db.usernames, ['user', 'other'])
+            self.assertEqual(db[1][-2:], [2.0, 3.0])
+        finally:
+            pyslidlink.deleteTableLink(self.conn, fts, did=None)
+
+        n, m = pysliddb.sync(self.conn, fts, scale, did=did)
+        self.assertIsNone(n)
 
 
     def test_processOMEIDs(self):
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import numpy
+import pickle
+import shutil
+import tempfile
+import time
+
+from FakeGateway import FakeGateway
+
+from pyslid import asynchronous
+from pyslid import features
+from pyslid import image
+from pyslid import instrument
+from pyslid import jobs
+from pyslid import objects
+from pyslid import scheduler
+from pyslid import texture
+from pyslid import utilities
+from pyslid.database import content
+from pyslid.database import direct
+from pyslid.database import link
+
+
+
+class TestFakeGateway(unittest.TestCase):
+    """
+    Test pyslid against the in-memory FakeGateway, does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.conn = FakeGateway()
+        planes = numpy.arange(2 * 3 * 4 * 5, dtype=numpy.uint16).reshape(
+            (6, 4, 5))
+        self.iid = self.conn.createImage(planes, sizeZ=3, sizeC=2,
+                                         physical_size=(0.5, 0.5, 1.0))
+        self.planes = planes.reshape((3, 2, 4, 5))
+        self.tempdir = tempfile.mkdtemp(prefix='omero_searcher_content_db-')
+        direct.set_contentdb_path(self.tempdir)
+        direct.clearNameCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_getPlane(self):
+        plane = utilities.getPlane(self.conn, self.iid, 0, 1, 2, 0)
+        self.assertTrue((plane == self.planes[2, 1]).all())
+        self.assertTrue(utilities.hasImage(self.conn, self.iid))
+        self.assertFalse(utilities.hasImage(self.conn, self.iid + 100))
+
+    def test_features(self):
+        ids, feats, scale = features.calculate(
+            self.conn, self.iid, set='min_max_mean', channels=[1], zslice=2)
+        self.assertEqual(list(feats), [
+            self.planes[2, 1].min(), self.planes[2, 1].max(),
+            self.planes[2, 1].mean()])
+
+        self.assertFalse(features.hasTable(self.conn, self.iid,
+                                           'min_max_mean')[0])
+        features.link(self.conn, self.iid, scale, ids, feats, 'min_max_mean',
+                      channel=1, zslice=2)
+        self.assertTrue(features.hasTable(self.conn, self.iid,
+                                          'min_max_mean')[0])
+        self.assertTrue(features.has(self.conn, self.iid, scale,
+                                     'min_max_mean', channel=1, zslice=2))
+
+        r = features.get(self.conn, 'features', self.iid, scale,
+                         'min_max_mean', channel=1, zslice=2)
+        self.assertEqual(r[0], ids)
+        self.assertEqual(r[1], list(feats))
+
+        features.clinkChannels(self.conn, self.iid, set='min_max_mean')
+        r = features.get(self.conn, 'vector', self.iid, set='min_max_mean')
+        self.assertEqual(len(r[1]), 3)
+
+    def test_featureSets(self):
+        rs = numpy.random.RandomState(0)
+        planes = (rs.rand(2, 40, 40) * 4000).astype(numpy.uint16)
+        planes[:, 10:20, 10:20] += 20000
+        iid = self.conn.createImage(planes, sizeC=2,
+                                    physical_size=(0.5, 0.5, 1.0))
+        half = image.resize(planes[0], 0.5)
+
+        ids, feats, scale = features.calculate(
+            self.conn, iid, set='haralick', channels=[0], scale=0.5)
+        self.assertEqual(ids, features.getIds('haralick'))
+        self.assertTrue(numpy.allclose(
+            feats, texture.haralick(texture.quantize(half)).mean(axis=0)))
+
+        ids, feats, scale = features.calculate(
+            self.conn, iid, set='zernike', channels=[0], scale=0.5)
+        self.assertEqual(len(ids), len(feats))
+
+        objects.cache.clear()
+        hits = objects.cache.hits
+        ids, feats, scale = features.calculate(
+            self.conn, iid, set='objects', channels=[0], scale=0.5)
+        self.assertEqual(ids, features.getIds('objects'))
+        self.assertEqual(feats[0], 1)
+        ids, feats, scale = features.calculate(
+            self.conn, iid, set='objects-dna', channels=[0, 1], scale=0.5)
+        self.assertEqual(len(ids), len(feats))
+        # the protein channel was segmented once
+        self.assertEqual(objects.cache.hits, hits + 1)
+        self.assertEqual(len(objects.cache), 2)
+
+        # the segmentations of an image are dropped once it is linked
+        features.clinkChannels(self.conn, self.iid, set='objects')
+        self.assertEqual(len(objects.cache), 2)
+        features.clinkChannels(self.conn, iid, set='objects-dna',
+                               channels=[[0, 1]])
+        self.assertEqual(len(objects.cache), 0)
+
+    def test_scales(self):
+        rs = numpy.random.RandomState(0)
+        planes = (rs.rand(2, 40, 40) * 4000).astype(numpy.uint16)
+        iid = self.conn.createImage(planes, sizeC=2,
+                                    physical_size=(0.5, 0.5, 1.0))
+        scales = [1, 0.5, 0.25]
+
+        timings = instrument.Timings()
+        results = features.calculate(
+            self.conn, iid, set='haralick', channels=[1], timings=timings,
+            scales=scales)
+        self.assertEqual([r[2] for r in results], scales)
+        for r in results:
+            single = features.calculate(
+                self.conn, iid, r[2], set='haralick', channels=[1])
+            self.assertTrue(numpy.allclose(r[1], single[1]))
+        # the plane was downloaded once
+        self.assertTrue('download' in results[0][3]['stages'])
+        self.assertFalse('download' in results[1][3]['stages'])
+        self.assertFalse('download' in results[2][3]['stages'])
+
+        ids, feats, chans = features.clinkChannels(
+            self.conn, iid, set='haralick', scales=scales)
+        self.assertEqual(chans, [0, 0, 0, 1, 1, 1])
+        self.assertEqual(sorted(features.getScales(
+            self.conn, iid, set='haralick')), [0.25, 0.5, 1])
+
+    def test_planes(self):
+        ids, feats, planes = features.clinkPlanes(
+            self.conn, self.iid, set='min_max_mean')
+        self.assertEqual(planes, [(c, z, 0, 1) for z in range(3)
+                                  for c in range(2)])
+        for values, (c, z, t, scale) in zip(feats, planes):
+            plane = self.planes[z, c]
+            self.assertEqual(values, [plane.min(), plane.max(), plane.mean()])
+        table = features.get(self.conn, 'table', self.iid, set='min_max_mean')
+        self.assertEqual(table.getNumberOfRows(), 6)
+
+        # a subset of the planes, calculated in parallel
+        pool = utilities.SessionPool(factory=self.conn.clone, keepalive=0)
+        executor = asynchronous.Executor(self.conn, 3, pool)
+        try:
+            ids, feats2, planes2 = features.clinkPlanes(
+                self.conn, self.iid, set='min_max_mean', zslices=[2, 0],
+                executor=executor, timings=instrument.Timings())
+        finally:
+            executor.shutdown()
+            pool.close()
+        self.assertEqual(planes2, [(c, z, 0, 1) for z in [2, 0]
+                                   for c in range(2)])
+        self.assertEqual(feats2, feats[4:] + feats[:2])
+
+    def test_stack(self):
+        planes = list(utilities.iterPlanes(self.conn, self.iid, channel=1))
+        self.assertEqual(len(planes), 3)
+        for z in range(3):
+            self.assertTrue((planes[z] == self.planes[z, 1]).all())
+
+        stack = self.planes[:, 1].astype(numpy.double)
+        ids, feats, scale = features.calculate(
+            self.conn, self.iid, set='projections', channels=[1])
+        self.assertEqual(ids, features.getIds('projections'))
+        expected = []
+        for projection in [stack.max(axis=0), stack.mean(axis=0),
+                           stack.sum(axis=0)]:
+            expected += [projection.min(), projection.max(),
+                         projection.mean()]
+        self.assertTrue(numpy.allclose(feats, expected))
+
+        ids, feats, scale = features.calculate(
+            self.conn, self.iid, set='stack_min_max_mean', channels=[1])
+        self.assertTrue(numpy.allclose(
+            feats, [stack.min(), stack.max(), stack.mean(), stack.std()]))
+
+        # the stack is calculated once, not once per zslice
+        ids, feats, planes = features.clinkPlanes(
+            self.conn, self.iid, set='stack_min_max_mean')
+        self.assertEqual(planes, [(0, 0, 0, 1), (1, 0, 0, 1)])
+
+    def test_intensity(self):
+        ids, feats, planes = features.clinkPlanes(
+            self.conn, self.iid, set='intensity', scales=[1, 0.5])
+        self.assertEqual(ids, features.getIds('intensity'))
+        self.assertEqual(planes, [(c, z, 0, s) for z in range(3)
+                                  for c in range(2) for s in [1, 0.5]])
+        for values, (c, z, t, scale) in zip(feats, planes):
+            plane = self.planes[z, c].astype(numpy.double)
+            self.assertTrue(numpy.allclose(values, [
+                plane.min(), plane.max(), plane.mean(), plane.std(),
+                plane.sum(), 0]))
+
+        ids, feats, scale = features.calculate(
+            self.conn, self.iid, set='percentiles', channels=[1], zslice=2)
+        self.assertTrue(numpy.allclose(feats, numpy.percentile(
+            self.planes[2, 1], [1, 5, 10, 25, 50, 75, 90, 95, 99])))
+
+    def test_direct(self):
+        fids = ['f1', 'f2']
+        for i in xrange(3):
+            a, m = direct.update(self.conn, 'fake', 'user', 1.0, self.iid,
+                                 0, i, 0, 0, fids, [i, 2 * i], 'test')
+            self.assertTrue(a, m)
+        data, m = direct.retrieve(self.conn, 'test')
+        self.assertEqual(len(data[1.0]), 3)
+        self.assertEqual(list(data[1.0].features[:, 1]), [0, 2, 4])
+
+        # The name tag is found again once the cache is cleared
+        direct.clearNameCache()
+        data, m = direct.retrieve(self.conn, 'test')
+        self.assertEqual(len(data[1.0]), 3)
+
+        data, m = direct.retrieve(self.conn, 'test', normalize=True)
+        self.assertTrue(numpy.allclose(
+            data[1.0].features, [[-1.224745] * 2, [0] * 2, [1.224745] * 2]))
+
+        # The statistics are read without loading the DB
+        a, path = direct.has(self.conn, 'test')
+        with open(path, 'wb') as f:
+            f.write('not a DB')
+        stats, m = direct.getStats(self.conn, 'test', 1.0)
+        self.assertEqual(list(stats['mean']), [1, 2])
+        self.assertEqual(list(stats['max']), [2, 4])
+
+    def test_directLegacy(self):
+        fids = ['f1', 'f2']
+        for vector in [[1], [1, 2, 3]]:
+            a, m = direct.update(self.conn, 'fake', 'user', 1.0, self.iid,
+                                 0, 0, 0, 0, fids, vector, 'test')
+            self.assertFalse(a)
+            a, m = direct.updateDataset(self.conn, 'fake', 'user', 1.0,
+                                        [self.iid], [0], [0], [0], [0], fids,
+                                        [vector], 'test')
+            self.assertFalse(a)
+        data, m = direct.retrieve(self.conn, 'test')
+        self.assertEqual(len(data.get(1.0, [])), 0)
+
+        # DBs saved as lists of rows get the ids of the image feature table
+        ids, feats, planes = features.clinkPlanes(
+            self.conn, self.iid, set='min_max_mean')
+        a, m = direct.update(self.conn, 'fake', 'user', 1.0, self.iid,
+                             0, 0, 0, 0, ids, feats[0], 'min_max_mean')
+        self.assertTrue(a, m)
+        a, path = direct.has(self.conn, 'min_max_mean')
+        rows = [[1, 'fake', 'user', '', '', '', self.iid, 0, c, 0, 0] +
+                list(values) for c, values in enumerate(feats)]
+        with open(path, 'wb') as f:
+            pickle.dump({'info': 'min_max_mean', 1.0: rows}, f)
+        a, m = direct.removeDuplicates(self.conn, 1.0, 'min_max_mean')
+        self.assertTrue(a, m)
+        data, m = direct.retrieve(self.conn, 'min_max_mean', features=['max'])
+        self.assertEqual(data[1.0].feature_ids, ['max'])
+        self.assertEqual(list(data[1.0].features[:, 0]),
+                         [values[1] for values in feats])
+
+    def test_updatePerDataset(self):
+        planes = numpy.ones((2, 4, 5), numpy.uint16)
+        iid2 = self.conn.createImage(planes, sizeC=2)
+        did = self.conn.createDataset(iids=[self.iid, iid2])
+        features.clinkPlanes(self.conn, self.iid, set='min_max_mean')
+        ledger = jobs.Ledger(':memory:')
+        self.assertTrue(direct.updatePerDataset(
+            self.conn, 'fake', 'user', [did], 'min_max_mean', sessions=1,
+            ledger=ledger))
+
+        # the image without a feature table has no rows
+        job = 'updatePerDataset:min_max_mean:True:None'
+        self.assertEqual(ledger.getErrors(job), {str(iid2): 'No feature table'})
+        data, m = direct.retrieve(self.conn, 'min_max_mean')
+        self.assertEqual(list(data[1.0].iid), [self.iid] * 6)
+
+    def test_sync(self):
+        fids = ['f1', 'f2']
+        n = 1005
+        a, m = link.updateDataset(
+            self.conn, 'fake', 'user', range(n), [0] * n, [0] * n, [0] * n,
+            [0] * n, fids, [[i, 2 * i] for i in xrange(n)], 'test')
+        self.assertTrue(a, m)
+
+        # the rows are read in chunks and appended at once
+        calls = []
+        append = content.ContentDB.append
+        def countAppend(db, *args, **kwargs):
+            calls.append(len(db))
+            return append(db, *args, **kwargs)
+        content.ContentDB.append = countAppend
+        try:
+            self.assertEqual(direct.sync(self.conn, 'test', 1.0), (n, 'Good'))
+        finally:
+            content.ContentDB.append = append
+        self.assertEqual(calls, [0])
+        self.assertEqual(direct.sync(self.conn, 'test', 1.0), (0, 'Good'))
+
+        # a new table starts its INDEX again, so its rows are all copied
+        self.assertTrue(link.initialize(self.conn, fids, 'test'))
+        a, m = link.update(self.conn, 'fake', 'user', self.iid, 0, 0, 0, 0,
+                           fids, [7, 8], 'test')
+        self.assertEqual(direct.sync(self.conn, 'test', 1.0), (1, 'Good'))
+        data, m = direct.retrieve(self.conn, 'test')
+        self.assertEqual(len(data[1.0]), n + 1)
+        self.assertEqual(data[1.0][-1][-2:], [7, 8])
+
+    def test_retrieveRemote(self):
+        fids = ['f1', 'f2']
+        n = direct.FIRST_CHUNK_ROWS * 2 + 500
+        a, m = link.updateDataset(
+            self.conn, 'fake', 'user', range(n), [0] * n, [0] * n, [0] * n,
+            [0] * n, fids, [[i, 2 * i] for i in xrange(n)], 'test')
+        self.assertTrue(a, m)
+        self.assertEqual(direct.sync(self.conn, 'test', 1.0), (n, 'Good'))
+        data, m = direct.retrieve(self.conn, 'test')
+
+        for sessions in [1, 4]:
+            pool = utilities.SessionPool(factory=self.conn.clone,
+                                         size=sessions, keepalive=0)
+            try:
+                db, m = direct.retrieveRemote(None, self.conn, 'test',
+                                              sessions=sessions, pool=pool)
+            finally:
+                pool.close()
+            self.assertEqual(m, 'Good')
+            self.assertEqual(len(db), n)
+            self.assertEqual(db.feature_ids, fids)
+            self.assertEqual(list(db.index), range(1, n + 1))
+            self.assertEqual(list(db.iid), list(data[1.0].iid))
+            self.assertTrue((db.features == data[1.0].features).all())
+            self.assertEqual(db.rows(), data[1.0].rows())
+
+    def test_runWorker(self):
+        conn = FakeGateway(latency={'pixels': 0.1})
+        iid = conn.createImage(numpy.ones((2, 4, 5), numpy.uint16), sizeC=2)
+        iid2 = conn.createImage(numpy.ones((4, 5), numpy.uint16))
+        did = conn.createDataset(iids=[iid, iid2])
+        self.assertEqual(scheduler.listImages(conn, dids=[did, did]),
+                         [iid, iid2])
+
+        queue = jobs.WorkQueue(':memory:', max_attempts=2)
+        self.assertEqual(scheduler.enqueue(conn, queue, dids=[did]), 2)
+
+        # reading the planes takes several heartbeats
+        renewed = []
+        heartbeat = queue.heartbeat
+        def countHeartbeat(worker, items):
+            renewed.extend(items)
+            return heartbeat(worker, items)
+        queue.heartbeat = countHeartbeat
+        # the second image has no channel 1, so it fails on every attempt
+        n = scheduler.runWorker(conn, queue, set='min_max_mean',
+                                channels=[[0], [1]], worker='w',
+                                heartbeat=0.02, poll=0.01)
+        self.assertEqual(n, 1)
+        self.assertTrue(str(iid) in renewed)
+        self.assertEqual(queue.getCounts(), {jobs.PENDING: 0, jobs.LEASED: 0,
+                                             jobs.DONE: 1, jobs.FAILED: 1})
+        errors = queue.getErrors()
+        self.assertEqual(errors.keys(), [str(iid2)])
+        self.assertTrue('out of bounds' in errors[str(iid2)])
+        self.assertTrue(features.hasTable(conn, iid, 'min_max_mean')[0])
+
+    def test_latency(self):
+        conn = FakeGateway(latency={'gateway': 0.05})
+        iid = conn.createImage(numpy.zeros((4, 4)))
+        start = time.time()
+        self.assertTrue(conn.clone().getObject('Image', iid) is not None)
+        self.assertTrue(time.time() - start >= 0.05)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,8 +34,13 @@ from numpy import array
 from ClientHelper import ClientHelper
 import re
 import numpy
+import os
+import tempfile
 
 from pyslid import features
+from pyslid import instrument
+from pyslid import jobs
+from pyslid import utilities
 from pyslid.utilities import PyslidException
 
 
@@ -150,6 +155,70 @@ class TestFeatures(ClientHelper):
         self.assertIsNotNone(t)
         self.checkFeaturesTable(t)
 
+    def test_linkBatch(self):
+        iid = self.createImageWithRes()
+        fids = ['f1', 'f2']
+        feats = [[1.0, 2.0], [3.0, 4.0]]
+        r = features.linkBatch(self.conn, iid, 0.5, fids, feats,
+                               self.fake_ftset, pixels=[0, 0], channels=[0, 1],
+                               zslices=[0, 0], timepoints=[0, 0])
+        self.assertTrue(r)
+
+        t = features.get(self.conn, 'table', iid, set=self.fake_ftset)
+        self.assertEqual(t.getNumberOfRows(), 2)
+        self.assertEqual([c.values for c in t.readCoordinates([0, 1]).columns],
+                         [[0L, 0L], [0L, 1L], [0L, 0L], [0L, 0L], [0.5, 0.5],
+                          [1.0, 3.0], [2.0, 4.0]])
+        t.close()
+
+        self.assertRaises(PyslidException, features.linkBatch,
+                          self.conn, iid, 0.5, fids, feats, self.fake_ftset,
+                          pixels=[0], channels=[0], zslices=[0],
+                          timepoints=[0])
+
+    def test_calculateOnDataset(self):
+        iid1 = self.createImageWithRes(sizeC=2)
+        iid2 = self.createImageWithRes()
+        did = utilities.createDataset(self.conn, 'test_calculateOnDataset')
+        utilities.addImage2Dataset(self.conn, iid1, did)
+        utilities.addImage2Dataset(self.conn, iid2, did)
+
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            ledger = jobs.Ledger(path)
+            r = features.calculateOnDataset(self.conn, did, 'min_max_mean',
+                                            ledger=ledger)
+            self.assertEqual(r, [2, 2])
+            t = features.get(self.conn, 'table', iid1, set='min_max_mean')
+            self.assertEqual(t.getNumberOfRows(), 2)
+            t.close()
+
+            # Done images are skipped
+            r = features.calculateOnDataset(self.conn, did, 'min_max_mean',
+                                            ledger=ledger)
+            self.assertEqual(r, [2, 0])
+            ledger.close()
+        finally:
+            os.remove(path)
+
+    def test_calculate_timings(self):
+        iid = self.createImageWithRes(sizeC=2)
+        timings = instrument.Timings()
+        r = features.calculate(self.conn, iid, set='min_max_mean',
+                               channels=[0], timings=timings)
+        self.assertEqual(len(r), 4)
+        self.assertEqual(r[3]['iid'], iid)
+        self.assertEqual(sorted(r[3]['stages'].keys()),
+                         ['download', 'features', 'metadata'])
+        self.assertTrue(r[3]['peak_bytes'] > 0)
+
+        features.clinkChannels(self.conn, iid, set='min_max_mean',
+                               timings=timings)
+        summary = timings.summary()
+        self.assertEqual(summary['images'], 3)
+        self.assertTrue('link' in summary['stages'])
+
     def test_getScales(self):
         iid = self.createImageWithRes()
         filename = 'iid-%d_feature-%s_field.h5' % (iid, self.fake_ftset)
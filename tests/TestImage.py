@@ -28,6 +28,7 @@ if sys.version_info < (2, 7):
 else:
     import unittest
 from ClientHelper import ClientHelper
+import numpy
 import omero
 
 from pyslid import image
@@ -59,6 +60,77 @@ class TestImage(ClientHelper):
         self.assertEqual(r, [0., 0., 0.])
 
 
+class TestResize(unittest.TestCase):
+    """
+    Test pyslid.image.resize, does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.rs = numpy.random.RandomState(3)
+
+    def test_downscale(self):
+        plane = self.rs.randint(0, 65535, (8, 12)).astype(numpy.uint16)
+        r = image.resize(plane, 0.5)
+        self.assertEqual(r.dtype, numpy.uint16)
+        self.assertEqual(r.shape, (4, 6))
+        self.assertTrue((r == numpy.rint(
+            plane.reshape((4, 2, 6, 2)).mean(axis=3).mean(axis=1))).all())
+
+        # each output pixel is the mean over its area
+        plane = self.rs.rand(5, 4)
+        r = image.resize(plane, 0.4)
+        self.assertEqual(r.shape, (2, 1))
+        rows = numpy.array([plane[0] + plane[1] + 0.5 * plane[2],
+                            0.5 * plane[2] + plane[3] + plane[4]]) / 2.5
+        self.assertTrue(numpy.allclose(
+            r[:, 0], (rows[:, :2].sum(axis=1) + 0.5 * rows[:, 2]) / 2.5))
+
+    def test_upscale(self):
+        plane = self.rs.rand(4, 6)
+        r = image.resize(plane, 2.5)
+        self.assertEqual(r.shape, (10, 15))
+        self.assertTrue(plane.min() <= r.min() and r.max() <= plane.max())
+        r = image.resize(numpy.ones((3, 3), numpy.uint8) * 7, 2)
+        self.assertTrue((r == 7).all())
+
+    def test_out(self):
+        plane = self.rs.rand(6, 6)
+        self.assertTrue(image.resize(plane, 1) is plane)
+        out = numpy.empty((3, 3))
+        self.assertTrue(image.resize(plane, 0.5, out) is out)
+        self.assertTrue(numpy.allclose(
+            out, plane.reshape((3, 2, 3, 2)).mean(axis=3).mean(axis=1)))
+        self.assertRaises(image.PyslidException, image.resize, plane, 0.4,
+                          out)
+        self.assertRaises(image.PyslidException, image.resize, plane, 0)
+
+
+
+class TestStackAccumulator(unittest.TestCase):
+    """
+    Test pyslid.image.StackAccumulator, does not need an OMERO server
+    """
+
+    def test_add(self):
+        stack = numpy.random.RandomState(5).randint(0, 1000, (4, 6, 5))
+        acc = image.StackAccumulator()
+        self.assertRaises(image.PyslidException, acc.getStats)
+        for plane in stack:
+            acc.add(plane)
+        self.assertEqual(acc.count, 4)
+        self.assertTrue((acc.maxProjection == stack.max(axis=0)).all())
+        self.assertTrue((acc.minProjection == stack.min(axis=0)).all())
+        self.assertTrue(numpy.allclose(acc.sumProjection, stack.sum(axis=0)))
+        self.assertTrue(numpy.allclose(acc.meanProjection(),
+                                       stack.mean(axis=0)))
+        stats = acc.getStats()
+        self.assertEqual((stats['min'], stats['max']),
+                         (stack.min(), stack.max()))
+        self.assertAlmostEqual(stats['mean'], stack.mean())
+        self.assertAlmostEqual(stats['std'], stack.std())
+        self.assertRaises(image.PyslidException, acc.add,
+                          numpy.zeros((3, 3)))
+
 
 if __name__ == '__main__':
     unittest.main()
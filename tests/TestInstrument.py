@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import logging
+import numpy
+import omero
+import omero.grid
+
+from FakeGateway import FakeGateway
+
+from pyslid import instrument
+
+
+class TestInstrument(unittest.TestCase):
+    """
+    Test pyslid.instrument against the in-memory FakeGateway, does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.gateway = FakeGateway()
+        self.iid = self.gateway.createImage(numpy.zeros((2, 4), numpy.uint16))
+        table = self.gateway.getSharedResources().newTable(1, 'test.h5')
+        table.initialize([omero.grid.LongColumn('INDEX', '', []),
+                          omero.grid.StringColumn('name', '', 2, [])])
+        table.addData([omero.grid.LongColumn('INDEX', '', range(10)),
+                       omero.grid.StringColumn('name', '', 2, ['ab'] * 10)])
+        self.ofile = table.getOriginalFile()
+
+    def test_counts(self):
+        conn = instrument.instrument(self.gateway)
+        self.assertTrue(conn.getConnection() is self.gateway)
+        conn.getObject('Image', self.iid)
+
+        table = conn.getSharedResources().openTable(self.ofile)
+        table.read([0, 1], 0, 10)
+        table.addData([omero.grid.DoubleColumn('f', '', [1.0, 2.0])])
+
+        store = conn.createRawPixelsStore()
+        store.setPixelsId(self.iid, False)
+        self.assertEqual(len(store.getPlane(0, 0, 0)), 16)
+        self.assertRaises(KeyError, store.setPixelsId, self.iid + 100, False)
+
+        calls = conn.stats.snapshot()['calls']
+        self.assertEqual(sorted(calls.keys()), [
+            'gateway.createRawPixelsStore', 'gateway.getObject',
+            'gateway.getSharedResources', 'rawPixelsStore.getPlane',
+            'rawPixelsStore.setPixelsId', 'sharedResources.openTable',
+            'table.addData', 'table.read'])
+        self.assertEqual(calls['table.read']['count'], 1)
+        self.assertEqual(calls['table.read']['bytes'], 10 * 8 + 10 * 2)
+        self.assertEqual(calls['table.addData']['bytes'], 16)
+        self.assertEqual(calls['rawPixelsStore.getPlane']['bytes'], 16)
+        self.assertEqual(calls['rawPixelsStore.setPixelsId']['count'], 2)
+        self.assertEqual(calls['rawPixelsStore.setPixelsId']['errors'], 1)
+        for m in calls.values():
+            self.assertTrue(0 <= m['p50'] <= m['p90'] <= m['max'])
+
+        self.assertTrue('table.read=1/' in conn.stats.summary())
+        conn.stats.reset()
+        self.assertEqual(conn.stats.snapshot()['calls'], {})
+
+    def test_caller(self):
+        conn = instrument.instrument(self.gateway)
+        # Calls are attributed to the innermost pyslid function
+        scope = {'__name__': 'pyslid.fake', 'conn': conn}
+        exec 'def hasTable():\n    return conn.getObject("Image", 1)' in scope
+        scope['hasTable']()
+        conn.getObject('Image', 1)
+
+        callers = conn.stats.snapshot()['callers']
+        self.assertEqual(callers['pyslid.fake.hasTable']['count'], 1)
+        self.assertEqual(callers['other']['count'], 1)
+
+        # Wrapping again shares the statistics
+        conn2 = instrument.instrument(conn, conn.stats)
+        conn2.getObject('Image', 2)
+        self.assertEqual(
+            conn.stats.snapshot()['calls']['gateway.getObject']['count'], 3)
+
+    def test_logging(self):
+        stats = instrument.Stats()
+        stats.record('query.findByQuery', 'other', 0.5)
+        lines = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                lines.append(record.getMessage())
+        logger = logging.getLogger('TestInstrument')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(Handler())
+        stats.startLogging(0.05, logger)
+        import time
+        time.sleep(0.3)
+        stats.stopLogging()
+        self.assertTrue(lines)
+        self.assertTrue(lines[0].startswith('query.findByQuery=1/0.500s'))
+
+
+class TestTimings(unittest.TestCase):
+    """
+    Test pyslid.instrument.Timings, does not need an OMERO server
+    """
+
+    def test_timings(self):
+        timings = instrument.Timings()
+        for iid in [1, 2]:
+            record = timings.start(iid)
+            with timings.stage('download'):
+                a = numpy.zeros((10, 10))
+            timings.track(a)
+            with timings.stage('features'):
+                # arrays are counted once, and until they are freed
+                b = a + 1
+                timings.track(a, b)
+                del b
+                c = numpy.zeros((10, 10))
+                timings.track(c, c)
+                numpy.linalg.svd(numpy.ones((200, 200)))
+            self.assertEqual(record['bytes'], 2 * 800)
+            del a, c
+            self.assertEqual(record['bytes'], 0)
+        self.assertEqual(record['iid'], 2)
+        self.assertEqual(record['peak_bytes'], 2 * 800)
+        self.assertTrue(record['stages']['features']['wall'] > 0)
+
+        summary = timings.summary()
+        self.assertEqual(summary['images'], 2)
+        self.assertEqual(summary['peak_bytes'], 2 * 800)
+        self.assertEqual(sorted(summary['stages'].keys()),
+                         ['download', 'features'])
+        fractions = [s['fraction'] for s in summary['stages'].values()]
+        self.assertAlmostEqual(sum(fractions), 1.0)
+
+        # Failures are still timed
+        def fail():
+            with timings.stage('resize'):
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertTrue('resize' in record['stages'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import numpy
+
+from pyslid import intensity
+from pyslid.utilities import PyslidException
+
+
+class TestIntensity(unittest.TestCase):
+    """
+    Test pyslid.intensity against numpy, does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.rs = numpy.random.RandomState(7)
+
+    def expected(self, plane, saturation):
+        plane = plane.astype(numpy.double)
+        values = [plane.min(), plane.max(), plane.mean(), plane.std(),
+                  plane.sum(), (plane == saturation).mean()]
+        return values + list(numpy.percentile(plane, intensity.PERCENTILES))
+
+    def test_features(self):
+        for dtype, saturation in [(numpy.uint8, 255), (numpy.uint16, 65535)]:
+            plane = self.rs.randint(0, 300, (17, 23)).clip(
+                0, saturation).astype(dtype)
+            plane[0, :3] = saturation
+            feats = numpy.concatenate([
+                intensity.features(plane, 'intensity'),
+                intensity.features(plane, 'percentiles')])
+            self.assertTrue(numpy.allclose(
+                feats, self.expected(plane, saturation)))
+        self.assertEqual(list(intensity.features(plane, 'min_max_mean')),
+                         [plane.min(), plane.max(), plane.mean()])
+
+        # 12 bit images saturate below the largest value of the type
+        feats = intensity.features(plane, saturation=plane.max())
+        self.assertEqual(feats[5], (plane == plane.max()).mean())
+
+    def test_reductions(self):
+        plane = self.rs.rand(9, 11) * 100
+        feats = numpy.concatenate([
+            intensity.features(plane, 'intensity'),
+            intensity.features(plane, 'percentiles')])
+        self.assertTrue(numpy.allclose(
+            feats, self.expected(plane, plane.max())))
+
+    def test_batch(self):
+        planes = self.rs.randint(0, 1000, (intensity.CHUNK + 5, 6, 7)).astype(
+            numpy.uint16)
+        planes[3] = 12
+        feats = intensity.features(planes, 'percentiles')
+        self.assertEqual(feats.shape, (len(planes), len(intensity.PERCENTILES)))
+        for plane, values in zip(planes, feats):
+            self.assertTrue(numpy.allclose(
+                values, numpy.percentile(plane, intensity.PERCENTILES)))
+        self.assertTrue((feats[3] == 12).all())
+
+        # planes of several types, from an iterator
+        mixed = [planes[0], planes[1].astype(numpy.uint8),
+                 planes[2].astype(numpy.double)]
+        feats = intensity.features(iter(mixed), 'min_max_mean')
+        self.assertEqual(feats.shape, (3, 3))
+        for plane, values in zip(mixed, feats):
+            self.assertTrue(numpy.allclose(
+                values, [plane.min(), plane.max(), plane.mean()]))
+
+        self.assertRaises(PyslidException, intensity.features, planes, 'slf33')
+
+    def test_histogram(self):
+        plane = self.rs.randint(0, 256, (8, 10)).astype(numpy.uint8)
+        hist = intensity.histogram(plane[:4])
+        hist = intensity.histogram(plane[4:], hist)
+        self.assertEqual(hist.shape, (256,))
+        self.assertTrue((hist == intensity.histogram(plane)).all())
+        stats = intensity.histogramStats(hist)
+        self.assertEqual(stats['integrated_intensity'][0], plane.sum())
+        self.assertEqual(stats['percentile_50'][0], numpy.median(plane))
+
+        self.assertRaises(PyslidException, intensity.histogram,
+                          plane.astype(numpy.int16))
+        self.assertRaises(PyslidException, intensity.histogramStats,
+                          numpy.zeros((2, 256)))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+from pyslid import jobs
+
+
+
+class TestLedger(unittest.TestCase):
+    """
+    Test pyslid.jobs.Ledger, does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='pyslid_jobs-')
+        self.path = os.path.join(self.tempdir, 'ledger.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_states(self):
+        ledger = jobs.Ledger(self.path)
+        self.assertEqual(ledger.add('job', [1, 2, 3]), 3)
+        self.assertEqual(ledger.add('job', [3, 4]), 1)
+        self.assertEqual(ledger.add('other', [1]), 1)
+
+        ledger.markDone('job', [1, 3])
+        ledger.markFailed('job', [2], 'no table')
+        self.assertEqual(ledger.getItems('job'), ['1', '2', '3', '4'])
+        self.assertEqual(ledger.getItems('job', jobs.DONE), ['1', '3'])
+        self.assertEqual(ledger.getRemaining('job'), ['2', '4'])
+        self.assertEqual(ledger.getErrors('job'), {'2': 'no table'})
+        self.assertEqual(ledger.getCounts('job'),
+                         {jobs.PENDING: 1, jobs.DONE: 2, jobs.FAILED: 1})
+        self.assertEqual(ledger.getRemaining('other'), ['1'])
+
+        # Adding items again doesn't change their state
+        ledger.add('job', [1, 2])
+        self.assertEqual(ledger.getRemaining('job'), ['2', '4'])
+
+    def test_resume(self):
+        ledger = jobs.Ledger(self.path)
+        ledger.add('job', [1, 2])
+        ledger.markDone('job', [1])
+        ledger.close()
+
+        ledger = jobs.Ledger(self.path)
+        self.assertEqual(ledger.getRemaining('job'), ['2'])
+        ledger.markDone('job', [2])
+        self.assertEqual(ledger.getRemaining('job'), [])
+        ledger.close()
+
+
+
+class TestWorkQueue(unittest.TestCase):
+    """
+    Test pyslid.jobs.WorkQueue, does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='pyslid_jobs-')
+        self.path = os.path.join(self.tempdir, 'queue.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_lease(self):
+        queue = jobs.WorkQueue(self.path)
+        self.assertEqual(queue.put([1, 2, 3]), 3)
+        self.assertEqual(queue.put([3]), 0)
+
+        self.assertEqual(queue.lease('a', 2), ['1', '2'])
+        self.assertEqual(queue.lease('b', 2), ['3'])
+        self.assertEqual(queue.lease('b', 2), [])
+
+        self.assertTrue(queue.complete('a', '1', '3'))
+        self.assertFalse(queue.complete('b', '2'))
+        self.assertEqual(queue.heartbeat('a', ['1', '2', '3']), ['2'])
+        self.assertTrue(queue.fail('b', '3', 'error'))
+
+        self.assertEqual(queue.getCounts(), {jobs.PENDING: 1, jobs.LEASED: 1,
+                                             jobs.DONE: 1, jobs.FAILED: 0})
+        self.assertEqual(queue.lease('b', 2), ['3'])
+
+    def test_expire(self):
+        queue = jobs.WorkQueue(self.path, lease_seconds=-1, max_attempts=2)
+        queue.put([1])
+        self.assertEqual(queue.lease('a'), ['1'])
+        # The lease has already expired, so the item can be leased again
+        self.assertEqual(queue.heartbeat('a', ['1']), [])
+        self.assertEqual(queue.lease('b'), ['1'])
+        self.assertFalse(queue.complete('a', '1'))
+
+        # ... but only max_attempts times
+        self.assertEqual(queue.lease('c'), [])
+        self.assertEqual(queue.getCounts()[jobs.FAILED], 1)
+        self.assertEqual(queue.getErrors(), {'1': 'Lease expired'})
+
+    def test_shared(self):
+        queue1 = jobs.WorkQueue(self.path)
+        queue2 = jobs.WorkQueue(self.path)
+        queue1.put(range(10))
+        self.assertEqual(len(queue1.lease('a', 6)), 6)
+        self.assertEqual(len(queue2.lease('b', 6)), 4)
+        self.assertEqual(queue1.getCounts()[jobs.LEASED], 10)
+
+    def test_serve(self):
+        s = socket.socket()
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+        s.close()
+
+        queue = jobs.WorkQueue(self.path)
+        thread = threading.Thread(target=jobs.serve,
+                                  args=(queue, 'localhost', port))
+        thread.daemon = True
+        thread.start()
+
+        remote = jobs.connect('localhost', port)
+        for i in range(50):
+            try:
+                remote.getCounts()
+                break
+            except socket.error:
+                threading.Event().wait(0.1)
+        self.assertEqual(remote.put([1, 2]), 2)
+        self.assertEqual(remote.lease('a', 1), ['1'])
+        self.assertEqual(remote.heartbeat('a', ['1']), ['1'])
+        self.assertTrue(remote.complete('a', '1', ''))
+        self.assertEqual(queue.getCounts()[jobs.DONE], 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import mahotas
+import numpy
+import scipy.ndimage
+
+from pyslid import objects
+from pyslid import utilities
+
+
+class TestObjects(unittest.TestCase):
+    """
+    Test pyslid.objects, does not need an OMERO server
+    """
+
+    def setUp(self):
+        rs = numpy.random.RandomState(1)
+        self.img = (scipy.ndimage.gaussian_filter(rs.rand(80, 90), 3) *
+                    1000).astype(numpy.uint16)
+
+    def test_threshold(self):
+        self.assertAlmostEqual(objects.threshold(self.img),
+                               mahotas.thresholding.rc(self.img))
+        img = numpy.zeros((5, 5), numpy.uint8)
+        img[:2] = [[3], [9]]
+        self.assertAlmostEqual(objects.threshold(img),
+                               mahotas.thresholding.rc(img))
+        self.assertEqual(objects.threshold(img[2:]), 0)
+        self.assertAlmostEqual(objects.threshold(self.img / 8.),
+                               mahotas.thresholding.rc(self.img) / 8., 0)
+
+    def test_regionStats(self):
+        labels, n = objects.segment(self.img)
+        self.assertTrue(n > 1)
+        stats = objects.regionStats(labels, n, self.img)
+        index = numpy.arange(1, n + 1)
+        cm = numpy.array(scipy.ndimage.center_of_mass(
+            self.img.astype(numpy.double), labels, index))
+        self.assertTrue(numpy.allclose(stats['cy'], cm[:, 0]))
+        self.assertTrue(numpy.allclose(stats['cx'], cm[:, 1]))
+        self.assertTrue(numpy.allclose(
+            stats['area'], scipy.ndimage.sum(labels > 0, labels, index)))
+        self.assertTrue(numpy.allclose(
+            stats['mass'], scipy.ndimage.sum(self.img, labels, index)))
+
+    def test_objectFeatures(self):
+        # one object with one hole
+        ring = numpy.zeros((9, 9))
+        ring[2:7, 2:7] = 5
+        ring[4, 4] = 0
+        labels, n = objects.segment(ring, 1)
+        values = objects.objectFeatures(ring, labels, n)
+        self.assertEqual(len(values), len(objects.NAMES))
+        self.assertEqual(values[:4], [1, 0, 24, 0])
+
+        labels, n = objects.segment(self.img)
+        values = objects.objectFeatures(self.img, labels, n, self.img,
+                                        labels)
+        self.assertEqual(len(values),
+                         len(objects.NAMES) + len(objects.DNA_NAMES))
+        self.assertEqual(values[0], n)
+        self.assertEqual(values[-3:], [0, 1, 1])
+
+    def test_slf(self):
+        # SLF1.1-SLF1.8 and SLF2.17-SLF2.22 from their definitions, with the
+        # mahotas primitives pyslic computes them with
+        labels, n = objects.segment(self.img)
+        dna = numpy.roll(self.img, 7, 1)
+        dna_labels = objects.segment(dna)[0]
+        values = dict(zip(objects.IDS + objects.DNA_IDS,
+                          objects.objectFeatures(self.img, labels, n, dna,
+                                                 dna_labels)))
+        mask = labels > 0
+        sizes = mahotas.labeled.labeled_size(labels)[1:]
+        centers = mahotas.center_of_mass(self.img, labels)[1:]
+        cof = mahotas.center_of_mass(self.img)
+        dna_cof = mahotas.center_of_mass(dna)
+        distances = numpy.sqrt(((centers - cof) ** 2).sum(1))
+        dna_distances = numpy.sqrt(((centers - dna_cof) ** 2).sum(1))
+        expected = {
+            'SLF1.1': n,
+            'SLF1.2': mahotas.euler(numpy.pad(mask, 1, 'constant'), 8),
+            'SLF1.3': sizes.mean(),
+            'SLF1.4': sizes.var(),
+            'SLF1.5': float(sizes.max()) / sizes.min(),
+            'SLF1.6': distances.mean(),
+            'SLF1.7': distances.var(),
+            'SLF1.8': distances.max() / distances.min(),
+            'SLF2.17': dna_distances.mean(),
+            'SLF2.18': dna_distances.var(),
+            'SLF2.19': dna_distances.max() / dna_distances.min(),
+            'SLF2.20': numpy.sqrt(((cof - dna_cof) ** 2).sum()),
+            'SLF2.21': mask.sum() / float((dna_labels > 0).sum()),
+            'SLF2.22': self.img[mask & (dna_labels > 0)].sum() /
+                       float(self.img[mask].sum()),
+            }
+        self.assertEqual(sorted(values), sorted(expected))
+        for k in expected:
+            self.assertAlmostEqual(values[k], expected[k], 7, k)
+
+    def test_cache(self):
+        cache = utilities.ArrayCache(100)
+        self.assertTrue(cache.put('a', (numpy.zeros(5),)))
+        self.assertTrue(cache.put('b', (numpy.zeros(5),)))
+        self.assertEqual(cache.nbytes, 80)
+        self.assertTrue(cache.get('a') is not None)
+        # 'b' is the least recently used
+        self.assertTrue(cache.put('c', (numpy.zeros(3),)))
+        self.assertEqual(cache.get('b'), None)
+        self.assertFalse(cache.put('d', (numpy.zeros(20),)))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        self.assertEqual(cache.discard(lambda key: key == 'a'), 1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.nbytes, 24)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
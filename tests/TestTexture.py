@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import mahotas
+import numpy
+
+from pyslid import texture
+from pyslid.utilities import PyslidException
+
+
+class TestTexture(unittest.TestCase):
+    """
+    Test pyslid.texture against mahotas, which pyslic uses for its
+    texture features. Does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.rs = numpy.random.RandomState(4)
+
+    def test_cooccurrence(self):
+        img = numpy.array([[0, 0, 1],
+                           [1, 2, 2]], numpy.uint8)
+        cmats = texture.cooccurrence(img, symmetric=False)
+        self.assertEqual(cmats.shape, (4, 3, 3))
+        # horizontal pairs: (0, 0), (0, 1), (1, 2), (2, 2)
+        self.assertEqual(cmats[0].tolist(),
+                         [[1, 1, 0], [0, 0, 1], [0, 0, 1]])
+        # vertical pairs: (0, 1), (0, 2), (1, 2)
+        self.assertEqual(cmats[2].tolist(),
+                         [[0, 1, 1], [0, 0, 1], [0, 0, 0]])
+        for d, direction in enumerate(texture.DIRECTIONS):
+            expected = mahotas.features.texture.cooccurence(
+                img, d, symmetric=True)
+            self.assertTrue(
+                (texture.cooccurrence(img)[d] == expected).all())
+
+    def test_haralick(self):
+        for shape, levels in [((7, 5), 3), ((30, 40), 16), ((64, 48), 256)]:
+            img = self.rs.randint(0, levels, shape).astype(numpy.uint8)
+            for ignore_zeros in [False, True]:
+                expected = mahotas.features.haralick(img, ignore_zeros)
+                feats = texture.haralick(img, ignore_zeros)
+                self.assertEqual(feats.shape, (4, 13))
+                self.assertTrue(numpy.allclose(feats, expected))
+            expected = mahotas.features.haralick(img, distance=2)
+            self.assertTrue(numpy.allclose(
+                texture.haralick(img, distance=2), expected))
+
+    def test_constant(self):
+        img = numpy.ones((10, 10), numpy.uint8)
+        self.assertTrue(numpy.allclose(
+            texture.haralick(img), mahotas.features.haralick(img)))
+        self.assertRaises(PyslidException, texture.haralick, img - 1,
+                          ignore_zeros=True)
+
+    def test_quantize(self):
+        img = self.rs.randint(0, 200, (8, 8)).astype(numpy.uint8)
+        self.assertTrue(texture.quantize(img) is img)
+
+        img = self.rs.rand(8, 8) * 1000 + 5
+        q = texture.quantize(img, 16)
+        self.assertEqual((q.min(), q.max()), (0, 15))
+        self.assertEqual(texture.quantize(numpy.ones((3, 3)) * 7).max(), 0)
+        self.assertRaises(PyslidException, texture.cooccurrence, img)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import threading
+import time
+
+from ClientHelper import ClientHelper
+
+from pyslid import utilities
+from pyslid.utilities import PyslidException
+
+
+
+class FakeConnection(object):
+    """
+    Stands in for a BlitzGateway in the SessionPool tests
+    """
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.c = self
+
+    def closeSession(self):
+        self.closed = True
+
+    def keepAlive(self):
+        return self.alive
+
+
+class TestSessionPool(unittest.TestCase):
+    """
+    Test pyslid.utilities.SessionPool with fake connections
+    """
+
+    def test_acquire(self):
+        pool = utilities.SessionPool(factory=FakeConnection, size=2,
+                                     keepalive=0)
+        a = pool.acquire()
+        b = pool.acquire()
+        self.assertIsNot(a, b)
+
+        # The pool is full, so this waits for a release
+        got = []
+        t = threading.Thread(target=lambda: got.append(pool.acquire()))
+        t.start()
+        time.sleep(0.05)
+        self.assertEqual(got, [])
+        pool.release(a)
+        t.join()
+        self.assertEqual(got, [a])
+
+        # Closed connections are replaced
+        b.alive = False
+        pool.release(b, failed=True)
+        self.assertTrue(b.closed)
+        c = pool.acquire()
+        self.assertIsNot(c, b)
+
+        pool.release(a)
+        pool.release(c)
+        pool.close()
+        self.assertTrue(a.closed and c.closed)
+        self.assertRaises(PyslidException, pool.acquire)
+
+    def test_get(self):
+        pool = utilities.SessionPool(factory=FakeConnection, size=2,
+                                     keepalive=0)
+        conn = pool.get()
+        self.assertIs(pool.get(), conn)
+
+        other = []
+        t = threading.Thread(target=lambda: other.append(pool.get()))
+        t.start()
+        t.join()
+        self.assertIsNot(other[0], conn)
+
+        pool.releaseThread()
+        with pool.connection() as c:
+            self.assertIs(c, conn)
+        pool.close()
+
+    def test_keepalive(self):
+        pool = utilities.SessionPool(factory=FakeConnection, size=1,
+                                     keepalive=0.01)
+        with pool.connection() as conn:
+            pass
+        conn.alive = False
+        time.sleep(0.1)
+        self.assertTrue(conn.closed)
+        with pool.connection() as c:
+            self.assertIsNot(c, conn)
+        pool.close()
+
+    def test_keepalivePinned(self):
+        pings = []
+        class PingedConnection(FakeConnection):
+            def keepAlive(self):
+                pings.append(self)
+                return self.alive
+        pool = utilities.SessionPool(factory=PingedConnection, size=1,
+                                     keepalive=0.01)
+
+        # a connection pinned to the thread is pinged although not idle
+        conn = pool.get()
+        time.sleep(0.1)
+        self.assertTrue(conn in pings)
+        self.assertIs(pool.get(), conn)
+
+        # ... and replaced by get() once it is found closed
+        conn.alive = False
+        time.sleep(0.1)
+        c = pool.get()
+        self.assertIsNot(c, conn)
+        self.assertTrue(conn.closed)
+        pool.releaseThread()
+        del pings[:]
+        time.sleep(0.1)
+        # released connections are pinged as idle connections
+        self.assertTrue(c in pings)
+        pool.close()
+
+
+class TestSessionPoolServer(ClientHelper):
+    """
+    Test pyslid.utilities.SessionPool with clients joined to a session
+    """
+
+    def test_connection(self):
+        iid = self.createImage()
+        pool = utilities.SessionPool(self.conn, size=2)
+        with pool.connection() as conn:
+            self.assertIsNot(conn, self.conn)
+            self.assertEqual(conn.getObject('Image', iid).getId(), iid)
+        pool.close()
+        self.assertTrue(self.conn.keepAlive())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
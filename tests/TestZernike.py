@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+#
+#
+
+
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+import mahotas
+import numpy
+
+from pyslid import utilities
+from pyslid import zernike
+from pyslid.utilities import PyslidException
+
+
+class TestZernike(unittest.TestCase):
+    """
+    Test pyslid.zernike against mahotas, which pyslic uses for its
+    Zernike features. Does not need an OMERO server
+    """
+
+    def setUp(self):
+        self.rs = numpy.random.RandomState(2)
+        self.cache = zernike.cache
+        zernike.cache = utilities.ArrayCache(zernike.MAX_CACHE_BYTES)
+
+    def tearDown(self):
+        zernike.cache = self.cache
+
+    def test_moments(self):
+        img = self.rs.randint(0, 256, (40, 50)).astype(numpy.uint8)
+        img[:4] = 0
+        self.assertEqual(len(zernike.orders(12)), 49)
+        # by default the circle is centered on the center of mass
+        self.assertTrue(numpy.allclose(zernike.centerOfMass(img),
+                                       mahotas.center_of_mass(img)))
+        expected = mahotas.features.zernike_moments(img, 18, 12)
+        self.assertTrue(numpy.allclose(zernike.moments(img, 18, 12), expected))
+        for center in [(19.5, 24.5), (15.2, 27.6), (3.0, 45.5)]:
+            expected = mahotas.features.zernike_moments(img, 18, 12, cm=center)
+            self.assertTrue(numpy.allclose(
+                zernike.moments(img, 18, 12, center), expected))
+
+        stack = self.rs.randint(0, 256, (3, 40, 50))
+        z = zernike.moments(stack, 18, 8)
+        self.assertEqual(z.shape, (3, 25))
+        for i in xrange(3):
+            self.assertTrue(numpy.allclose(z[i], zernike.moments(
+                stack[i], 18, 8)))
+
+        self.assertRaises(PyslidException, zernike.moments,
+                          numpy.zeros((10, 10)), 5)
+
+    def test_cache(self):
+        # The basis of a degree is shared by all image shapes, radii and centers
+        img = self.rs.rand(30, 30)
+        zernike.moments(img, 15)
+        zernike.moments(img * 2, 10, center=(12.0, 17.5))
+        zernike.moments(self.rs.rand(200, 300), 90)
+        self.assertEqual((zernike.cache.hits, zernike.cache.misses), (2, 1))
+        zernike.moments(img, 15, 8)
+        self.assertEqual(len(zernike.cache), 2)
+        basis = zernike.basis(8)
+        self.assertEqual(basis.shape, (25, 9, 9))
+        self.assertTrue(zernike.basis(8) is basis)
+
+        # Least recently used bases are dropped to stay under the limit
+        zernike.cache.max_bytes = basis.nbytes
+        zernike.moments(img, 15, 6)
+        self.assertEqual(len(zernike.cache), 1)
+        misses = zernike.cache.misses
+        zernike.moments(img, 15, 8)
+        self.assertEqual(zernike.cache.misses, misses + 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()